@@ -1,19 +1,64 @@
-from flask import Flask, render_template, request, send_file, jsonify
+from flask import Flask, render_template, request, send_file, jsonify, Response, url_for, stream_with_context, g
 from flask_cors import CORS
 from PIL import Image
-import io
 import base64
 import os
 import atexit
 import shutil
+import time
+import logging
+import mimetypes
+import functools
+import json
+import math
+from datetime import datetime, timezone
 from werkzeug.utils import secure_filename
-import requests
+from werkzeug.security import safe_join
+from cache import ResultCache, PageCache, make_key, content_digest
+from pipeline import run_pipeline, read_sheet_options, read_output_options, sheet_photo_size, sheet_canvas_cost
+from loader import open_image, decode_image, decode_cost, source_size, read_source, ImageTooLarge, MAX_IMAGE_PIXELS
+from autocrop import auto_crop, NoFaceFound, AutoCropUnavailable, DEFAULT_HEAD_RATIO, DEFAULT_EYE_LINE
+from encoders import mimetype_for, iter_chunks, encode_raster, timed_encode, encoder_profile, UnsupportedFormat
+from jobs import JobQueue, QueueFull, MemoryJobStore, SQLiteJobStore, job_timings
+from removebg import RemoveBgClient, DEFAULT_API_URL
+from segmentation import RemovalError, RemoveBgBackend, LocalBackend
+from preprocess import preprocess_upload
+from batch import BatchError, read_batch_items, stream_zip, build_pdf
+from metrics import registry, stage, start_trace, end_trace, log_request, SQLiteMetricsStore
+from ingest import MemoryBudget, BudgetExceeded, spool_json_image
+from ratelimit import RateLimiter, QuotaLedger, MemoryStore, SQLiteStore, RateLimited, QuotaExhausted
+import assets
+
+logging.basicConfig(
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    format='ts=%(asctime)s level=%(levelname)s logger=%(name)s %(message)s'
+)
+log = logging.getLogger(__name__)
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=[
+    'X-Photos-Count', 'X-Cache',
+    'X-Preprocess-Bytes-Saved', 'X-Preprocess-Ms', 'X-Preprocess-Time-Saved-Ms',
+    'X-Encode-Profile', 'X-Encode-Ms', 'X-Encode-Bytes', 'X-Autocrop-Detector'
+])
 
 # Remove.bg API Configuration
-REMOVEBG_API_KEY = 'wur8bps17aG47SXUxygcPura'
+REMOVEBG_API_KEY = os.environ.get('REMOVEBG_API_KEY', 'wur8bps17aG47SXUxygcPura')
+REMOVEBG_API_URL = os.environ.get('REMOVEBG_API_URL', DEFAULT_API_URL)
+
+removebg_client = RemoveBgClient(
+    REMOVEBG_API_KEY,
+    api_url=REMOVEBG_API_URL,
+    pool_size=int(os.environ.get('REMOVEBG_POOL_SIZE', 10)),
+    max_retries=int(os.environ.get('REMOVEBG_MAX_RETRIES', 3))
+)
+
+# Background removal engines: 'removebg' (remote API) or 'local' (offline, CPU)
+removal_backends = {
+    'removebg': RemoveBgBackend(removebg_client),
+    'local': LocalBackend(),
+}
+REMOVAL_ENGINE = os.environ.get('REMOVAL_ENGINE', 'removebg')
 
 # Security Headers
 @app.after_request
@@ -38,6 +83,24 @@ def set_security_headers(response):
     
     return response
 
+# Per-request timing: route latency histogram + stage breakdown (see metrics.py)
+@app.before_request
+def start_request_timer():
+    g.start_time = time.perf_counter()
+    start_trace()
+
+@app.after_request
+def record_request_metrics(response):
+    if 'start_time' not in g:
+        return response
+    elapsed = time.perf_counter() - g.start_time
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    registry.observe('http_request_duration_seconds', elapsed, route=route)
+    registry.inc('http_requests_total', route=route, method=request.method, status=response.status_code)
+    log_request(route, request.method, response.status_code, elapsed, end_trace())
+    registry.flush()
+    return response
+
 # Configuration
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 app.config['UPLOAD_FOLDER'] = 'uploads'
@@ -48,10 +111,143 @@ DEBUG = os.environ.get('DEBUG', 'False') == 'True'
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Remove.bg results cache (memory + disk under UPLOAD_FOLDER). The memory tier is
+# per worker; the disk directory and its DISK_MB budget are shared by all workers.
+app.config['REMOVEBG_CACHE_MEMORY_MB'] = int(os.environ.get('REMOVEBG_CACHE_MEMORY_MB', 64))
+app.config['REMOVEBG_CACHE_DISK_MB'] = int(os.environ.get('REMOVEBG_CACHE_DISK_MB', 512))
+
+removebg_cache = ResultCache(
+    os.path.join(app.config['UPLOAD_FOLDER'], 'removebg_cache'),
+    memory_limit=app.config['REMOVEBG_CACHE_MEMORY_MB'] * 1024 * 1024,
+    disk_limit=app.config['REMOVEBG_CACHE_DISK_MB'] * 1024 * 1024
+)
+
+# Finished sheets, keyed by upload digest + every layout/output parameter, so
+# regenerating (or toggling back to) the same sheet never touches PIL. The spill
+# directory sits under UPLOAD_FOLDER, so cleanup_uploads() removes it on exit;
+# like removebg_cache, its DISK_MB budget covers all workers together.
+app.config['SHEET_CACHE_MEMORY_MB'] = int(os.environ.get('SHEET_CACHE_MEMORY_MB', 64))
+app.config['SHEET_CACHE_DISK_MB'] = int(os.environ.get('SHEET_CACHE_DISK_MB', 256))
+
+sheet_cache = ResultCache(
+    os.path.join(app.config['UPLOAD_FOLDER'], 'sheet_cache'),
+    memory_limit=app.config['SHEET_CACHE_MEMORY_MB'] * 1024 * 1024,
+    disk_limit=app.config['SHEET_CACHE_DISK_MB'] * 1024 * 1024
+)
+
+# Background removal job queue (async mode of /api/remove-background). Jobs run
+# on the accepting worker's threads; with the sqlite store (default) their status
+# and results are shared, so any gunicorn worker can answer a poll. Finished
+# results are capped by count and bytes. QUEUE_DEPTH counts jobs host-wide.
+app.config['REMOVEBG_JOB_WORKERS'] = int(os.environ.get('REMOVEBG_JOB_WORKERS', 4))
+app.config['REMOVEBG_JOB_QUEUE_DEPTH'] = int(os.environ.get('REMOVEBG_JOB_QUEUE_DEPTH', 16))
+app.config['REMOVEBG_JOB_RESULTS'] = int(os.environ.get('REMOVEBG_JOB_RESULTS', 32))
+app.config['REMOVEBG_JOB_RESULTS_MB'] = int(os.environ.get('REMOVEBG_JOB_RESULTS_MB', 64))
+app.config['JOB_STORAGE'] = os.environ.get('JOB_STORAGE', 'sqlite')
+
+if app.config['JOB_STORAGE'] == 'sqlite':
+    job_store = SQLiteJobStore(os.path.join(app.config['UPLOAD_FOLDER'], 'jobs.db'))
+else:
+    job_store = MemoryJobStore()
+
+removal_jobs = JobQueue(
+    max_workers=app.config['REMOVEBG_JOB_WORKERS'],
+    max_pending=app.config['REMOVEBG_JOB_QUEUE_DEPTH'],
+    max_results=app.config['REMOVEBG_JOB_RESULTS'],
+    max_result_bytes=app.config['REMOVEBG_JOB_RESULTS_MB'] * 1024 * 1024,
+    store=job_store
+)
+
+# /metrics counters and histograms: with the sqlite store (default) every worker
+# writes its own to uploads/metrics.db and a scrape answers host-wide totals;
+# 'memory' reports only the worker that happens to answer. Gauges are per worker.
+app.config['METRICS_STORAGE'] = os.environ.get('METRICS_STORAGE', 'sqlite')
+
+if app.config['METRICS_STORAGE'] == 'sqlite':
+    registry.store = SQLiteMetricsStore(os.path.join(app.config['UPLOAD_FOLDER'], 'metrics.db'))
+
+# Per-worker budget for decoded pixels in flight, shared by all threads (request
+# and job threads; batch uploads and sheet canvases are charged too): a burst
+# of large uploads waits (then gets 503) instead of OOMing the dyno
+app.config['INGEST_MEMORY_BUDGET_MB'] = int(os.environ.get('INGEST_MEMORY_BUDGET_MB', 256))
+
+memory_budget = MemoryBudget(app.config['INGEST_MEMORY_BUDGET_MB'] * 1024 * 1024)
+
+# Per-client token bucket on the remove.bg calls of /api/remove-background (cache
+# misses with engine=removebg) + a local ledger of remove.bg credits spent this
+# month (see ratelimit.py). The sqlite store is shared by
+# every gunicorn worker on the host; 'memory' keeps one count per worker.
+app.config['RATE_LIMIT_BURST'] = int(os.environ.get('RATE_LIMIT_BURST', 5))
+app.config['RATE_LIMIT_PER_MINUTE'] = float(os.environ.get('RATE_LIMIT_PER_MINUTE', 10))
+app.config['RATE_LIMIT_STORAGE'] = os.environ.get('RATE_LIMIT_STORAGE', 'sqlite')
+app.config['RATE_LIMIT_DB'] = os.environ.get('RATE_LIMIT_DB', 'ratelimit.db')
+# X-Forwarded-For entries added by our own proxies (Render adds one); 0 = use the socket address
+app.config['RATE_LIMIT_PROXY_HOPS'] = int(os.environ.get('RATE_LIMIT_PROXY_HOPS', 1))
+app.config['REMOVEBG_MONTHLY_CREDITS'] = float(os.environ.get('REMOVEBG_MONTHLY_CREDITS', 50))
+app.config['REMOVEBG_CREDITS_PER_IMAGE'] = float(os.environ.get('REMOVEBG_CREDITS_PER_IMAGE', 1))
+
+if app.config['RATE_LIMIT_STORAGE'] == 'sqlite':
+    limit_store = SQLiteStore(app.config['RATE_LIMIT_DB'])
+else:
+    limit_store = MemoryStore()
+
+rate_limiter = RateLimiter(
+    limit_store,
+    burst=app.config['RATE_LIMIT_BURST'],
+    per_minute=app.config['RATE_LIMIT_PER_MINUTE']
+)
+credit_ledger = QuotaLedger(limit_store, monthly_limit=app.config['REMOVEBG_MONTHLY_CREDITS'])
+
+# Bundled, fingerprinted CSS/JS (see assets.py): built once at startup,
+# rebuilt on source changes in DEBUG
+asset_manifest = assets.load_manifest()
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+def asset_url(name):
+    """URL of a built bundle; the name carries its content hash, so it can be cached forever"""
+    manifest = assets.load_manifest() if DEBUG else asset_manifest
+    return url_for('hashed_asset', filename=manifest[name])
+
+app.jinja_env.globals['asset_url'] = asset_url
+
+# Rendered pages + sitemap: re-rendered only when a template (or the asset build) changes
+page_cache = PageCache()
+TEMPLATE_DIR = os.path.join(app.root_path, app.template_folder)
+ASSET_MANIFEST = os.path.join(assets.STATIC_DIR, assets.DIST_DIR, assets.MANIFEST)
+
+def cached_page(*templates, mimetype='text/html'):
+    """Serve a GET view from page_cache with ETag/Last-Modified and 304s on revalidation.
+
+    The view must not depend on the request (query string, cookies): it
+    runs once per change to the listed templates.
+    """
+    sources = [os.path.join(TEMPLATE_DIR, name) for name in templates] + [ASSET_MANIFEST]
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            body, etag, last_modified, hit = page_cache.get(request.path, sources, lambda: view(*args, **kwargs))
+            registry.inc('page_cache_total', result='hit' if hit else 'miss')
+            response = Response(body, mimetype=mimetype)
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            # Pages link hashed bundles: let browsers keep them, but revalidate (a cheap 304)
+            response.cache_control.public = True
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+# Process that owns uploads/: with gunicorn --preload that is the master, and
+# workers (forked, recycled by max_requests) must not wipe it when they exit
+UPLOADS_OWNER_PID = os.getpid()
+
 def cleanup_uploads():
+    if os.getpid() != UPLOADS_OWNER_PID:
+        return
     if os.path.exists(app.config['UPLOAD_FOLDER']):
         try:
             shutil.rmtree(app.config['UPLOAD_FOLDER'])
@@ -61,215 +257,568 @@ def cleanup_uploads():
 
 atexit.register(cleanup_uploads)
 
+def wants_raw_response(mimetype):
+    """Opt-in binary responses via ?raw=1 or an Accept header preferring image/*"""
+    if request.args.get('raw') == '1':
+        return True
+    # JSON wins ties, so plain fetch() calls (Accept: */*) keep the old format
+    return request.accept_mimetypes.best_match(['application/json', mimetype]) == mimetype
+
+def image_response(output, mimetype, headers=None, extra=None):
+    """Return encoded image bytes raw (opt-in) or as a base64 data URI in JSON"""
+    if wants_raw_response(mimetype):
+        # Stream straight from the encoded buffer, metadata travels in headers
+        response = Response(iter_chunks(output), mimetype=mimetype, headers=headers)
+        response.headers['Content-Length'] = str(len(output))
+        return response
+
+    with stage('base64'):
+        img_str = base64.b64encode(output).decode()
+    result = {
+        'success': True,
+        'image': f'data:{mimetype};base64,{img_str}'
+    }
+    result.update(extra or {})
+    response = jsonify(result)
+    response.headers.extend(headers or {})
+    return response
+
+def read_image_request():
+    """Read the upload + params from either a multipart upload or base64 JSON.
+
+    The image comes back as a seekable file, never as one big bytes object:
+    multipart parts are spooled by Werkzeug, base64 JSON is decoded straight
+    from the request stream into a spooled temp file.
+    """
+    if 'image' in request.files:
+        return request.files['image'].stream, request.form
+
+    with stage('ingest'):
+        upload, data = spool_json_image(request.stream)
+    if upload is None:
+        raise ValueError('No image provided')
+    g.setdefault('spooled_uploads', []).append(upload)
+    return upload, data
+
+def read_photo_px(data):
+    """Passport photo size in pixels from the width/height (inches) and dpi request fields"""
+    dpi = int(data.get('dpi', 300))
+    width = float(data.get('width', 1.2))
+    height = float(data.get('height', 1.4))
+    if not 72 <= dpi <= 1200:
+        raise ValueError('DPI must be between 72 and 1200')
+    if width <= 0 or height <= 0:
+        raise ValueError('Photo size must be positive')
+    photo_px = (round(width * dpi), round(height * dpi))
+    if photo_px[0] * photo_px[1] > MAX_IMAGE_PIXELS:
+        raise ValueError(f'Photo size is {photo_px[0]}x{photo_px[1]} pixels, '
+                         f'the limit is {MAX_IMAGE_PIXELS // 1_000_000} megapixels')
+    return photo_px
+
+def reserve_memory(nbytes):
+    """Hold nbytes of the worker's memory budget until the request ends"""
+    with stage('memory_wait'):
+        memory_budget.acquire(nbytes)
+    g.reserved_memory = g.get('reserved_memory', 0) + nbytes
+
+@app.teardown_request
+def release_request_memory(exc):
+    memory_budget.release(g.pop('reserved_memory', 0))
+    for upload in g.pop('spooled_uploads', ()):
+        upload.close()
+
+def load_request_image(source, target=None):
+    """Decode an upload (upright, pixel ceiling enforced), no larger than target needs.
+
+    Waits for room in the memory budget before any pixels are allocated.
+    """
+    img = open_image(source)
+    reserve_memory(decode_cost(img, target))
+    with stage('decode'):
+        return decode_image(img, target)
+
+def image_too_large_response(err):
+    return jsonify({
+        'error': 'Image too large',
+        'message': str(err)
+    }), 413
+
+def invalid_request_response(err):
+    """Bad client input (unknown paper, DPI out of range, unparsable number, ...)"""
+    return jsonify({
+        'error': 'Invalid request',
+        'message': str(err)
+    }), 400
+
+def budget_exceeded_response(err):
+    registry.inc('memory_budget_rejections_total')
+    log.warning('memory budget exhausted, rejecting request: %s', err)
+    return jsonify({
+        'error': 'Server busy',
+        'message': 'Too many large images in progress. Please retry shortly.'
+    }), 503, {'Retry-After': '5'}
+
 @app.route('/')
+@cached_page('index.html')
 def index():
     return render_template('index.html')
 
 @app.route('/passport-maker')
+@cached_page('passport_maker.html')
 def passport_maker():
     return render_template('passport_maker.html')
 
 @app.route('/contact')
+@cached_page('contact.html')
 def contact():
     return render_template('contact.html')
 
 @app.route('/about')
+@cached_page('about.html')
 def about():
     return render_template('about.html')
+
+def release_credits(credits, err):
+    """Give back remove.bg credits reserved for a call that never went through"""
+    if not credits:
+        return
+    credit_ledger.refund(credits)
+    if isinstance(err, RemovalError) and err.status_code in (402, 403):
+        # remove.bg says the quota is gone, whatever our count says: stop forwarding
+        credit_ledger.exhaust()
+
+def run_removal(source, quality, cache_key, engine, passport_px, profile, credits=0):
+    """Preprocess, run the segmentation backend, apply the quality tier and cache the PNG result.
+
+    Returns (png_bytes, stats) where stats reports what preprocessing saved
+    and what the PNG encode cost (stats['encode']). credits is what was
+    charged to credit_ledger for this call; it is refunded if the upstream
+    call does not succeed. The decode memory is held in memory_budget for
+    the duration, also when this runs on a job thread outside any request.
+    """
+    upstream_done = False
+    reserved = 0
+    try:
+        cost = decode_cost(open_image(source))
+        with stage('memory_wait'):
+            memory_budget.acquire(cost)
+        reserved = cost
+        
+        # Only send as many pixels as the passport frame can use
+        with stage('preprocess'):
+            upload, target, stats = preprocess_upload(source, passport_px, quality)
+        log.debug('preprocess bytes_in=%s bytes_out=%s target=%sx%s ms=%s',
+                  stats['bytes_in'], stats['bytes_out'], target[0], target[1], stats['preprocess_ms'])
+        
+        start_time = time.perf_counter()
+        with stage('upstream'):
+            img = removal_backends[engine].remove_background(upload)
+        upstream_done = True
+        stats['upstream_ms'] = round((time.perf_counter() - start_time) * 1000, 1)
+        
+        # Upstream time scales with bytes/pixels sent: estimate what the full upload would have cost
+        if stats['bytes_out']:
+            stats['est_time_saved_ms'] = round(
+                stats['upstream_ms'] * stats['bytes_saved'] / stats['bytes_out'] - stats['preprocess_ms'], 1
+            )
+        
+        # Apply quality settings (target already reflects the quality tier): scale the
+        # cutout down to fit, keeping whatever aspect ratio the engine returned
+        scale = min(target[0] / img.width, target[1] / img.height)
+        if scale < 1:
+            with stage('resize'):
+                img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                                 Image.LANCZOS)
+        
+        with stage('encode'):
+            output, stats['encode'] = timed_encode(encode_raster, img, 'png', quality, profile=profile)
+        
+        removebg_cache.put(cache_key, output)
+        return output, stats
+    
+    except RemovalError as e:
+        if not upstream_done:
+            release_credits(credits, e)
+        raise
+    
+    except ImageTooLarge as e:
+        release_credits(credits, e)
+        raise RemovalError(413, 'Image too large', str(e))
+    
+    except BudgetExceeded as e:
+        release_credits(credits, e)
+        raise
+    
+    except Exception as api_error:
+        if not upstream_done:
+            release_credits(credits, api_error)
+        log.exception('background removal failed')
+        raise RemovalError(500, 'Processing error', str(api_error))
+    
+    finally:
+        memory_budget.release(reserved)
+
+def encode_headers(encode_stats):
+    return {
+        'X-Encode-Profile': encode_stats['profile'],
+        'X-Encode-Ms': str(encode_stats['encode_ms']),
+        'X-Encode-Bytes': str(encode_stats['bytes']),
+    }
+
+def preprocess_headers(stats):
+    headers = {
+        'X-Cache': 'MISS',
+        'X-Preprocess-Bytes-Saved': str(stats['bytes_saved']),
+        'X-Preprocess-Ms': str(stats['preprocess_ms']),
+        **encode_headers(stats['encode']),
+    }
+    if 'est_time_saved_ms' in stats:
+        headers['X-Preprocess-Time-Saved-Ms'] = str(stats['est_time_saved_ms'])
+    return headers
+
+def client_id():
+    """Rate-limit identity: the client address as seen by the first of our proxies"""
+    forwarded = request.headers.get('X-Forwarded-For')
+    hops = app.config['RATE_LIMIT_PROXY_HOPS']
+    if hops and forwarded:
+        # Entries left of the ones our proxies appended are client-controlled
+        chain = [address.strip() for address in forwarded.split(',')]
+        return chain[max(0, len(chain) - hops)]
+    return request.remote_addr
+
+def rate_limited_response(err):
+    registry.inc('rate_limited_total', reason='rate')
+    log.info('rate limited client=%s retry_after=%.1f', client_id(), err.retry_after)
+    return jsonify({
+        'error': 'Too many requests',
+        'message': f'Please wait {math.ceil(err.retry_after)} seconds before removing another background.'
+    }), 429, {'Retry-After': str(math.ceil(err.retry_after))}
+
+def quota_exhausted_response(err):
+    registry.inc('rate_limited_total', reason='quota')
+    log.warning('remove.bg credit budget exhausted: %s', err)
+    return jsonify({
+        'error': 'API quota exceeded',
+        'message': 'The monthly background removal limit has been reached. Please try again later.'
+    }), 429, {'Retry-After': str(math.ceil(err.retry_after))}
+
+def removal_error_response(err):
+    return jsonify({
+        'error': err.error,
+        'message': err.message
+    }), err.status_code
+
 @app.route('/api/remove-background', methods=['POST'])
 def remove_background():
-    """Background removal using remove.bg API"""
+    """Background removal using remove.bg API (or the local engine).
+
+    Pass engine=local|removebg to pick the backend (default REMOVAL_ENGINE).
+    Pass async=1 (form field or query string) to enqueue the job and
+    poll /api/jobs/<id> instead of holding the request open.
+    """
     try:
-        print("=" * 50)
-        print("BACKGROUND REMOVAL REQUEST RECEIVED")
-        print("=" * 50)
-        
         if 'image' not in request.files:
-            print("ERROR: No image in request")
             return jsonify({'error': 'No image provided'}), 400
         
         file = request.files['image']
         quality = request.form.get('quality', 'high')
+        run_async = (request.form.get('async') or request.args.get('async')) == '1'
+        engine = request.form.get('engine') or request.args.get('engine') or REMOVAL_ENGINE
+        # Lower tiers have always traded encode CPU for smaller PNGs
+        profile = request.form.get('profile') or request.args.get('profile') or (
+            None if quality == 'high' else 'smallest'
+        )
         
-        print(f"File name: {file.filename}")
-        print(f"Quality: {quality}")
+        # Final passport photo size (inches @ dpi) bounds the resolution worth uploading
+        passport_px = read_photo_px(request.form)
+        
+        if engine not in removal_backends:
+            return jsonify({'error': f'Unknown engine: {engine}'}), 400
+        
+        try:
+            profile = encoder_profile(profile)
+        except UnsupportedFormat as e:
+            return jsonify({'error': 'Invalid profile', 'message': str(e)}), 400
         
         if file.filename == '':
-            print("ERROR: Empty filename")
             return jsonify({'error': 'No selected file'}), 400
         
         if file and allowed_file(file.filename):
-            # Read file
-            file_content = file.read()
-            file_size = len(file_content) / (1024 * 1024)
-            
-            print(f"File size: {file_size:.2f} MB")
-            print(f"API Key present: {bool(REMOVEBG_API_KEY)}")
-            print(f"API Key (first 10 chars): {REMOVEBG_API_KEY[:10]}...")
+            # Werkzeug has spooled the part (to disk when large): work from the file
+            upload = file.stream
+            file_size = source_size(upload) / (1024 * 1024)
             
             # Check file size
             if file_size > 12:
-                print("ERROR: File too large")
                 return jsonify({
                     'error': 'Image too large',
                     'message': 'Please use an image smaller than 12MB'
                 }), 400
             
-            try:
-                print("\n>>> Calling remove.bg API...")
-                print(f">>> Endpoint: https://api.remove.bg/v1.0/removebg")
-                print(f">>> Timeout: 90 seconds")
-                
-                # Call API
-                import time
-                start_time = time.time()
-                
-                response = requests.post(
-                    'https://api.remove.bg/v1.0/removebg',
-                    files={'image_file': file_content},
-                    data={'size': 'auto'},
-                    headers={'X-Api-Key': REMOVEBG_API_KEY},
-                    timeout=90
-                )
-                
-                elapsed_time = time.time() - start_time
-                
-                print(f">>> Response received in {elapsed_time:.2f} seconds")
-                print(f">>> Status Code: {response.status_code}")
-                print(f">>> Response Headers: {dict(response.headers)}")
-                
-                if response.status_code == 200:
-                    print(">>> SUCCESS! Processing image...")
-                    
-                    # Process image
-                    img = Image.open(io.BytesIO(response.content))
-                    print(f">>> Image size: {img.size}")
-                    print(f">>> Image mode: {img.mode}")
-                    
-                    # Apply quality settings
-                    buffered = io.BytesIO()
-                    
-                    if quality == 'high':
-                        img.save(buffered, format="PNG", optimize=False)
-                    elif quality == 'medium':
-                        img = img.resize(
-                            (int(img.width * 0.75), int(img.height * 0.75)), 
-                            Image.LANCZOS
-                        )
-                        img.save(buffered, format="PNG", optimize=True)
-                    else:
-                        img = img.resize(
-                            (int(img.width * 0.5), int(img.height * 0.5)), 
-                            Image.LANCZOS
-                        )
-                        img.save(buffered, format="PNG", optimize=True)
-                    
-                    output_size = len(buffered.getvalue()) / (1024 * 1024)
-                    print(f">>> Output size: {output_size:.2f} MB")
-                    
-                    output_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-                    
-                    print(">>> Sending response to client")
-                    print("=" * 50)
-                    
+            # Same photo + quality -> serve cached result, no API credit spent
+            cache_key = make_key(content_digest(upload), quality, engine, f'{passport_px[0]}x{passport_px[1]}', profile)
+            cached = removebg_cache.get(cache_key)
+            if cached is not None:
+                registry.inc('removal_cache_total', result='hit')
+                # Nothing was encoded for this response; the profile is part of the key
+                encode_stats = {'profile': profile, 'encode_ms': 0, 'bytes': len(cached)}
+                return image_response(cached, 'image/png', headers={'X-Cache': 'HIT', **encode_headers(encode_stats)},
+                                      extra={'encode': encode_stats})
+            
+            registry.inc('removal_cache_total', result='miss')
+            
+            # Only paid calls are limited: cache hits and the local engine cost nothing.
+            # Take the client's token and reserve the credits before anything is forwarded
+            credits = 0
+            if engine == 'removebg':
+                rate_limiter.check(client_id())
+                credits = app.config['REMOVEBG_CREDITS_PER_IMAGE']
+                credit_ledger.charge(credits)
+            
+            if run_async:
+                try:
+                    # The job outlives the request (and its spooled upload)
+                    job_id = removal_jobs.submit(run_removal, read_source(upload), quality, cache_key, engine,
+                                                 passport_px, profile, credits)
+                except QueueFull:
+                    release_credits(credits, None)
+                    log.warning('removal queue full, rejecting request depth=%s', removal_jobs.depth())
                     return jsonify({
-                        'success': True,
-                        'image': f'data:image/png;base64,{output_base64}'
-                    })
+                        'error': 'Server busy',
+                        'message': 'Too many background removals in progress. Please retry shortly.'
+                    }), 429, {'Retry-After': '5'}
                 
-                else:
-                    print(f">>> ERROR: API returned {response.status_code}")
-                    print(f">>> Response body: {response.text[:500]}")
-                    
-                    if response.status_code == 403:
-                        return jsonify({
-                            'error': 'API quota exceeded',
-                            'message': 'Free API limit (50 images/month) reached.'
-                        }), 403
-                    elif response.status_code == 402:
-                        return jsonify({
-                            'error': 'Credits exhausted',
-                            'message': 'Remove.bg API credits used up.'
-                        }), 402
-                    else:
-                        return jsonify({
-                            'error': 'API error',
-                            'message': f'Service error: {response.status_code}'
-                        }), response.status_code
-                    
-            except requests.exceptions.Timeout as timeout_err:
-                print(f">>> TIMEOUT ERROR: {str(timeout_err)}")
+                log.debug('queued removal job %s engine=%s', job_id, engine)
                 return jsonify({
-                    'error': 'Request timeout',
-                    'message': 'Processing took too long. Try smaller image.'
-                }), 504
+                    'success': True,
+                    'job_id': job_id,
+                    'status': 'queued',
+                    'status_url': url_for('job_status', job_id=job_id)
+                }), 202
             
-            except requests.exceptions.ConnectionError as conn_err:
-                print(f">>> CONNECTION ERROR: {str(conn_err)}")
-                return jsonify({
-                    'error': 'Connection error',
-                    'message': 'Cannot connect to removal service.'
-                }), 503
+            try:
+                output, stats = run_removal(upload, quality, cache_key, engine, passport_px, profile, credits)
+            except RemovalError as err:
+                return removal_error_response(err)
             
-            except Exception as api_error:
-                print(f">>> EXCEPTION: {str(api_error)}")
-                import traceback
-                traceback.print_exc()
-                return jsonify({
-                    'error': 'Processing error',
-                    'message': str(api_error)
-                }), 500
+            return image_response(output, 'image/png', headers=preprocess_headers(stats), extra={'preprocess': stats})
         
-        print("ERROR: Invalid file type")
         return jsonify({'error': 'Invalid file type'}), 400
     
+    except RateLimited as e:
+        return rate_limited_response(e)
+    
+    except QuotaExhausted as e:
+        return quota_exhausted_response(e)
+    
+    except ImageTooLarge as e:
+        return image_too_large_response(e)
+    
+    except BudgetExceeded as e:
+        return budget_exceeded_response(e)
+    
+    except ValueError as e:
+        return invalid_request_response(e)
+    
     except Exception as e:
-        print(f"FATAL ERROR: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception('remove_background failed')
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """Status (and, once done, the result) of a queued background removal"""
+    job = removal_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    info = {'job_id': job_id, 'status': job['status'], **job_timings(job)}
+    
+    if job['status'] == 'done':
+        output, stats = job['result']
+        return image_response(output, 'image/png', headers=preprocess_headers(stats), extra={**info, 'preprocess': stats})
+    
+    if job['status'] == 'failed':
+        err = job['error']
+        if isinstance(err, BudgetExceeded):
+            return budget_exceeded_response(err)
+        if not isinstance(err, RemovalError):
+            err = RemovalError(500, 'Processing error', str(err))
+        return jsonify({**info, 'error': err.error, 'message': err.message}), err.status_code
+    
+    return jsonify({**info, 'success': True, 'queue_depth': removal_jobs.depth()}), 202
+
 
 # [PASTE THE REMOVE-BACKGROUND FUNCTION FROM ABOVE HERE]
 
+def pipeline_response(img, bg_color=None, sheet_type=None, photo_width=1.2, photo_height=1.4,
+                      format_type='png', quality='high', sheet_options=None, output_options=None, feather=0,
+                      profile=None, headers=None, extra=None, cache_key=None):
+    """Run the passport pipeline and return the encoded result (plus any extra headers/JSON fields).
+
+    With a cache_key the result is also stored in sheet_cache.
+    """
+    try:
+        output, count, encode_stats = run_pipeline(
+            img,
+            bg_color=bg_color,
+            sheet_type=sheet_type,
+            photo_width=photo_width,
+            photo_height=photo_height,
+            format_type=format_type,
+            quality=quality,
+            sheet_options=sheet_options,
+            output_options=output_options,
+            feather=feather,
+            profile=profile
+        )
+    except UnsupportedFormat as e:
+        return jsonify({'error': 'Unsupported output', 'message': str(e)}), 400
+
+    if cache_key:
+        # One JSON line of metadata in front of the encoded bytes
+        meta = json.dumps({'count': count, 'encode': encode_stats}).encode()
+        sheet_cache.put(cache_key, meta + b'\n' + output)
+    return encoded_response(output, count, encode_stats, format_type, sheet_type, headers, extra)
+
+def encoded_response(output, count, encode_stats, format_type, sheet_type=None, headers=None, extra=None):
+    headers = {**(headers or {}), **encode_headers(encode_stats)}
+    extra = {**(extra or {}), 'encode': encode_stats}
+    if sheet_type:
+        headers['X-Photos-Count'] = str(count)
+        extra['photos_count'] = count
+    return image_response(output, mimetype_for(format_type), headers=headers, extra=extra)
+
+def sheet_response(upload, target, **options):
+    """pipeline_response() for a sheet, answered from sheet_cache when this upload was rendered the same way before.
+
+    options are the pipeline_response() arguments; all of them go into the
+    key along with the upload's digest. A hit skips decoding, resizing,
+    tiling and encoding entirely.
+    """
+    cache_key = make_key(content_digest(upload), json.dumps(options, sort_keys=True))
+    cached = sheet_cache.get(cache_key)
+    if cached is not None:
+        registry.inc('sheet_cache_total', result='hit')
+        meta, _, output = cached.partition(b'\n')
+        meta = json.loads(meta)
+        # Nothing was encoded for this response: profile and size still describe the bytes
+        encode_stats = {**meta['encode'], 'encode_ms': 0}
+        return encoded_response(output, meta['count'], encode_stats, options.get('format_type', 'png'),
+                                options.get('sheet_type'), headers={'X-Cache': 'HIT'})
+
+    registry.inc('sheet_cache_total', result='miss')
+    # The sheet canvas is the largest allocation of a render: hold it in the budget too
+    reserve_memory(sheet_canvas_cost(options.get('sheet_type'), options.get('photo_width', 1.2),
+                                     options.get('photo_height', 1.4), options.get('sheet_options')))
+    img = load_request_image(upload, target)
+    return pipeline_response(img, headers={'X-Cache': 'MISS'}, cache_key=cache_key, **options)
+
+@app.route('/api/passport-pipeline', methods=['POST'])
+def passport_pipeline():
+    """Background fill + resize + sheet tiling + encode in a single call"""
+    try:
+        upload, data = read_image_request()
+        sheet_type = data.get('sheetType', 'normal')
+        format_type = data.get('format', 'png')
+        quality = data.get('quality', 'high')
+        bg_color = data.get('bgColor', '#FFFFFF')
+
+        if sheet_type not in ('normal', 'joint'):
+            return jsonify({'error': f'Unknown sheet type: {sheet_type}'}), 400
+
+        photo_width = float(data.get('width', 1.2))
+        photo_height = float(data.get('height', 1.4))
+        sheet_options = read_sheet_options(data)
+
+        return sheet_response(
+            upload,
+            sheet_photo_size(sheet_type, photo_width, photo_height, sheet_options),
+            bg_color=bg_color,
+            sheet_type=sheet_type,
+            photo_width=photo_width,
+            photo_height=photo_height,
+            format_type=format_type,
+            quality=quality,
+            sheet_options=sheet_options,
+            output_options=read_output_options(data),
+            feather=float(data.get('feather', 0)),
+            profile=data.get('profile')
+        )
+
+    except ImageTooLarge as e:
+        return image_too_large_response(e)
+
+    except BudgetExceeded as e:
+        return budget_exceeded_response(e)
+
+    except ValueError as e:
+        return invalid_request_response(e)
+
+    except Exception as e:
+        log.exception('passport_pipeline failed')
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/process-passport', methods=['POST'])
 def process_passport():
+    """Background fill of a passport photo.
+
+    autoCrop=1 frames the photo server-side instead: the face and eye line
+    are detected and the crop for width x height inches at dpi (default
+    1.2x1.4 @ 300) is cut so the head takes headRatio of the height, with
+    the eyes eyeLine from the top.
+    """
     try:
-        data = request.get_json()
-        image_data = data.get('image')
+        upload, data = read_image_request()
         bg_color = data.get('bgColor', '#FFFFFF')
-        
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-        
-        img_bytes = base64.b64decode(image_data)
-        img = Image.open(io.BytesIO(img_bytes))
-        
-        if img.mode != 'RGBA':
-            img = img.convert('RGBA')
-        
-        background = Image.new('RGBA', img.size, bg_color)
-        background.paste(img, (0, 0), img)
-        background = background.convert('RGB')
-        
-        buffered = io.BytesIO()
-        background.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        
-        return jsonify({
-            'success': True,
-            'image': f'data:image/png;base64,{img_str}'
-        })
+
+        headers, extra = {}, {}
+        if str(data.get('autoCrop', '')).lower() in ('1', 'true'):
+            photo_px = read_photo_px(data)
+            head_ratio = float(data.get('headRatio', DEFAULT_HEAD_RATIO))
+            eye_line = float(data.get('eyeLine', DEFAULT_EYE_LINE))
+            if not (0.2 <= head_ratio <= 0.9 and 0.2 <= eye_line <= 0.8):
+                return jsonify({'error': 'Invalid crop', 'message': 'headRatio must be 0.2-0.9, eyeLine 0.2-0.8'}), 400
+
+            reserve_memory(decode_cost(open_image(upload)))
+            with stage('autocrop'):
+                img, crop_info = auto_crop(upload, photo_px, head_ratio, eye_line)
+            headers['X-Autocrop-Detector'] = crop_info['detector']
+            extra['autocrop'] = crop_info
+        else:
+            img = load_request_image(upload)
+
+        return pipeline_response(
+            img,
+            bg_color=bg_color,
+            feather=float(data.get('feather', 0)),
+            profile=data.get('profile'),
+            headers=headers,
+            extra=extra
+        )
+    
+    except ImageTooLarge as e:
+        return image_too_large_response(e)
+    
+    except BudgetExceeded as e:
+        return budget_exceeded_response(e)
+    
+    except NoFaceFound as e:
+        return jsonify({'error': 'No face found', 'message': str(e)}), 422
+    
+    except AutoCropUnavailable as e:
+        return jsonify({'error': 'Auto-crop unavailable', 'message': str(e)}), 501
+    
+    except ValueError as e:
+        return invalid_request_response(e)
     
     except Exception as e:
-        print(f"Error in process_passport: {str(e)}")
+        log.exception('process_passport failed')
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/generate-passport-sheet', methods=['POST'])
 def generate_passport_sheet():
     try:
-        data = request.get_json()
-        image_data = data.get('image')
+        upload, data = read_image_request()
         format_type = data.get('format', 'png')
         quality = data.get('quality', 'high')
         
@@ -277,199 +826,115 @@ def generate_passport_sheet():
         photo_width = float(data.get('width', 1.2))
         photo_height = float(data.get('height', 1.4))
         
-        print(f"Generating sheet with photo size: {photo_width}\" x {photo_height}\"")
-        
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-        
-        img_bytes = base64.b64decode(image_data)
-        passport_photo = Image.open(io.BytesIO(img_bytes))
-        
-        # Calculate dimensions at 300 DPI
-        passport_width_px = int(photo_width * 300)
-        passport_height_px = int(photo_height * 300)
-        
-        print(f"Photo dimensions: {passport_width_px}px x {passport_height_px}px")
-        
-        passport_photo = passport_photo.resize((passport_width_px, passport_height_px), Image.LANCZOS)
-        
-        # Create 4x6 inch sheet at 300 DPI
-        sheet_width = int(4 * 300)  # 1200 pixels
-        sheet_height = int(6 * 300)  # 1800 pixels
-        sheet = Image.new('RGB', (sheet_width, sheet_height), 'white')
-        
-        # Calculate how many photos fit
-        margin = 20
-        available_width = sheet_width - (2 * margin)
-        available_height = sheet_height - (2 * margin)
-        
-        cols = max(1, int(available_width / passport_width_px))
-        rows = max(1, int(available_height / passport_height_px))
+        sheet_options = read_sheet_options(data)
         
-        # Limit to 12 photos maximum
-        total_photos = min(cols * rows, 12)
-        
-        # Recalculate for even spacing
-        if cols * rows > 12:
-            # Try 3x4 layout for 12 photos
-            cols = 3
-            rows = 4
-        
-        print(f"Layout: {cols} cols x {rows} rows = {cols * rows} photos")
-        
-        spacing_x = (available_width - (cols * passport_width_px)) // (cols + 1) if cols > 1 else (available_width - passport_width_px) // 2
-        spacing_y = (available_height - (rows * passport_height_px)) // (rows + 1) if rows > 1 else (available_height - passport_height_px) // 2
-        
-        count = 0
-        for row in range(rows):
-            for col in range(cols):
-                if count >= 12:  # Stop at 12 photos
-                    break
-                x = margin + spacing_x + col * (passport_width_px + spacing_x)
-                y = margin + spacing_y + row * (passport_height_px + spacing_y)
-                sheet.paste(passport_photo, (x, y))
-                count += 1
-            if count >= 12:
-                break
-        
-        print(f"Pasted {count} photos on sheet")
-        
-        # Save with quality settings
-        buffered = io.BytesIO()
-        if format_type == 'jpeg':
-            if quality == 'high':
-                sheet.save(buffered, format="JPEG", quality=95, dpi=(300, 300))
-            elif quality == 'medium':
-                sheet.save(buffered, format="JPEG", quality=85, dpi=(300, 300))
-            else:
-                sheet.save(buffered, format="JPEG", quality=70, dpi=(300, 300))
-        else:
-            sheet.save(buffered, format="PNG", dpi=(300, 300))
-        
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        
-        return jsonify({
-            'success': True,
-            'image': f'data:image/{format_type};base64,{img_str}',
-            'photos_count': count
-        })
+        return sheet_response(
+            upload,
+            sheet_photo_size('normal', photo_width, photo_height, sheet_options),
+            sheet_type='normal',
+            photo_width=photo_width,
+            photo_height=photo_height,
+            format_type=format_type,
+            quality=quality,
+            sheet_options=sheet_options,
+            output_options=read_output_options(data),
+            profile=data.get('profile')
+        )
+    
+    except ImageTooLarge as e:
+        return image_too_large_response(e)
+    
+    except BudgetExceeded as e:
+        return budget_exceeded_response(e)
+    
+    except ValueError as e:
+        return invalid_request_response(e)
     
     except Exception as e:
-        print(f"Error in generate_passport_sheet: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception('generate_passport_sheet failed')
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/generate-joint-sheet', methods=['POST'])
 def generate_joint_sheet():
     """Generate joint photo sheet - 8 photos of 1.9x1.4 inches on 4x6 sheet"""
     try:
-        print("=" * 50)
-        print("JOINT PHOTO SHEET GENERATION STARTED")
-        print("=" * 50)
-        
-        data = request.get_json()
-        image_data = data.get('image')
+        upload, data = read_image_request()
         format_type = data.get('format', 'png')
         quality = data.get('quality', 'high')
         
-        # Fixed dimensions for joint photos
-        photo_width = 1.9  # inches
-        photo_height = 1.4  # inches
-        
-        print(f"Joint photo size: {photo_width}\" x {photo_height}\"")
-        print(f"Format: {format_type}, Quality: {quality}")
-        
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-        
-        img_bytes = base64.b64decode(image_data)
-        joint_photo = Image.open(io.BytesIO(img_bytes))
-        
-        print(f"Original image size: {joint_photo.size}")
-        
-        # Calculate dimensions at 300 DPI
-        photo_width_px = int(photo_width * 300)  # 570 pixels
-        photo_height_px = int(photo_height * 300)  # 420 pixels
-        
-        print(f"Photo dimensions: {photo_width_px}px x {photo_height_px}px")
-        
-        # Resize photo
-        joint_photo = joint_photo.resize((photo_width_px, photo_height_px), Image.LANCZOS)
-        
-        # Create 4x6 inch sheet at 300 DPI
-        sheet_width = int(4 * 300)  # 1200 pixels
-        sheet_height = int(6 * 300)  # 1800 pixels
-        sheet = Image.new('RGB', (sheet_width, sheet_height), 'white')
-        
-        print(f"Sheet size: {sheet_width}px x {sheet_height}px")
-        
-        # Layout: 2 columns x 4 rows = 8 photos
-        cols = 2
-        rows = 4
+        sheet_options = read_sheet_options(data)
         
-        # Calculate spacing
-        margin = 15
-        available_width = sheet_width - (2 * margin)
-        available_height = sheet_height - (2 * margin)
-        
-        spacing_x = (available_width - (cols * photo_width_px)) // (cols + 1)
-        spacing_y = (available_height - (rows * photo_height_px)) // (rows + 1)
-        
-        print(f"Layout: {cols} cols x {rows} rows = 8 photos")
-        print(f"Spacing - X: {spacing_x}px, Y: {spacing_y}px")
-        
-        # Paste photos on sheet
-        count = 0
-        for row in range(rows):
-            for col in range(cols):
-                x = margin + spacing_x + col * (photo_width_px + spacing_x)
-                y = margin + spacing_y + row * (photo_height_px + spacing_y)
-                
-                print(f"Photo {count + 1}: Position ({x}, {y})")
-                
-                sheet.paste(joint_photo, (x, y))
-                count += 1
-        
-        print(f"Total photos pasted: {count}")
-        
-        # Save with quality settings
-        buffered = io.BytesIO()
-        
-        if format_type == 'jpeg':
-            if quality == 'high':
-                sheet.save(buffered, format="JPEG", quality=95, dpi=(300, 300))
-            elif quality == 'medium':
-                sheet.save(buffered, format="JPEG", quality=85, dpi=(300, 300))
-            else:
-                sheet.save(buffered, format="JPEG", quality=70, dpi=(300, 300))
-        else:
-            sheet.save(buffered, format="PNG", dpi=(300, 300))
+        return sheet_response(
+            upload,
+            sheet_photo_size('joint', sheet_options=sheet_options),
+            sheet_type='joint',
+            format_type=format_type,
+            quality=quality,
+            sheet_options=sheet_options,
+            output_options=read_output_options(data),
+            profile=data.get('profile')
+        )
+    
+    except ImageTooLarge as e:
+        return image_too_large_response(e)
+    
+    except BudgetExceeded as e:
+        return budget_exceeded_response(e)
+    
+    except ValueError as e:
+        return invalid_request_response(e)
+    
+    except Exception as e:
+        log.exception('generate_joint_sheet failed')
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/batch/sheets', methods=['POST'])
+def batch_sheets():
+    """Many photos -> many sheets in one request, rendered in parallel on a process pool.
+
+    Upload repeated 'images' parts and/or an 'archive' ZIP. Form fields
+    (sheetType, width, height, bgColor, format, ...) apply to every item;
+    'items' is an optional JSON list of per-item overrides. output=zip
+    (default) streams entries as they finish; output=pdf returns one
+    multi-page PDF.
+    """
+    try:
+        # The item bytes stay in this worker until the pool has rendered them
+        items = read_batch_items(request.files, request.form, reserve=reserve_memory)
+        output = request.form.get('output') or request.args.get('output', 'zip')
         
-        output_size = len(buffered.getvalue()) / (1024 * 1024)
-        print(f"Output file size: {output_size:.2f} MB")
+        log.info('batch items=%s output=%s', len(items), output)
         
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+        if output == 'pdf':
+            parts, size, manifest = build_pdf(items)
+            failed = sum(1 for entry in manifest if 'error' in entry)
+            return Response(iter(parts), mimetype='application/pdf', headers={
+                'Content-Disposition': 'attachment; filename=passport-sheets.pdf',
+                'Content-Length': str(size),
+                'X-Batch-Items': str(len(items)),
+                'X-Batch-Failed': str(failed)
+            })
         
-        print("SUCCESS! Joint sheet generated")
-        print("=" * 50)
+        if output != 'zip':
+            return jsonify({'error': f'Unknown output: {output}'}), 400
         
-        return jsonify({
-            'success': True,
-            'image': f'data:image/{format_type};base64,{img_str}',
-            'photos_count': count
+        return Response(stream_with_context(stream_zip(items)), mimetype='application/zip', headers={
+            'Content-Disposition': 'attachment; filename=passport-sheets.zip',
+            'X-Batch-Items': str(len(items))
         })
     
+    except BatchError as e:
+        return jsonify({'error': 'Invalid batch', 'message': str(e)}), 400
+    
+    except BudgetExceeded as e:
+        return budget_exceeded_response(e)
+    
     except Exception as e:
-        print("=" * 50)
-        print(f"ERROR in generate_joint_sheet: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        print("=" * 50)
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        log.exception('batch_sheets failed')
+        return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/contact', methods=['POST'])
@@ -482,57 +947,78 @@ def contact_form():
 
 @app.route('/health')
 def health():
-    return jsonify({'status': 'healthy'}), 200
+    return jsonify({
+        'status': 'healthy',
+        'removebg_cache': removebg_cache.stats(),
+        'sheet_cache': sheet_cache.stats(),
+        'removebg_credits': credit_ledger.stats()
+    }), 200
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint: request/stage latency histograms and counters.
+
+    Counters and histograms are host-wide (summed over all workers, see
+    METRICS_STORAGE); gauges are those of the worker answering the scrape.
+    """
+    registry.set_gauge('removal_queue_depth', removal_jobs.depth())
+    registry.set_gauge('memory_budget_in_use_bytes', memory_budget.in_use)
+    credits = credit_ledger.stats()
+    registry.set_gauge('removebg_credits_used', credits['used'])
+    registry.set_gauge('removebg_credits_limit', credits['limit'])
+    for name, value in removebg_cache.stats().items():
+        if isinstance(value, (int, float)):
+            registry.set_gauge('removebg_cache', value, stat=name)
+    for name, value in sheet_cache.stats().items():
+        registry.set_gauge('sheet_cache', value, stat=name)
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/assets/<path:filename>')
+def hashed_asset(filename):
+    """Fingerprinted bundles, precompressed (br/gzip) when the client accepts it, immutable for a year"""
+    path = safe_join(os.path.join(assets.STATIC_DIR, assets.DIST_DIR), filename)
+    if path is None or not os.path.isfile(path):
+        return jsonify({'error': 'Not found'}), 404
+
+    send_path, encoding = assets.pick_encoding(path, request.headers.get('Accept-Encoding', ''))
+    response = send_file(send_path, mimetype=mimetypes.guess_type(filename)[0], max_age=ASSET_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+# (path, template, priority, changefreq); lastmod is the template's mtime
+SITEMAP_PAGES = [
+    ('/', 'index.html', '1.0', 'daily'),
+    ('/passport-maker', 'passport_maker.html', '0.9', 'daily'),
+    ('/about', 'about.html', '0.5', 'monthly'),
+    ('/contact', 'contact.html', '0.5', 'monthly'),
+]
 
 @app.route('/sitemap.xml')
+@cached_page(*[page[1] for page in SITEMAP_PAGES], mimetype='application/xml')
 def sitemap():
-    from datetime import datetime
-    today = datetime.now().strftime('%Y-%m-%d')
-    
-    pages = [
-        {
-            'loc': '/', 
-            'lastmod': today,
-            'priority': '1.0', 
-            'changefreq': 'daily'
-        },
-        {
-            'loc': '/passport-maker', 
-            'lastmod': today,
-            'priority': '0.9', 
-            'changefreq': 'daily'
-        },
-        {
-            'loc': '/about', 
-            'lastmod': today,
-            'priority': '0.5', 
-            'changefreq': 'monthly'
-        },
-        {
-            'loc': '/contact', 
-            'lastmod': today,
-            'priority': '0.5', 
-            'changefreq': 'monthly'
-        },
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        'xsi:schemaLocation="http://www.sitemaps.org/schemas/sitemap/0.9 '
+        'http://www.sitemaps.org/schemas/sitemap/0.9/sitemap.xsd">',
     ]
-    
-    sitemap_xml = '<?xml version="1.0" encoding="UTF-8"?>\n'
-    sitemap_xml += '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
-    sitemap_xml += 'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
-    sitemap_xml += 'xsi:schemaLocation="http://www.sitemaps.org/schemas/sitemap/0.9 '
-    sitemap_xml += 'http://www.sitemaps.org/schemas/sitemap/0.9/sitemap.xsd">\n'
-    
-    for page in pages:
-        sitemap_xml += '  <url>\n'
-        sitemap_xml += f'    <loc>https://passport-photo-maker-4.onrender.com{page["loc"]}</loc>\n'
-        sitemap_xml += f'    <lastmod>{page["lastmod"]}</lastmod>\n'
-        sitemap_xml += f'    <priority>{page["priority"]}</priority>\n'
-        sitemap_xml += f'    <changefreq>{page["changefreq"]}</changefreq>\n'
-        sitemap_xml += '  </url>\n'
-    
-    sitemap_xml += '</urlset>'
-    
-    return sitemap_xml, 200, {'Content-Type': 'application/xml; charset=utf-8'}
+    for loc, template, priority, changefreq in SITEMAP_PAGES:
+        mtime = os.path.getmtime(os.path.join(TEMPLATE_DIR, template))
+        lines += [
+            '  <url>',
+            f'    <loc>https://passport-photo-maker-4.onrender.com{loc}</loc>',
+            f'    <lastmod>{datetime.fromtimestamp(mtime, timezone.utc).strftime("%Y-%m-%d")}</lastmod>',
+            f'    <priority>{priority}</priority>',
+            f'    <changefreq>{changefreq}</changefreq>',
+            '  </url>',
+        ]
+    lines.append('</urlset>')
+    return '\n'.join(lines)
 
 @app.route('/robots.txt')
 def robots():
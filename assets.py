@@ -0,0 +1,208 @@
+"""Static asset build: bundle, minify, fingerprint and precompress CSS/JS.
+
+Each bundle concatenates its sources (in the order the pages used to load
+them), minifies the result and writes static/dist/<name>.<hash>.<ext>,
+plus .gz and, when the brotli package is installed, .br variants next to
+it. static/dist/manifest.json maps bundle names to the hashed files.
+brotli, rjsmin and rcssmin are in requirements.txt; without them the
+build still works, with gzip only and the simpler built-in minifiers.
+
+Templates link bundles with asset_url('maker.js'); the app serves them
+from /assets/ with a one-year immutable Cache-Control, so browsers only
+fetch a bundle again once its content (and so its name) changes.
+
+Run `python assets.py` as a build step. The app also builds on startup if
+the manifest is missing or older than any source.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+
+# Bundle name -> sources under static/, in page load order
+BUNDLES = {
+    'site.css': ['css/style.css'],
+    'maker.css': ['css/style.css', 'css/confetti.css'],
+    'home.js': ['js/security.js', 'js/main.js', 'js/language.js', 'js/theme.js'],
+    'maker.js': ['js/passport.js', 'js/language.js', 'js/theme.js', 'js/security.js'],
+    'about.js': ['js/security.js', 'js/language.js', 'js/theme.js'],
+    'contact.js': ['js/security.js', 'js/contact.js', 'js/language.js', 'js/theme.js'],
+}
+
+# Compressed variants, preferred first, as (Content-Encoding, file suffix)
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+HASH_LENGTH = 10
+
+_CSS_STRING = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')')
+_CSS_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+
+
+def minify_css(text):
+    """Strip comments and redundant whitespace, leaving strings untouched"""
+    if rcssmin is not None:
+        return rcssmin.cssmin(text)
+
+    out = []
+    for part in _CSS_STRING.split(text):
+        if part[:1] in ('"', "'"):
+            out.append(part)
+            continue
+        part = re.sub(r'/\*.*?\*/', '', part, flags=re.S)
+        part = re.sub(r'\s+', ' ', part)
+        out.append(_CSS_PUNCTUATION.sub(r'\1', part).replace(';}', '}'))
+    return ''.join(out).strip()
+
+
+def minify_js(text):
+    """Drop indentation, blank lines and whole-line // comments.
+
+    Deliberately line-based: newlines are kept (automatic semicolon
+    insertion still sees the same statements) and lines inside template
+    literals are left exactly as written. rjsmin is used when installed.
+    """
+    if rjsmin is not None:
+        return rjsmin.jsmin(text)
+
+    out = []
+    in_template = False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not in_template and (not stripped or stripped.startswith('//')):
+            continue
+        out.append(line if in_template else stripped)
+        # An odd number of backticks opens or closes a multi-line template
+        if line.count('`') % 2:
+            in_template = not in_template
+    return '\n'.join(out)
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def bundle_sources(name, static_dir=STATIC_DIR):
+    return [os.path.join(static_dir, source) for source in BUNDLES[name]]
+
+
+def build_bundle(name, static_dir=STATIC_DIR):
+    """Concatenated, minified content of one bundle, as bytes"""
+    ext = os.path.splitext(name)[1]
+    parts = []
+    for path in bundle_sources(name, static_dir):
+        with open(path, encoding='utf-8') as f:
+            parts.append(MINIFIERS[ext](f.read()))
+    # ';' keeps a source without a trailing semicolon from running into the next
+    return (';\n' if ext == '.js' else '\n').join(parts).encode('utf-8')
+
+
+def _write(path, data):
+    """Write atomically, so workers building at the same time never serve half a file"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+
+def build(static_dir=STATIC_DIR):
+    """Build every bundle and its compressed variants; returns the manifest"""
+    dist = os.path.join(static_dir, DIST_DIR)
+    os.makedirs(dist, exist_ok=True)
+
+    manifest = {}
+    for name in BUNDLES:
+        content = build_bundle(name, static_dir)
+        stem, ext = os.path.splitext(name)
+        filename = f'{stem}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{ext}'
+        path = os.path.join(dist, filename)
+
+        if not os.path.exists(path):
+            _write(path, content)
+            # mtime=0: the same content always compresses to the same bytes
+            _write(path + '.gz', gzip.compress(content, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _write(path + '.br', brotli.compress(content, quality=11))
+        manifest[name] = filename
+
+    _write(os.path.join(dist, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    _prune(dist, set(manifest.values()))
+    return manifest
+
+
+def _prune(dist, keep):
+    """Remove bundles from earlier builds"""
+    for filename in os.listdir(dist):
+        base = filename[:-3] if filename.endswith(('.gz', '.br')) else filename
+        if filename != MANIFEST and base not in keep:
+            os.remove(os.path.join(dist, filename))
+
+
+def load_manifest(static_dir=STATIC_DIR):
+    """The build manifest, rebuilding first if it is missing or any source is newer"""
+    path = os.path.join(static_dir, DIST_DIR, MANIFEST)
+    try:
+        built = os.path.getmtime(path)
+    except OSError:
+        return build(static_dir)
+
+    sources = {source for sources in BUNDLES.values() for source in sources}
+    if any(os.path.getmtime(os.path.join(static_dir, source)) > built for source in sources):
+        return build(static_dir)
+
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    if set(manifest) != set(BUNDLES):
+        return build(static_dir)
+    return manifest
+
+
+def pick_encoding(path, accept_encoding):
+    """(file to send, Content-Encoding or None) for the client's Accept-Encoding"""
+    accepted = {token.split(';')[0].strip() for token in accept_encoding.lower().split(',')}
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and os.path.exists(path + suffix):
+            return path + suffix, encoding
+    return path, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--static-dir', default=STATIC_DIR)
+    args = parser.parse_args()
+
+    manifest = build(args.static_dir)
+    dist = os.path.join(args.static_dir, DIST_DIR)
+    for name, filename in sorted(manifest.items()):
+        raw = sum(os.path.getsize(source) for source in bundle_sources(name, args.static_dir))
+        sizes = [f'{raw} B sources', f'{os.path.getsize(os.path.join(dist, filename))} B minified']
+        for encoding, suffix in ENCODINGS:
+            variant = os.path.join(dist, filename + suffix)
+            if os.path.exists(variant):
+                sizes.append(f'{os.path.getsize(variant)} B {encoding}')
+        print(f'{name:12} -> {filename:24} ' + ', '.join(sizes))
+
+
+if __name__ == '__main__':
+    main()
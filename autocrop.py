@@ -0,0 +1,170 @@
+from PIL import Image
+import math
+
+from loader import open_image, oriented_size, decode_image
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# Longest side of the copy the detector looks at
+DETECT_SIZE = 480
+
+# Head (crown to chin) as a share of the photo height, and where the eye
+# line sits, from the top. Most passport specs want 50-70% and ~45%.
+DEFAULT_HEAD_RATIO = 0.6
+DEFAULT_EYE_LINE = 0.45
+
+# Face box (brows to chin, as detectors report it) -> head: the crown is
+# about a quarter box above it, the chin just below its bottom edge
+CROWN_ABOVE_FACE = 0.25
+CHIN_BELOW_FACE = 0.1
+EYES_IN_FACE = 0.42  # eye line when the eyes themselves aren't found
+
+
+class NoFaceFound(Exception):
+    """No usable face in the photo"""
+
+
+class AutoCropUnavailable(Exception):
+    """Neither OpenCV nor numpy is installed"""
+
+
+def detect_face(img):
+    """Largest face in img as ((x, y, w, h), eye_y, detector_name), or None.
+
+    Uses OpenCV's Haar cascades when cv2 is installed, otherwise a skin
+    color heuristic (needs numpy) that works for plain, front-facing
+    passport-style shots.
+    """
+    if cv2 is not None:
+        return _detect_opencv(img)
+    if np is not None:
+        return _detect_skin(img)
+    raise AutoCropUnavailable('Auto-crop needs opencv-python-headless or numpy installed')
+
+
+_cascades = {}
+
+
+def _cascade(name):
+    if name not in _cascades:
+        _cascades[name] = cv2.CascadeClassifier(cv2.data.haarcascades + name)
+    return _cascades[name]
+
+
+def _detect_opencv(img):
+    gray = cv2.equalizeHist(np.asarray(img.convert('L')))
+    min_side = max(24, min(gray.shape) // 8)
+    faces = _cascade('haarcascade_frontalface_default.xml').detectMultiScale(
+        gray, scaleFactor=1.1, minNeighbors=5, minSize=(min_side, min_side)
+    )
+    if len(faces) == 0:
+        return None
+    x, y, w, h = (int(v) for v in max(faces, key=lambda face: face[2] * face[3]))
+
+    # Eyes: the two largest hits in the upper half of the face
+    upper = gray[y:y + h // 2, x:x + w]
+    eyes = _cascade('haarcascade_eye.xml').detectMultiScale(upper, scaleFactor=1.1, minNeighbors=5)
+    if len(eyes) >= 2:
+        eyes = sorted(eyes, key=lambda eye: eye[2] * eye[3])[-2:]
+        eye_y = y + sum(ey + eh / 2 for _, ey, _, eh in eyes) / 2
+    else:
+        eye_y = y + h * EYES_IN_FACE
+    return (x, y, w, h), eye_y, 'opencv'
+
+
+def _detect_skin(img):
+    ycbcr = np.asarray(img.convert('YCbCr'), dtype=np.int16)
+    cb, cr = ycbcr[..., 1], ycbcr[..., 2]
+    skin = (cb >= 77) & (cb <= 127) & (cr >= 133) & (cr <= 173)
+    if img.mode in ('RGBA', 'LA'):
+        skin &= np.asarray(img.getchannel('A')) > 128
+
+    rows = skin.sum(axis=1)
+    min_width = max(4, img.width // 20)
+    skin_rows = np.nonzero(rows >= min_width)[0]
+    if len(skin_rows) == 0:
+        return None
+
+    # The face is the first solid band of skin rows from the top; its width
+    # is measured over the upper part of that band (below it: neck, chest)
+    top = int(skin_rows[0])
+    band = skin[top:top + max(8, img.height // 6)]
+    columns = np.nonzero(band.sum(axis=0) >= max(2, len(band) // 4))[0]
+    if len(columns) == 0:
+        return None
+    left, right = int(columns[0]), int(columns[-1])
+    w = right - left + 1
+    h = int(w * 1.3)  # typical face height/width
+    return (left, top, w, h), top + h * EYES_IN_FACE, 'skin'
+
+
+def crop_box(image_size, face, eye_y, photo_aspect, head_ratio=DEFAULT_HEAD_RATIO, eye_line=DEFAULT_EYE_LINE):
+    """Crop (left, top, right, bottom) giving the requested head size and eye line.
+
+    photo_aspect is width / height of the passport photo. The box is
+    shifted (and if needed shrunk) to stay inside the image.
+    """
+    x, y, w, h = face
+    head_height = h * (1 + CROWN_ABOVE_FACE + CHIN_BELOW_FACE)
+
+    crop_height = head_height / head_ratio
+    crop_width = crop_height * photo_aspect
+    scale = min(1.0, image_size[0] / crop_width, image_size[1] / crop_height)
+    crop_width, crop_height = crop_width * scale, crop_height * scale
+
+    left = x + w / 2 - crop_width / 2
+    top = eye_y - crop_height * eye_line
+    left = min(max(left, 0), image_size[0] - crop_width)
+    top = min(max(top, 0), image_size[1] - crop_height)
+    return left, top, left + crop_width, top + crop_height
+
+
+def auto_crop(source, photo_px, head_ratio=DEFAULT_HEAD_RATIO, eye_line=DEFAULT_EYE_LINE):
+    """Find the face and return (passport photo of photo_px, info).
+
+    source is the upload as bytes or a seekable file. Detection runs on a
+    small draft-decoded copy. The photo is then decoded again at the
+    smallest scale that still covers the crop at photo_px and resampled
+    from the crop box only, so the margins around the head are never
+    resized.
+    """
+    img = open_image(source)
+    size = oriented_size(img)
+    shrink = min(1.0, DETECT_SIZE / max(size))
+    detect_size = (max(1, round(size[0] * shrink)), max(1, round(size[1] * shrink)))
+    small = decode_image(img, detect_size)
+    small = small.resize(detect_size, Image.BILINEAR) if small.size != detect_size else small
+
+    found = detect_face(small)
+    if found is None:
+        raise NoFaceFound('No face found in the photo')
+    (x, y, w, h), eye_y, detector = found
+
+    # Back to full-resolution (upright) coordinates
+    to_full = size[0] / detect_size[0]
+    face = tuple(round(v * to_full) for v in (x, y, w, h))
+    box = crop_box(size, face, eye_y * to_full, photo_px[0] / photo_px[1], head_ratio, eye_line)
+
+    # Decode just big enough that the crop box still has photo_px pixels
+    zoom = photo_px[1] / (box[3] - box[1])
+    needed = (min(size[0], math.ceil(size[0] * zoom)), min(size[1], math.ceil(size[1] * zoom)))
+    full = decode_image(open_image(source), needed)
+    scale_x, scale_y = full.width / size[0], full.height / size[1]
+    left, top, right, bottom = box
+    photo = full.resize(photo_px, Image.LANCZOS, box=(left * scale_x, top * scale_y, right * scale_x, bottom * scale_y))
+
+    info = {
+        'detector': detector,
+        'face': list(face),
+        'crop': [round(v) for v in box],
+        'decoded_size': list(full.size),
+    }
+    return photo, info
@@ -0,0 +1,243 @@
+import io
+import os
+import json
+import time
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pipeline import compose, encode_image, read_sheet_options, read_output_options, sheet_photo_size, SHEET_DPI
+from loader import load_image, source_size, read_source
+from encoders import jpeg_for_pdf, pdf_document, timed_encode
+
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 50))
+
+# Render processes per web worker. Every gunicorn worker gets its own pool, so by
+# default the host's cores are split between them (WEB_CONCURRENCY is the worker
+# count, exported by gunicorn.conf.py) rather than each worker taking them all.
+BATCH_PROCESSES = int(os.environ.get('BATCH_PROCESSES', 0)) or max(
+    1, (os.cpu_count() or 1) // int(os.environ.get('WEB_CONCURRENCY', 1))
+)
+BATCH_MAX_ARCHIVE_BYTES = 200 * 1024 * 1024  # uncompressed, guards against zip bombs
+BATCH_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
+
+# Per-item option names (same as the single-photo routes)
+ITEM_FIELDS = ('sheetType', 'width', 'height', 'bgColor', 'feather', 'format', 'quality', 'profile',
+               'paper', 'paperWidth', 'paperHeight', 'dpi', 'margin', 'bleed', 'maxPhotos', 'rotate',
+               'sheets', 'compression')
+
+_pool = None
+
+
+class BatchError(Exception):
+    """Invalid batch request (bad archive, too many items, ...)"""
+
+
+def get_pool():
+    """Process pool of BATCH_PROCESSES, created on first use.
+
+    Pool processes start from a clean forkserver (spawn where that is
+    missing), never by forking this multi-threaded web worker.
+    """
+    global _pool
+    if _pool is None:
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        _pool = ProcessPoolExecutor(max_workers=BATCH_PROCESSES, mp_context=multiprocessing.get_context(method))
+    return _pool
+
+
+def read_batch_items(files, form, reserve=None):
+    """Collect (name, image_bytes, options) from a multipart list and/or a ZIP.
+
+    Images come from repeated 'images' parts and/or one 'archive' ZIP.
+    Form fields are the defaults for every item; the optional 'items' field
+    is a JSON list of per-item overrides, matched by 'name' or by position.
+    reserve(nbytes), when given, is called with the total image size before
+    any image is read into memory (the web worker's memory budget).
+    """
+    parts = files.getlist('images')
+    archive = files.get('archive')
+    zf, members = _open_archive(archive) if archive else (None, [])
+
+    count = len(parts) + len(members)
+    if not count:
+        raise BatchError('No images provided')
+    if count > BATCH_MAX_ITEMS:
+        raise BatchError(f'Too many images ({count}), maximum is {BATCH_MAX_ITEMS}')
+
+    if reserve:
+        reserve(sum(source_size(part.stream) for part in parts) + sum(info.file_size for info in members))
+    images = [
+        (part.filename or f'photo-{index + 1}.png', read_source(part.stream)) for index, part in enumerate(parts)
+    ]
+    images += [(os.path.basename(info.filename), zf.read(info)) for info in members]
+
+    defaults = {field: form.get(field) for field in ITEM_FIELDS if form.get(field) is not None}
+    try:
+        overrides = json.loads(form.get('items') or '[]')
+    except ValueError:
+        raise BatchError('items must be a JSON list') from None
+    by_name = {item['name']: item for item in overrides if isinstance(item, dict) and 'name' in item}
+
+    items = []
+    for index, (name, image_bytes) in enumerate(images):
+        options = dict(defaults)
+        if name in by_name:
+            options.update(by_name[name])
+        elif index < len(overrides) and isinstance(overrides[index], dict) and 'name' not in overrides[index]:
+            options.update(overrides[index])
+        items.append((name, image_bytes, options))
+    return items
+
+
+def _open_archive(archive):
+    """The ZIP (read in place from the spooled upload) and its image members, in name order"""
+    try:
+        zf = zipfile.ZipFile(archive.stream)
+    except zipfile.BadZipFile:
+        raise BatchError('archive is not a valid ZIP file') from None
+
+    members = [
+        info for info in zf.infolist()
+        if not info.is_dir()
+        and not os.path.basename(info.filename).startswith('.')
+        and info.filename.rsplit('.', 1)[-1].lower() in BATCH_IMAGE_EXTENSIONS
+    ]
+    if sum(info.file_size for info in members) > BATCH_MAX_ARCHIVE_BYTES:
+        raise BatchError('archive is too large when extracted')
+
+    return zf, sorted(members, key=lambda info: info.filename)
+
+
+def render_item(index, name, image_bytes, options, pdf_page=False):
+    """Worker: build one sheet. Runs in a pool process, so it only takes/returns plain data.
+
+    pdf_page=True returns the sheet's JPEG stream and size for the
+    combined PDF instead of an encoded file.
+    """
+    start_time = time.perf_counter()
+    result = {'index': index, 'name': name}
+    try:
+        sheet_type = options.get('sheetType', 'normal')
+        if sheet_type not in ('normal', 'joint'):
+            raise ValueError(f'Unknown sheet type: {sheet_type}')
+        format_type = options.get('format', 'png')
+
+        photo_width = float(options.get('width', 1.2))
+        photo_height = float(options.get('height', 1.4))
+        sheet_options = read_sheet_options(options)
+
+        img = load_image(image_bytes, sheet_photo_size(sheet_type, photo_width, photo_height, sheet_options))
+        sheet, count, dpi = compose(
+            img,
+            bg_color=options.get('bgColor', '#FFFFFF'),
+            sheet_type=sheet_type,
+            photo_width=photo_width,
+            photo_height=photo_height,
+            sheet_options=sheet_options,
+            feather=float(options.get('feather', 0))
+        )
+
+        quality = options.get('quality', 'high')
+        if pdf_page:
+            result['jpeg'] = jpeg_for_pdf(sheet, quality, options.get('profile'))
+            result['size'] = sheet.size
+        else:
+            result['data'], result['encode'] = timed_encode(
+                encode_image, sheet, format_type, quality, dpi=dpi,
+                profile=options.get('profile'), **read_output_options(options)
+            )
+        result.update(photos_count=count, format=format_type, dpi=dpi)
+    except Exception as e:
+        result['error'] = str(e)
+
+    result['ms'] = round((time.perf_counter() - start_time) * 1000, 1)
+    return result
+
+
+def _run(items, pdf_pages=False):
+    """Yield worker results as they finish"""
+    pool = get_pool()
+    futures = [
+        pool.submit(render_item, index, name, image_bytes, options, pdf_pages)
+        for index, (name, image_bytes, options) in enumerate(items)
+    ]
+    for future in as_completed(futures):
+        try:
+            yield future.result()
+        except Exception as e:  # e.g. BrokenProcessPool
+            yield {'index': futures.index(future), 'name': items[futures.index(future)][0], 'error': str(e)}
+
+
+class _ChunkWriter(io.RawIOBase):
+    """Write-only sink that hands out what was written since the last drain"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _manifest_entry(result):
+    entry = {key: result[key] for key in ('index', 'name', 'ms') if key in result}
+    if 'error' in result:
+        entry['error'] = result['error']
+    else:
+        entry['photos_count'] = result['photos_count']
+        if 'encode' in result:
+            entry['encode'] = result['encode']
+    return entry
+
+
+def stream_zip(items):
+    """Yield a ZIP of sheets chunk by chunk, each entry as soon as its worker finishes"""
+    sink = _ChunkWriter()
+    manifest = []
+    used_names = set()
+
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zf:
+        for result in _run(items):
+            manifest.append(_manifest_entry(result))
+            if 'error' not in result:
+                stem = os.path.splitext(result['name'])[0]
+                extension = {'jpeg': 'jpg'}.get(result['format'], result['format'])
+                entry_name = f"{stem}-sheet.{extension}"
+                if entry_name in used_names:
+                    entry_name = f"{stem}-{result['index'] + 1}-sheet.{entry_name.rsplit('.', 1)[1]}"
+                used_names.add(entry_name)
+                zf.writestr(entry_name, result['data'])
+            yield sink.drain()
+
+        manifest.sort(key=lambda entry: entry['index'])
+        zf.writestr('manifest.json', json.dumps(manifest, indent=2))
+    yield sink.drain()
+
+
+def build_pdf(items):
+    """All sheets as one multi-page PDF (pages in upload order). Returns (parts, size, manifest).
+
+    Workers JPEG-encode their sheet in parallel; the PDF just wraps those
+    streams, each page at its own physical size.
+    """
+    results = sorted(_run(items, pdf_pages=True), key=lambda result: result['index'])
+    manifest = [_manifest_entry(result) for result in results]
+
+    pages = [
+        (result['jpeg'], result['size'], result['dpi'] or SHEET_DPI)
+        for result in results if 'error' not in result
+    ]
+    if not pages:
+        raise BatchError('No sheet could be generated')
+
+    parts = pdf_document(pages)
+    return parts, sum(len(part) for part in parts), manifest
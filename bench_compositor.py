@@ -0,0 +1,113 @@
+"""Micro-benchmark: sheet compositing, per-cell paste loop vs row-strip copy.
+
+Also prints the other per-sheet stages (resize, encode) for comparison,
+since those decide what moving from 300 to 600 DPI costs per request.
+
+Usage: python bench_compositor.py [--repeat N]
+"""
+import argparse
+import io
+import time
+
+from PIL import Image
+
+from layout import compute_layout
+from pipeline import paste_rows
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CASES = [
+    # (label, paper w/h, photo w/h, max photos)
+    ('4x6 passport', (4, 6), (1.2, 1.4), 12),
+    ('4x6 joint', (4, 6), (1.9, 1.4), None),
+    ('a4 passport', (8.27, 11.69), (1.2, 1.4), None),
+]
+
+
+def paste_loop(sheet, photo, positions):
+    """The original compositor: one paste per cell"""
+    for position in positions:
+        sheet.paste(photo, position)
+
+
+def numpy_tile(sheet, photo, positions):
+    """Array tiling: np.tile the photo into the grid block, one assignment"""
+    arr = np.asarray(sheet).copy()
+    tile = np.asarray(photo)
+    width, height = photo.size
+    xs = sorted({x for x, _ in positions})
+    ys = sorted({y for _, y in positions})
+    for y in ys:
+        for x in xs:
+            arr[y:y + height, x:x + width] = tile
+    return Image.fromarray(arr)
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def stage_breakdown(repeat):
+    """Time every stage of a default 4x6 passport sheet at 300 and 600 DPI"""
+    source = Image.effect_noise((360, 420), 64).convert('RGB')
+
+    print(f"\n{'4x6 passport':<14} {'dpi':>4}  {'resize':>10}  {'composite':>10}  {'png':>10}  {'jpeg':>10}")
+    for dpi in (300, 600):
+        layout = compute_layout(4, 6, 1.2, 1.4, dpi=dpi, margin=20 / 300, max_photos=12)
+        photo = source.resize(layout.photo_size, Image.LANCZOS)
+        sheet = Image.new('RGB', layout.sheet_size, 'white')
+        paste_rows(sheet, photo, layout.positions)
+
+        stages = [
+            lambda: source.resize(layout.photo_size, Image.LANCZOS),
+            lambda: paste_rows(Image.new('RGB', layout.sheet_size, 'white'), photo, layout.positions),
+            lambda: sheet.save(io.BytesIO(), format='PNG', dpi=(dpi, dpi)),
+            lambda: sheet.save(io.BytesIO(), format='JPEG', quality=95, dpi=(dpi, dpi)),
+        ]
+        # Encoders are slow, a few rounds are enough
+        results = [timed(fn, repeat if i < 2 else max(1, repeat // 5)) for i, fn in enumerate(stages)]
+        print(f"{'':<14} {dpi:>4}  " + '  '.join(f'{ms:>8.1f}ms' for ms in results))
+
+
+def best_of(fn, layout, photo, repeat):
+    timings = []
+    for _ in range(repeat):
+        sheet = Image.new('RGB', layout.sheet_size, 'white')
+        start = time.perf_counter()
+        fn(sheet, photo, layout.positions)
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    compositors = [('paste loop', paste_loop), ('row strip', paste_rows)]
+    if np is not None:
+        compositors.append(('numpy tile', numpy_tile))
+
+    print(f"{'case':<14} {'dpi':>4} {'photos':>6}  " + '  '.join(f'{name:>12}' for name, _ in compositors))
+    for label, (paper_w, paper_h), (photo_w, photo_h), max_photos in CASES:
+        for dpi in (300, 600):
+            layout = compute_layout(paper_w, paper_h, photo_w, photo_h, dpi=dpi,
+                                    margin=20 / 300, max_photos=max_photos)
+            photo = Image.effect_noise(layout.photo_size, 64).convert('RGB')
+            results = [best_of(fn, layout, photo, args.repeat) for _, fn in compositors]
+            print(f'{label:<14} {dpi:>4} {len(layout.positions):>6}  '
+                  + '  '.join(f'{ms:>10.2f}ms' for ms in results))
+
+    stage_breakdown(args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+"""Benchmark: latency/throughput of the image endpoints, in-process and under gunicorn.
+
+Drives /api/process-passport, /api/generate-passport-sheet,
+/api/generate-joint-sheet, /api/passport-pipeline and
+/api/remove-background with synthetic photos at several resolutions.
+Background removal goes to a local remove.bg stub (removebg_stub.py), and
+every upload is made unique, so each request is a cache miss.
+
+Two modes:
+  client    Flask test client, one request at a time: pure handler cost
+  gunicorn  real `gunicorn app:app` over HTTP with --concurrency threads
+
+Reports p50/p95/p99 latency, throughput and peak RSS (per gunicorn worker)
+and writes everything to JSON. Pass --baseline old.json to compare p95s
+and exit 1 on regressions beyond --tolerance.
+
+Usage: python bench_endpoints.py [--mode client|gunicorn|both] [--requests N]
+                                 [--concurrency N] [--workers N] [--output FILE]
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import PIL
+import requests
+from PIL import Image, ImageFilter
+
+from removebg_stub import RemoveBgStub
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (label, size) of the synthetic uploads
+RESOLUTIONS = [
+    ('small', (600, 700)),
+    ('medium', (1200, 1400)),
+    ('large', (3000, 3500)),
+]
+
+ENDPOINTS = [
+    # (path, form fields, upload kind)
+    ('/api/process-passport', {'bgColor': '#FFFFFF'}, 'cutout'),
+    ('/api/generate-passport-sheet', {'width': '1.2', 'height': '1.4'}, 'photo'),
+    ('/api/generate-joint-sheet', {}, 'photo'),
+    ('/api/passport-pipeline?raw=1', {'sheetType': 'normal', 'bgColor': '#FFFFFF'}, 'cutout'),
+    ('/api/remove-background', {'quality': 'high'}, 'photo'),
+]
+
+
+def synthetic_photo(size):
+    """Photo-like JPEG: smooth noise compresses like a real portrait"""
+    img = Image.effect_noise(size, 40).convert('RGB').filter(ImageFilter.GaussianBlur(2))
+    buffered = io.BytesIO()
+    img.save(buffered, format='JPEG', quality=90)
+    return buffered.getvalue()
+
+
+def synthetic_cutout(size):
+    """Cutout-like PNG: opaque subject on a transparent background"""
+    img = Image.new('RGBA', size, (0, 0, 0, 0))
+    subject = Image.effect_noise((size[0] // 2, size[1] * 7 // 8), 40).filter(ImageFilter.GaussianBlur(2))
+    img.paste(subject.convert('RGBA'), (size[0] // 4, size[1] // 8))
+    buffered = io.BytesIO()
+    img.save(buffered, format='PNG')
+    return buffered.getvalue()
+
+
+def unique_variant(image_bytes, n):
+    """Append a few bytes after the image data so content-addressed caches miss"""
+    return image_bytes + n.to_bytes(8, 'big')
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(latencies, errors, wall_seconds):
+    latencies = sorted(latencies)
+    ms = [value * 1000 for value in latencies]
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'p50_ms': round(percentile(ms, 50), 2) if ms else None,
+        'p95_ms': round(percentile(ms, 95), 2) if ms else None,
+        'p99_ms': round(percentile(ms, 99), 2) if ms else None,
+        'mean_ms': round(sum(ms) / len(ms), 2) if ms else None,
+        'throughput_rps': round(len(latencies) / wall_seconds, 2) if wall_seconds else None,
+    }
+
+
+def self_peak_rss_mb():
+    # ru_maxrss is KB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def proc_peak_rss_mb(pid):
+    """VmHWM (peak resident set) of a process, Linux only"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def child_pids(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def build_cases(resolutions):
+    images = {}
+    for label, size in resolutions:
+        images[label] = {'photo': synthetic_photo(size), 'cutout': synthetic_cutout(size)}
+    return [
+        (path, fields, kind, label, images[label][kind])
+        for path, fields, kind in ENDPOINTS
+        for label, _ in resolutions
+    ]
+
+
+def filename_for(kind):
+    return 'photo.jpg' if kind == 'photo' else 'cutout.png'
+
+
+def run_client(cases, args):
+    """In-process: Flask test client, sequential"""
+    import app as app_module
+    client = app_module.app.test_client()
+    counter = iter(range(10 ** 9))
+
+    results = []
+    for path, fields, kind, label, image in cases:
+        def call():
+            data = dict(fields, image=(io.BytesIO(unique_variant(image, next(counter))), filename_for(kind)))
+            start = time.perf_counter()
+            response = client.post(path, data=data, content_type='multipart/form-data')
+            response.get_data()
+            return time.perf_counter() - start, response.status_code
+
+        for _ in range(args.warmup):
+            call()
+
+        latencies, errors = [], 0
+        wall_start = time.perf_counter()
+        for _ in range(args.requests):
+            elapsed, status = call()
+            if status == 200:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+        wall = time.perf_counter() - wall_start
+
+        result = {'mode': 'client', 'endpoint': path, 'resolution': label, 'concurrency': 1,
+                  **summarize(latencies, errors, wall), 'peak_rss_mb': self_peak_rss_mb()}
+        print_result(result)
+        results.append(result)
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.exceptions.ConnectionError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'gunicorn did not come up at {url}')
+
+
+def run_gunicorn(cases, args, env, workdir):
+    """Real server: gunicorn over HTTP, --concurrency client threads"""
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    command = [
+        sys.executable, '-m', 'gunicorn', 'app:app',
+        '--bind', f'127.0.0.1:{port}',
+        '--workers', str(args.workers),
+        '--threads', str(args.threads),
+        '--chdir', workdir,
+        '--pythonpath', REPO_DIR,
+        '--log-level', 'warning',
+    ] + args.gunicorn_arg
+    server = subprocess.Popen(command, env=env)
+    sessions = threading.local()
+    counter = iter(range(10 ** 9))
+    counter_lock = threading.Lock()
+
+    def call(path, fields, kind, image):
+        session = getattr(sessions, 'session', None)
+        if session is None:
+            session = sessions.session = requests.Session()
+        with counter_lock:
+            n = next(counter)
+        files = {'image': (filename_for(kind), unique_variant(image, n))}
+        start = time.perf_counter()
+        try:
+            response = session.post(base_url + path, data=fields, files=files, timeout=120)
+            status = response.status_code
+        except requests.exceptions.RequestException:
+            status = None
+        return time.perf_counter() - start, status
+
+    results = []
+    try:
+        wait_for(base_url + '/health')
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for path, fields, kind, label, image in cases:
+                list(pool.map(lambda _: call(path, fields, kind, image), range(args.warmup * args.concurrency)))
+
+                wall_start = time.perf_counter()
+                outcomes = list(pool.map(lambda _: call(path, fields, kind, image), range(args.requests)))
+                wall = time.perf_counter() - wall_start
+
+                latencies = [elapsed for elapsed, status in outcomes if status == 200]
+                workers = {str(pid): proc_peak_rss_mb(pid) for pid in child_pids(server.pid)}
+                result = {'mode': 'gunicorn', 'endpoint': path, 'resolution': label,
+                          'concurrency': args.concurrency,
+                          **summarize(latencies, len(outcomes) - len(latencies), wall),
+                          'peak_rss_mb': max(filter(None, workers.values()), default=None),
+                          'worker_peak_rss_mb': workers}
+                print_result(result)
+                results.append(result)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return results
+
+
+def print_result(result):
+    print(f"{result['mode']:<9} {result['endpoint']:<32} {result['resolution']:<7} "
+          f"p50 {result['p50_ms'] or 0:>8.1f}ms  p95 {result['p95_ms'] or 0:>8.1f}ms  "
+          f"p99 {result['p99_ms'] or 0:>8.1f}ms  {result['throughput_rps'] or 0:>7.1f} req/s  "
+          f"rss {result['peak_rss_mb'] or 0:>6.1f}MB  errors {result['errors']}", flush=True)
+
+
+def compare(results, baseline_path, tolerance):
+    """Print p95 changes against a previous run; return the regressed cases"""
+    with open(baseline_path) as f:
+        baseline = {
+            (r['mode'], r['endpoint'], r['resolution']): r
+            for r in json.load(f)['results']
+        }
+
+    regressions = []
+    print(f'\nvs {baseline_path} (tolerance {tolerance:.0%})')
+    for result in results:
+        old = baseline.get((result['mode'], result['endpoint'], result['resolution']))
+        if not old or not old.get('p95_ms') or not result['p95_ms']:
+            continue
+        change = result['p95_ms'] / old['p95_ms'] - 1
+        flag = 'REGRESSION' if change > tolerance else ''
+        print(f"{result['mode']:<9} {result['endpoint']:<32} {result['resolution']:<7} "
+              f"p95 {old['p95_ms']:>8.1f} -> {result['p95_ms']:>8.1f}ms ({change:+.0%}) {flag}")
+        if flag:
+            regressions.append(result)
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=('client', 'gunicorn', 'both'), default='both')
+    parser.add_argument('--requests', type=int, default=30, help='measured requests per case')
+    parser.add_argument('--warmup', type=int, default=2, help='unmeasured requests per case (per thread)')
+    parser.add_argument('--concurrency', type=int, default=4, help='client threads in gunicorn mode')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--gunicorn-arg', action='append', default=[], help='extra gunicorn argument')
+    parser.add_argument('--resolutions', default=','.join(label for label, _ in RESOLUTIONS),
+                        help='comma-separated subset of ' + ', '.join(label for label, _ in RESOLUTIONS))
+    parser.add_argument('--endpoint', action='append', help='only endpoints containing this (repeatable)')
+    parser.add_argument('--stub-latency', type=float, default=0.0, help='seconds the remove.bg stub waits')
+    parser.add_argument('--output', default='bench-results.json')
+    parser.add_argument('--baseline', help='previous results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 slowdown vs baseline')
+    args = parser.parse_args()
+    # Client mode chdirs into a temp dir; resolve file arguments first
+    args.output = os.path.abspath(args.output)
+    if args.baseline:
+        args.baseline = os.path.abspath(args.baseline)
+
+    wanted = set(args.resolutions.split(','))
+    cases = build_cases([resolution for resolution in RESOLUTIONS if resolution[0] in wanted])
+    if args.endpoint:
+        cases = [case for case in cases if any(part in case[0] for part in args.endpoint)]
+
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    results = []
+    with RemoveBgStub(latency=args.stub_latency) as stub:
+        # One client hammering remove.bg is exactly what the rate limit stops: lift it
+        env = dict(os.environ, REMOVEBG_API_URL=stub.url, REMOVEBG_API_KEY='bench',
+                   LOG_LEVEL='WARNING', LOG_SLOW_MS='600000',
+                   RATE_LIMIT_PER_MINUTE='0', REMOVEBG_MONTHLY_CREDITS='0')
+
+        if args.mode in ('client', 'both'):
+            # Same environment the server gets; uploads/ and caches land in the temp dir
+            os.environ.update(env)
+            sys.path.insert(0, REPO_DIR)
+            os.chdir(workdir)
+            results += run_client(cases, args)
+
+        if args.mode in ('gunicorn', 'both'):
+            results += run_gunicorn(cases, args, env, workdir)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nwrote {args.output}')
+
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
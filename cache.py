@@ -0,0 +1,208 @@
+import os
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def make_key(*parts):
+    """Build a content-addressed cache key from bytes/str parts"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def content_digest(source, chunk_size=1024 * 1024):
+    """sha256 hex digest of an upload given as bytes or a seekable binary file"""
+    if isinstance(source, (bytes, bytearray)):
+        return hashlib.sha256(source).hexdigest()
+    digest = hashlib.sha256()
+    source.seek(0)
+    for chunk in iter(lambda: source.read(chunk_size), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Two-tier (memory + disk) LRU cache for encoded results, bounded by bytes.
+
+    The memory tier is per process. The disk tier is the directory itself,
+    shared by every gunicorn worker using it: an entry written by any worker
+    is a hit, a file's mtime is its recency (bumped on every hit), and
+    disk_limit bounds the directory as a whole, not each worker's share.
+    Each process tracks the directory size as of its last scan plus what it
+    wrote since, and rescans (evicting the least recently used files) once
+    that passes disk_limit or it has written RESCAN_FRACTION of it.
+    """
+
+    RESCAN_FRACTION = 1 / 8
+
+    def __init__(self, directory, memory_limit=64 * 1024 * 1024, disk_limit=512 * 1024 * 1024):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+
+        self._memory = OrderedDict()  # key -> bytes
+        self._memory_bytes = 0
+        self._disk_entries = 0
+        self._disk_bytes = 0  # at the last scan, plus our own writes since
+        self._written = 0  # bytes this process wrote since the last scan
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            self._evict_disk()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.bin')
+
+    @staticmethod
+    def _touch(path):
+        # Explicit ns timestamp: coarse filesystem clocks would tie entries written back to back
+        now = time.time_ns()
+        os.utime(path, ns=(now, now))
+
+    def get(self, key):
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return value
+
+            try:
+                with open(self._path(key), 'rb') as f:
+                    value = f.read()
+                self._touch(self._path(key))
+            except OSError:
+                # Never written, evicted by another worker, or removed by cleanup_uploads
+                self.misses += 1
+                return None
+
+            self._store_memory(key, value)
+            self.disk_hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._store_memory(key, value)
+            self._store_disk(key, value)
+
+    def _store_memory(self, key, value):
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        if len(value) > self.memory_limit:
+            return
+        self._memory[key] = value
+        self._memory_bytes += len(value)
+        while self._memory_bytes > self.memory_limit:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _store_disk(self, key, value):
+        if len(value) > self.disk_limit:
+            return
+        path = self._path(key)
+        try:
+            if os.path.exists(path):
+                self._touch(path)
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            # Unique temp name: two workers may store the same key at once
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+            self._touch(path)
+        except OSError:
+            return
+        self._disk_entries += 1
+        self._disk_bytes += len(value)
+        self._written += len(value)
+        if self._disk_bytes > self.disk_limit or self._written > self.disk_limit * self.RESCAN_FRACTION:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """Rescan the directory and remove least recently used entries until it fits disk_limit"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.bin'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.disk_limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # another worker evicted it first
+            total -= size
+            removed += 1
+        self._disk_entries, self._disk_bytes, self._written = len(entries) - removed, total, 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_entries': self._disk_entries,
+                'disk_bytes': self._disk_bytes,
+            }
+
+
+class PageCache:
+    """Rendered GET responses (pages, sitemap), tied to the files they were built from.
+
+    An entry is rebuilt when any of its source files (templates, the asset
+    manifest) has a newer mtime than when it was built, so editing a
+    template invalidates exactly the pages that use it. Entries carry an
+    ETag (content hash) and Last-Modified (newest source mtime) for
+    conditional GETs.
+    """
+
+    def __init__(self):
+        self._entries = {}  # key -> (sources_mtime, body, etag, last_modified)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def sources_mtime(sources):
+        return max((os.path.getmtime(path) for path in sources if os.path.exists(path)), default=0)
+
+    def get(self, key, sources, build):
+        """(body, etag, last_modified, hit) for key; build() returns the body as str or bytes on a miss"""
+        mtime = self.sources_mtime(sources)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] == mtime:
+            return (*entry[1:], True)
+
+        body = build()
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        entry = (mtime, body, hashlib.sha256(body).hexdigest()[:32], int(mtime))
+        with self._lock:
+            self._entries[key] = entry
+        return (*entry[1:], False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,248 @@
+from PIL import Image, features
+import io
+import os
+import time
+
+try:
+    import pillow_avif  # noqa: F401 - registers the AVIF plugin with Pillow
+except ImportError:
+    pass
+
+# Every format the routes can produce
+RASTER_FORMATS = ('png', 'jpeg', 'webp', 'avif')
+OUTPUT_FORMATS = RASTER_FORMATS + ('pdf', 'tiff')
+
+# Print formats and their MIME types
+PRINT_FORMATS = {
+    'pdf': 'application/pdf',
+    'tiff': 'image/tiff',
+}
+
+TIFF_COMPRESSION = {
+    'lzw': 'tiff_lzw',
+    'deflate': 'tiff_adobe_deflate',
+}
+
+# TIFF has no way to share one image between pages: every page is a full
+# re-encode held in memory (~0.15 s and several MB each). Bigger print orders
+# go to PDF, where extra pages are nearly free.
+TIFF_MAX_PAGES = 4
+
+# Quality tier -> JPEG/WebP/AVIF quality
+JPEG_QUALITY = {'high': 95, 'medium': 85, 'low': 70}
+
+# Encoder effort per profile and format. The quality tier still decides
+# the lossy quality; the profile decides how much CPU goes into the bytes.
+ENCODER_PROFILES = {
+    # Least CPU, a few KB bigger: for busy days
+    'fast': {
+        'png': {'compress_level': 1},
+        'jpeg': {},
+        'webp': {'method': 0},
+        'avif': {'speed': 10},
+    },
+    # Pillow defaults (what every route produced so far)
+    'balanced': {
+        'png': {},
+        'jpeg': {},
+        'webp': {},
+        'avif': {},
+    },
+    # Most CPU for the fewest bytes
+    'smallest': {
+        'png': {'optimize': True},
+        'jpeg': {'optimize': True, 'progressive': True},
+        'webp': {'method': 6},
+        'avif': {'speed': 2},
+    },
+    # Full chroma resolution for printing, no progressive JPEG
+    'print': {
+        'png': {},
+        'jpeg': {'subsampling': 0},
+        'webp': {'lossless': True},
+        'avif': {'subsampling': '4:4:4'},
+    },
+}
+
+DEFAULT_PROFILE = os.environ.get('ENCODER_PROFILE', 'balanced')
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class UnsupportedFormat(ValueError):
+    """Unknown encoder profile, or an output format (or format option) this server can't encode"""
+
+
+def mimetype_for(format_type):
+    return PRINT_FORMATS.get(format_type, f'image/{format_type}')
+
+
+def check_format(format_type):
+    """Raise UnsupportedFormat unless format_type is one of OUTPUT_FORMATS"""
+    if format_type not in OUTPUT_FORMATS:
+        raise UnsupportedFormat(f'Unknown output format: {format_type}')
+
+
+def encoder_profile(name=None):
+    """Validate a profile name; None means DEFAULT_PROFILE"""
+    name = name or DEFAULT_PROFILE
+    if name not in ENCODER_PROFILES:
+        raise UnsupportedFormat(f'Unknown encoder profile: {name}')
+    return name
+
+
+def encode_raster(img, format_type='png', quality='high', profile=None, dpi=None):
+    """PNG/JPEG/WebP/AVIF bytes with the profile's encoder settings"""
+    if format_type not in RASTER_FORMATS:
+        raise UnsupportedFormat(f'Unknown output format: {format_type}')
+    if format_type == 'webp' and not features.check('webp'):
+        raise UnsupportedFormat('WebP output is not available (Pillow built without libwebp)')
+    if format_type == 'avif' and 'AVIF' not in Image.SAVE:
+        raise UnsupportedFormat('AVIF output needs pillow-avif-plugin installed')
+
+    params = dict(ENCODER_PROFILES[encoder_profile(profile)][format_type])
+    if format_type != 'png':
+        params.setdefault('quality', JPEG_QUALITY.get(quality, 70))
+    if dpi and format_type in ('png', 'jpeg'):
+        params['dpi'] = (dpi, dpi)
+
+    buffered = io.BytesIO()
+    img.save(buffered, format=format_type.upper(), **params)
+    return buffered.getvalue()
+
+
+def timed_encode(encode, *args, profile=None, **kwargs):
+    """Run an encode function; returns (bytes, stats) with encode time and output size"""
+    start_time = time.perf_counter()
+    output = encode(*args, profile=profile, **kwargs)
+    return output, {
+        'profile': encoder_profile(profile),
+        'encode_ms': round((time.perf_counter() - start_time) * 1000, 1),
+        'bytes': len(output),
+    }
+
+
+def iter_chunks(data, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield an encoded file in chunks for a streamed response.
+
+    WSGI servers (gunicorn) only accept bytes, so each slice of the view is
+    copied out - one chunk at a time, never the whole file.
+    """
+    view = memoryview(data)
+    for offset in range(0, len(view), chunk_size):
+        yield bytes(view[offset:offset + chunk_size])
+
+
+def jpeg_for_pdf(img, quality='high', profile=None):
+    """Encode a sheet once as the JPEG (DCT) stream embedded in the PDF, with the profile's JPEG settings"""
+    params = dict(ENCODER_PROFILES[encoder_profile(profile)]['jpeg'])
+    params.setdefault('quality', JPEG_QUALITY.get(quality, 70))
+    buffered = io.BytesIO()
+    img.convert('RGB').save(buffered, format='JPEG', **params)
+    return buffered.getvalue()
+
+
+def encode_pdf(img, dpi, quality='high', pages=1, profile=None):
+    """Single- or multi-page PDF of one sheet at its physical size.
+
+    The sheet is JPEG-encoded once and that one image object is shared
+    by every page, so extra copies cost a few hundred bytes each.
+    """
+    jpeg = jpeg_for_pdf(img, quality, profile)
+    return b''.join(pdf_document([(jpeg, img.size, dpi)] * pages))
+
+
+def pdf_document(pages):
+    """Minimal PDF writer. pages: list of (jpeg_bytes, (width_px, height_px), dpi).
+
+    Pages that pass the very same jpeg_bytes object share a single image
+    XObject (and content stream). Returns the file as a list of parts;
+    the JPEG data is referenced, not copied.
+    """
+    parts = [b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n']
+    offsets = {}
+    size = len(parts[0])
+
+    def add_object(number, body, stream=None):
+        nonlocal size
+        offsets[number] = size
+        header = f'{number} 0 obj\n'.encode() + body
+        if stream is None:
+            chunk = header + b'\nendobj\n'
+            parts.append(chunk)
+            size += len(chunk)
+        else:
+            header += b'\nstream\n'
+            footer = b'\nendstream\nendobj\n'
+            parts.extend([header, stream, footer])
+            size += len(header) + len(stream) + len(footer)
+
+    # 1: catalog, 2: page tree, then shared images/contents, then pages
+    next_number = 3
+    shared = {}  # (id(jpeg), dpi) -> (image number, content number, media box)
+    page_numbers = []
+    page_specs = []
+
+    for jpeg, (width, height), dpi in pages:
+        key = (id(jpeg), dpi)
+        if key not in shared:
+            image_number, content_number = next_number, next_number + 1
+            next_number += 2
+
+            add_object(image_number, (
+                f'<< /Type /XObject /Subtype /Image /Width {width} /Height {height} '
+                f'/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode '
+                f'/Length {len(jpeg)} >>'
+            ).encode(), jpeg)
+
+            # Physical size: pixels / DPI inches, 72 points per inch
+            width_pt = round(width * 72 / dpi, 3)
+            height_pt = round(height * 72 / dpi, 3)
+            content = f'q {width_pt} 0 0 {height_pt} 0 0 cm /Im0 Do Q'.encode()
+            add_object(content_number, f'<< /Length {len(content)} >>'.encode(), content)
+
+            shared[key] = (image_number, content_number, f'[0 0 {width_pt} {height_pt}]')
+        page_numbers.append(next_number)
+        page_specs.append(shared[key])
+        next_number += 1
+
+    for page_number, (image_number, content_number, media_box) in zip(page_numbers, page_specs):
+        add_object(page_number, (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox {media_box} '
+            f'/Resources << /XObject << /Im0 {image_number} 0 R >> >> '
+            f'/Contents {content_number} 0 R >>'
+        ).encode())
+
+    kids = ' '.join(f'{number} 0 R' for number in page_numbers)
+    add_object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+    add_object(2, f'<< /Type /Pages /Kids [{kids}] /Count {len(page_numbers)} >>'.encode())
+
+    xref = [f'xref\n0 {next_number}\n0000000000 65535 f \n']
+    xref.extend(f'{offsets[number]:010d} 00000 n \n' for number in range(1, next_number))
+    xref.append(f'trailer\n<< /Size {next_number} /Root 1 0 R >>\nstartxref\n{size}\n%%EOF\n')
+    parts.append(''.join(xref).encode())
+    return parts
+
+
+def check_tiff_options(compression='lzw', pages=1):
+    """Raise UnsupportedFormat for a TIFF this server won't encode"""
+    if compression not in TIFF_COMPRESSION:
+        raise UnsupportedFormat(f'Unknown TIFF compression: {compression}')
+    if pages > TIFF_MAX_PAGES:
+        raise UnsupportedFormat(f'TIFF output is limited to {TIFF_MAX_PAGES} sheets, use format=pdf for more')
+
+
+def encode_tiff(img, dpi, compression='lzw', pages=1):
+    """Lossless LZW/Deflate TIFF (multi-page for pages > 1) with the DPI tag set.
+
+    Each page is encoded separately, so pages is capped at TIFF_MAX_PAGES.
+    """
+    check_tiff_options(compression, pages)
+    codec = TIFF_COMPRESSION[compression]
+
+    buffered = io.BytesIO()
+    img.save(
+        buffered, format='TIFF', compression=codec, dpi=(dpi, dpi),
+        save_all=pages > 1, append_images=[img] * (pages - 1)
+    )
+    return buffered.getvalue()
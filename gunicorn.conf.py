@@ -0,0 +1,166 @@
+"""Gunicorn settings for the passport photo app (loaded by the Procfile).
+
+The app has two kinds of requests:
+  - /api/remove-background mostly waits on remove.bg (I/O bound)
+  - sheet/pipeline routes spend their time in PIL resize/encode (CPU bound,
+    but PIL releases the GIL while it works)
+
+gthread workers cover both: a few threads per worker keep the CPU busy
+while other threads wait on the network. gevent is available for
+deployments dominated by remove.bg traffic (pip install gevent).
+
+Every setting can be overridden through the environment:
+
+  GUNICORN_WORKER_CLASS  gthread (default), sync or gevent
+  GUNICORN_WORKERS       worker processes (default: from CPUs and memory)
+  GUNICORN_THREADS       threads per gthread worker (default 4)
+  GUNICORN_CONNECTIONS   greenlets per gevent worker (default 100)
+  GUNICORN_WORKER_MEMORY_MB  peak memory per worker for the sizing (default:
+                         derived from the app's own budgets, see below)
+  GUNICORN_MAX_REQUESTS  recycle a worker after N requests (default 500, 0 = never)
+  GUNICORN_PRELOAD       import the app once in the master (default 1)
+  GUNICORN_TIMEOUT       worker timeout in seconds (default 120)
+
+Load test (bench_endpoints.py --mode gunicorn, 1 vCPU / 6 GB container
+shared with the load generator and the remove.bg stub, medium 1200x1400
+uploads, 8 client threads):
+
+                          remove-background (stub 0.5s)   passport sheet
+  config                  p50 / p95       req/s           p50 / p95       req/s
+  sync, 2 workers         4.1s / 4.6s     1.9             2.8s / 3.0s     2.9
+  gthread, 2 x 4 threads  2.3s / 2.6s     3.4             2.5s / 2.7s     3.1
+  gthread, 1 x 8 threads  2.2s / 3.0s     3.5             2.7s / 3.0s     2.9
+
+  with the stub at 2s (closer to real remove.bg latency):
+  sync, 2 workers         10.6s / 10.8s   0.8
+  gthread, 2 x 4 threads  3.6s / 4.8s     1.9
+
+Sheets are CPU bound: on one core, extra workers or threads only queue,
+so throughput stays flat. Threads let remove.bg waits overlap (2.4x at
+2s upstream latency). Peak RSS was 150 MB per 2x4 worker and 250 MB for
+a single 8-thread worker, hence the modest thread count.
+
+Memory sizing: each worker may hold, beyond its ~80 MB baseline, the
+decode budget (INGEST_MEMORY_BUDGET_MB), the in-memory tiers of the
+remove.bg and sheet caches (REMOVEBG_CACHE_MEMORY_MB, SHEET_CACHE_MEMORY_MB)
+and, with JOB_STORAGE=memory, finished job results (REMOVEBG_JOB_RESULTS_MB).
+The default worker count only allows as many workers as fit those sums,
+after reserving room for the batch render processes (about one per core
+host-wide, see batch.py). With the defaults that is 464 MB per worker:
+one worker on a 512 MB instance. Lower the budgets to run more.
+
+Background removal jobs (async=1) are shared through uploads/jobs.db
+(see jobs.py), so polls may land on any worker and finished results
+survive max_requests recycling. Likewise /metrics counters and histograms
+are summed over all workers, past ones included, through uploads/metrics.db.
+"""
+import multiprocessing
+import os
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _memory_mb():
+    """Memory available to this container (cgroup limit if set), in MB"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+            if value.isdigit() and int(value) < 1 << 60:
+                return int(value) // (1024 * 1024)
+        except OSError:
+            pass
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (ValueError, OSError):
+        return None
+
+
+# Resident size of an idle worker: interpreter, Flask, PIL, numpy (~70 MB measured)
+WORKER_BASE_MB = 80
+# One batch render process rendering a sheet
+BATCH_PROCESS_MB = 60
+
+# Per-worker memory budgets of the app: (env var, default), same defaults as app.py
+APP_BUDGETS_MB = [
+    ('INGEST_MEMORY_BUDGET_MB', 256),
+    ('REMOVEBG_CACHE_MEMORY_MB', 64),
+    ('SHEET_CACHE_MEMORY_MB', 64),
+]
+
+
+def _worker_memory_mb():
+    """Peak memory of one worker: its baseline plus everything the app may keep in it"""
+    if 'GUNICORN_WORKER_MEMORY_MB' in os.environ:
+        return _env_int('GUNICORN_WORKER_MEMORY_MB', 0)
+    total = WORKER_BASE_MB + sum(_env_int(name, default) for name, default in APP_BUDGETS_MB)
+    if os.environ.get('JOB_STORAGE', 'sqlite') == 'memory':
+        total += _env_int('REMOVEBG_JOB_RESULTS_MB', 64)
+    if os.environ.get('BATCH_PROCESSES'):
+        total += _env_int('BATCH_PROCESSES', 0) * BATCH_PROCESS_MB
+    return total
+
+
+def _batch_reserve_mb():
+    """Memory for the batch pools when they split the host's cores (BATCH_PROCESSES unset)"""
+    if os.environ.get('BATCH_PROCESSES'):
+        return 0
+    return multiprocessing.cpu_count() * BATCH_PROCESS_MB
+
+
+def _default_workers():
+    """One worker per core (+1 to cover I/O stalls), capped by what memory allows"""
+    workers = multiprocessing.cpu_count() + 1
+    memory = _memory_mb()
+    if memory:
+        workers = min(workers, max(1, (memory - _batch_reserve_mb()) // _worker_memory_mb()))
+    return workers
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = _env_int('GUNICORN_WORKERS', _default_workers())
+# Seen by the app (preloaded after this file runs): batch.py splits the cores among workers
+os.environ['WEB_CONCURRENCY'] = str(workers)
+threads = _env_int('GUNICORN_THREADS', 4)
+worker_connections = _env_int('GUNICORN_CONNECTIONS', 100)
+
+# Load the app (and PIL, numpy) once, share the pages copy-on-write
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# Recycle workers to hand fragmented PIL/numpy heap back to the OS;
+# the jitter keeps them from all restarting at once
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 500)
+max_requests_jitter = max(1, max_requests // 10) if max_requests else 0
+
+# remove.bg calls may take up to 90 s (plus retries)
+timeout = _env_int('GUNICORN_TIMEOUT', 120)
+graceful_timeout = 30
+keepalive = 5
+
+# Heartbeat files on tmpfs: a slow disk must not get workers killed
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+
+
+def on_starting(server):
+    """Warn when the configured workers can outgrow the container's memory"""
+    memory = _memory_mb()
+    needed = workers * _worker_memory_mb() + _batch_reserve_mb()
+    if memory and needed > memory:
+        server.log.warning(
+            'workers=%s may need %s MB at peak but %s MB is available; '
+            'lower INGEST_MEMORY_BUDGET_MB / *_CACHE_MEMORY_MB or GUNICORN_WORKERS', workers, needed, memory
+        )
+
+
+def worker_exit(server, worker):
+    """Hand the exiting worker's last counts to the shared /metrics store"""
+    from metrics import registry
+    registry.flush(force=True)
@@ -0,0 +1,201 @@
+import binascii
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+# Decoded uploads stay in memory up to this size, then spill to a temp file
+SPOOL_MAX_BYTES = int(os.environ.get('INGEST_SPOOL_KB', 1024)) * 1024
+
+# How long a request waits for room in the memory budget before it is turned away
+BUDGET_WAIT = float(os.environ.get('INGEST_BUDGET_WAIT', 10))
+
+CHUNK_SIZE = 64 * 1024
+
+# A data: URI header ("data:image/jpeg;base64,") is always shorter than this
+DATA_URI_PREFIX_LIMIT = 256
+
+WHITESPACE = b' \t\r\n'
+QUOTE, BACKSLASH = ord('"'), ord('\\')
+
+_STRUCTURE = re.compile(rb'["{}\[\]]')
+
+
+class BudgetExceeded(Exception):
+    """No room in the worker's memory budget within BUDGET_WAIT"""
+
+
+class MemoryBudget:
+    """Bytes of decode memory this process may have in flight at once.
+
+    acquire() blocks until the request fits (or raises BudgetExceeded after
+    wait seconds). A request larger than the whole budget still runs when
+    nothing else holds memory, so big-but-allowed photos are never starved;
+    the pixel ceiling in loader bounds those. limit=0 disables the budget.
+    """
+
+    def __init__(self, limit, wait=BUDGET_WAIT):
+        self.limit = limit
+        self.wait = wait
+        self.in_use = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes):
+        if not self.limit:
+            return
+        deadline = time.monotonic() + self.wait
+        with self._cond:
+            while self.in_use and self.in_use + nbytes > self.limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise BudgetExceeded(
+                        f'{self.in_use // (1024 * 1024)} MB of the {self.limit // (1024 * 1024)} MB '
+                        'image memory budget is in use'
+                    )
+                self._cond.wait(remaining)
+            self.in_use += nbytes
+
+    def release(self, nbytes):
+        if not self.limit:
+            return
+        with self._cond:
+            self.in_use = max(0, self.in_use - nbytes)
+            self._cond.notify_all()
+
+
+class Base64Writer:
+    """Decode base64 text fed in arbitrary pieces into a binary file.
+
+    A data: URI header ("data:image/png;base64,") is skipped and bare
+    base64 is accepted. Whitespace (line-wrapped base64) is ignored.
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.head = b''
+        self.pending = b''
+        self.in_body = False
+
+    def write(self, text):
+        if not self.in_body:
+            self.head += text
+            comma = self.head.find(b',')
+            if comma == -1 and len(self.head) < DATA_URI_PREFIX_LIMIT:
+                return
+            text = self.head[comma + 1:]
+            self.head, self.in_body = b'', True
+
+        data = self.pending + text.translate(None, WHITESPACE)
+        usable = len(data) - len(data) % 4
+        if usable:
+            self.out.write(binascii.a2b_base64(data[:usable]))
+        self.pending = data[usable:]
+
+    def close(self):
+        if not self.in_body:
+            # No data: URI header, what was held back is bare base64
+            head, self.head, self.in_body = self.head, b'', True
+            self.write(head)
+        if self.pending:
+            self.out.write(binascii.a2b_base64(self.pending + b'=' * (-len(self.pending) % 4)))
+            self.pending = b''
+
+
+def spool_json_image(stream, field='image', spool_max=SPOOL_MAX_BYTES, chunk_size=CHUNK_SIZE):
+    """Read a JSON object from stream, decoding its top-level base64 `field` on the fly.
+
+    Returns (spool, data): spool is a SpooledTemporaryFile (rewound) with
+    the decoded bytes, or None when the field is missing or not a string;
+    data is the rest of the object with the field set to None. Neither
+    the base64 text nor the JSON body is ever held in memory whole.
+    """
+    key = field.encode('utf-8')
+    rest = bytearray()
+    spool, decoder = None, None
+    in_string = in_image = False
+    depth = 0
+    key_start, last_key = None, None
+    carry = b''
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        buf, carry = carry + chunk, b''
+        pos = 0
+
+        while pos < len(buf):
+            if in_image or in_string:
+                # bytes.find (memchr) rather than a regex: this scans the whole image
+                quote = buf.find(b'"', pos)
+                backslash = buf.find(b'\\', pos, len(buf) if quote == -1 else quote)
+                i = backslash if backslash != -1 else quote
+                if i == -1:
+                    (decoder.write if in_image else rest.extend)(buf[pos:])
+                    break
+                if buf[i] == BACKSLASH:
+                    if i + 1 == len(buf):
+                        (decoder.write if in_image else rest.extend)(buf[pos:i])
+                        carry = buf[i:]
+                        break
+                    if in_image:
+                        decoder.write(buf[pos:i])
+                        escaped = buf[i + 1:i + 2]
+                        if escaped == b'/':
+                            decoder.write(b'/')
+                        elif escaped not in (b'n', b'r'):
+                            raise ValueError(f'Unexpected escape in {field}: \\{escaped.decode("latin-1")}')
+                    else:
+                        rest.extend(buf[pos:i + 2])
+                    pos = i + 2
+                    continue
+
+                # Closing quote
+                if in_image:
+                    decoder.write(buf[pos:i])
+                    decoder.close()
+                    rest.extend(b'null')
+                    in_image = False
+                else:
+                    rest.extend(buf[pos:i + 1])
+                    in_string = False
+                    if key_start is not None:
+                        last_key, key_start = bytes(rest[key_start:-1]), None
+                pos = i + 1
+                continue
+
+            match = _STRUCTURE.search(buf, pos)
+            if match is None:
+                rest.extend(buf[pos:])
+                break
+            i = match.start()
+            rest.extend(buf[pos:i])
+            char = buf[i]
+            pos = i + 1
+
+            if char == QUOTE:
+                before = rest[-64:].rstrip()
+                if depth == 1 and before.endswith(b':') and last_key == key and spool is None:
+                    spool = tempfile.SpooledTemporaryFile(max_size=spool_max)
+                    decoder = Base64Writer(spool)
+                    in_image = True
+                    continue
+                # A string right after '{' or ',' at the top level is a key
+                key_start = len(rest) + 1 if depth == 1 and before[-1:] in (b'{', b',') else None
+                rest.append(char)
+                in_string = True
+            else:
+                depth += 1 if char in b'{[' else -1
+                rest.append(char)
+
+    if in_image or in_string or carry:
+        raise ValueError('Request body is not complete JSON')
+
+    data = json.loads(bytes(rest))
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    if spool is not None:
+        spool.seek(0)
+    return spool, data
@@ -0,0 +1,278 @@
+import os
+import time
+import uuid
+import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+ACTIVE = ('queued', 'running')
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is at its depth limit"""
+
+
+class JobLost(Exception):
+    """The worker process running a job exited before the job finished"""
+
+
+def result_size(result):
+    """Bytes a job result holds on to: its bytes parts (the encoded images)"""
+    if isinstance(result, (bytes, bytearray)):
+        return len(result)
+    if isinstance(result, (tuple, list)):
+        return sum(result_size(part) for part in result)
+    return 0
+
+
+def expired_results(finished, max_results, max_bytes):
+    """Ids of finished jobs past the newest max_results, or past max_bytes of results in total.
+
+    finished is (job_id, finished_at, result_bytes) for every finished job.
+    The newest result is always kept, however large.
+    """
+    newest = sorted(finished, key=lambda job: job[1], reverse=True)
+    total = 0
+    for index, (_, _, size) in enumerate(newest):
+        total += size
+        if index and (index >= max_results or total > max_bytes):
+            return [job[0] for job in newest[index:]]
+    return []
+
+
+class MemoryJobStore:
+    """Job records in process memory (one gunicorn worker's view only)"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def add(self, job, max_pending):
+        """Store a new job unless max_pending jobs are already queued or running"""
+        with self._lock:
+            if sum(1 for other in self._jobs.values() if other['status'] in ACTIVE) >= max_pending:
+                return False
+            self._jobs[job['id']] = dict(job)
+            return True
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def active(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job['status'] in ACTIVE)
+
+    def purge(self, cutoff, max_results, max_bytes):
+        with self._lock:
+            finished = [
+                (job_id, job['finished_at'], job['result_bytes'])
+                for job_id, job in self._jobs.items() if job['finished_at'] is not None
+            ]
+            for job_id, finished_at, _ in finished:
+                if finished_at < cutoff:
+                    del self._jobs[job_id]
+            for job_id in expired_results([job for job in finished if job[1] >= cutoff], max_results, max_bytes):
+                del self._jobs[job_id]
+
+
+class SQLiteJobStore:
+    """Job records and results in a SQLite file, shared by every worker on the host.
+
+    A job can then be polled on any worker, and its result outlives the
+    worker that ran it (max_requests recycling). Jobs left queued or
+    running by a worker that has since died are reported as failed
+    (JobLost) instead of staying pending forever.
+    """
+
+    FIELDS = ('id', 'status', 'pid', 'submitted_at', 'started_at', 'finished_at', 'result', 'error', 'result_bytes')
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._transaction() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, pid INTEGER, '
+                'submitted_at REAL, started_at REAL, finished_at REAL, result BLOB, error BLOB, result_bytes INTEGER)'
+            )
+
+    def _db(self):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db, self._local.pid = db, os.getpid()
+        return self._local.db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    @staticmethod
+    def _dump_error(error):
+        try:
+            data = pickle.dumps(error)
+            pickle.loads(data)  # exceptions with custom __init__ may not load back
+            return data
+        except Exception:
+            return pickle.dumps(RuntimeError(str(error)))
+
+    def _reap(self, db, job_id=None):
+        """Fail the active jobs (or job_id) whose worker process is gone"""
+        query = 'SELECT id, pid FROM jobs WHERE status IN (?, ?)'
+        args = ACTIVE
+        if job_id is not None:
+            query += ' AND id = ?'
+            args += (job_id,)
+        for lost_id, pid in db.execute(query, args).fetchall():
+            if not _alive(pid):
+                error = self._dump_error(JobLost('The server restarted while processing this job. Please retry.'))
+                db.execute('UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+                           ('failed', error, time.time(), lost_id))
+
+    def add(self, job, max_pending):
+        with self._transaction() as db:
+            self._reap(db)
+            active = db.execute('SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)', ACTIVE).fetchone()[0]
+            if active >= max_pending:
+                return False
+            db.execute(
+                f'INSERT INTO jobs ({", ".join(self.FIELDS)}) VALUES ({", ".join("?" * len(self.FIELDS))})',
+                [job.get(field) for field in self.FIELDS]
+            )
+            return True
+
+    def update(self, job_id, **fields):
+        if 'result' in fields:
+            fields['result'] = pickle.dumps(fields['result'])
+        if fields.get('error') is not None:
+            fields['error'] = self._dump_error(fields['error'])
+        with self._transaction() as db:
+            db.execute(f'UPDATE jobs SET {", ".join(f"{name} = ?" for name in fields)} WHERE id = ?',
+                       [*fields.values(), job_id])
+
+    def get(self, job_id):
+        with self._transaction() as db:
+            self._reap(db, job_id)
+            row = db.execute(f'SELECT {", ".join(self.FIELDS)} FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(self.FIELDS, row))
+        for field in ('result', 'error'):
+            if job[field] is not None:
+                job[field] = pickle.loads(job[field])
+        return job
+
+    def active(self):
+        with self._transaction() as db:
+            self._reap(db)
+            return db.execute('SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)', ACTIVE).fetchone()[0]
+
+    def purge(self, cutoff, max_results, max_bytes):
+        with self._transaction() as db:
+            db.execute('DELETE FROM jobs WHERE finished_at < ?', (cutoff,))
+            finished = db.execute(
+                'SELECT id, finished_at, COALESCE(result_bytes, 0) FROM jobs WHERE finished_at IS NOT NULL'
+            ).fetchall()
+            for job_id in expired_results(finished, max_results, max_bytes):
+                db.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    """Bounded thread-pool job queue with per-job status and timing.
+
+    Jobs run on this process's threads; their records live in `store`.
+    With a SQLiteJobStore any worker can answer a poll and max_pending
+    bounds the jobs queued or running across all of them. Finished
+    results are kept for result_ttl seconds, and at most max_results of
+    them (max_result_bytes in total), newest first.
+    """
+
+    def __init__(self, max_workers=4, max_pending=16, result_ttl=300, max_results=32,
+                 max_result_bytes=64 * 1024 * 1024, store=None):
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.max_results = max_results
+        self.max_result_bytes = max_result_bytes
+        self.store = store or MemoryJobStore()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+
+    def depth(self):
+        """Number of jobs queued or running"""
+        return self.store.active()
+
+    def submit(self, fn, *args, **kwargs):
+        """Enqueue fn(*args, **kwargs) and return its job id"""
+        self._purge()
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'status': 'queued',
+            'pid': os.getpid(),
+            'submitted_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None,
+            'result_bytes': 0,
+        }
+        if not self.store.add(job, self.max_pending):
+            raise QueueFull(f'{self.max_pending} jobs pending')
+
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        self.store.update(job_id, status='running', started_at=time.time())
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.store.update(job_id, status='failed', error=e, finished_at=time.time())
+        else:
+            self.store.update(job_id, status='done', result=result, result_bytes=result_size(result),
+                              finished_at=time.time())
+        self._purge()
+
+    def get(self, job_id):
+        """Return a snapshot of the job, or None if unknown/expired"""
+        self._purge()
+        return self.store.get(job_id)
+
+    def _purge(self):
+        self.store.purge(time.time() - self.result_ttl, self.max_results, self.max_result_bytes)
+
+
+def job_timings(job):
+    """Queue wait and run time of a job snapshot, in milliseconds"""
+    now = time.time()
+    started = job['started_at']
+    finished = job['finished_at']
+
+    return {
+        'queued_ms': round(((started or now) - job['submitted_at']) * 1000, 1),
+        'run_ms': round(((finished or now) - started) * 1000, 1) if started else None,
+    }
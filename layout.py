@@ -0,0 +1,117 @@
+import os
+from collections import namedtuple
+from functools import lru_cache
+
+# Paper sizes in inches (width, height), portrait
+PAPER_SIZES = {
+    '4x6': (4, 6),
+    '5x7': (5, 7),
+    'a4': (8.27, 11.69),
+    'letter': (8.5, 11),
+}
+
+# Pixel ceiling for a rendered sheet (an RGB canvas, 3 bytes per pixel): 5x7 in
+# at 1200 DPI fits, letter/A4 at 1200 DPI do not
+MAX_SHEET_PIXELS = int(os.environ.get('MAX_SHEET_PIXELS', 64_000_000))
+
+SheetLayout = namedtuple('SheetLayout', ['sheet_size', 'photo_size', 'rotated', 'cols', 'rows', 'positions'])
+
+
+def paper_size(paper='4x6', width=None, height=None):
+    """Resolve a named paper size (or custom width/height in inches)"""
+    if width and height:
+        width, height = float(width), float(height)
+        if width <= 0 or height <= 0:
+            raise ValueError('Paper size must be positive')
+        return width, height
+    try:
+        return PAPER_SIZES[str(paper).lower()]
+    except KeyError:
+        raise ValueError(f'Unknown paper size: {paper}') from None
+
+
+def _grid(available_width, available_height, photo_width, photo_height, gap, max_photos):
+    cols = max(1, int((available_width - gap) / (photo_width + gap)))
+    rows = max(1, int((available_height - gap) / (photo_height + gap)))
+
+    if max_photos:
+        # Keep the grid as wide as it fits, drop the rows we don't need
+        cols = min(cols, max_photos)
+        rows = min(rows, -(-max_photos // cols))
+
+    count = cols * rows
+    if max_photos:
+        count = min(count, max_photos)
+    return cols, rows, count
+
+
+@lru_cache(maxsize=256)
+def compute_layout(paper_width, paper_height, photo_width, photo_height, dpi=300,
+                   margin=0.0, bleed=0.0, max_photos=None, allow_rotate=True):
+    """Compute paste positions for tiling a photo onto a sheet.
+
+    All sizes are in inches. `margin` is the blank border of the sheet and
+    `bleed` is the minimum clear space kept between photos for cutting. When
+    `allow_rotate` is set and rotating the photo by 90 degrees fits more
+    copies, the rotated placement is used. Results are memoized, so
+    repeated requests for the same layout cost nothing. Raises ValueError
+    for negative spacing or a sheet over MAX_SHEET_PIXELS.
+    """
+    if margin < 0 or bleed < 0:
+        raise ValueError('Margin and bleed cannot be negative')
+
+    sheet_width = int(paper_width * dpi)
+    sheet_height = int(paper_height * dpi)
+    photo_width_px = int(photo_width * dpi)
+    photo_height_px = int(photo_height * dpi)
+    margin_px = int(round(margin * dpi))
+    bleed_px = int(round(bleed * dpi))
+
+    available_width = sheet_width - (2 * margin_px)
+    available_height = sheet_height - (2 * margin_px)
+
+    if sheet_width * sheet_height > MAX_SHEET_PIXELS:
+        raise ValueError(f'Sheet is {sheet_width}x{sheet_height} pixels, '
+                         f'the limit is {MAX_SHEET_PIXELS // 1_000_000} megapixels')
+    if available_width <= 0 or available_height <= 0:
+        raise ValueError('Margin leaves no room on the sheet')
+    if photo_width_px <= 0 or photo_height_px <= 0:
+        raise ValueError('Photo size must be positive')
+
+    rotated = False
+    cols, rows, count = _grid(
+        available_width, available_height,
+        photo_width_px, photo_height_px, bleed_px, max_photos
+    )
+
+    if allow_rotate and photo_width_px != photo_height_px:
+        r_cols, r_rows, r_count = _grid(
+            available_width, available_height,
+            photo_height_px, photo_width_px, bleed_px, max_photos
+        )
+        if r_count > count:
+            rotated = True
+            cols, rows, count = r_cols, r_rows, r_count
+            photo_width_px, photo_height_px = photo_height_px, photo_width_px
+
+    # Even spacing between photos and the sheet edges
+    spacing_x = (available_width - (cols * photo_width_px)) // (cols + 1)
+    spacing_y = (available_height - (rows * photo_height_px)) // (rows + 1)
+
+    positions = []
+    for row in range(rows):
+        for col in range(cols):
+            if len(positions) >= count:
+                break
+            x = margin_px + spacing_x + col * (photo_width_px + spacing_x)
+            y = margin_px + spacing_y + row * (photo_height_px + spacing_y)
+            positions.append((x, y))
+
+    return SheetLayout(
+        sheet_size=(sheet_width, sheet_height),
+        photo_size=(photo_width_px, photo_height_px),
+        rotated=rotated,
+        cols=cols,
+        rows=rows,
+        positions=tuple(positions)
+    )
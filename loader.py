@@ -0,0 +1,102 @@
+from PIL import Image, ImageOps
+import io
+import os
+
+# Pixel-count ceiling for uploads (decompression-bomb guard), 12MP phones fit easily
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 50_000_000))
+
+# Keep at least this factor above the target when pre-shrinking with reduce(),
+# so the final LANCZOS resize still has enough pixels to filter (as in
+# Pillow's reducing_gap)
+REDUCING_GAP = 2
+
+REDUCIBLE_MODES = ('L', 'LA', 'RGB', 'RGBA')
+
+
+class ImageTooLarge(ValueError):
+    """Upload exceeds the MAX_IMAGE_PIXELS ceiling"""
+
+
+def open_image(source, max_pixels=MAX_IMAGE_PIXELS):
+    """Open an upload lazily (header only) and enforce the pixel ceiling.
+
+    source is the upload as bytes or a seekable binary file (a spooled
+    request body); files are rewound, so they can be opened again.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    else:
+        source.seek(0)
+    img = Image.open(source)
+    width, height = img.size
+    if width * height > max_pixels:
+        raise ImageTooLarge(f'Image is {width}x{height} pixels, the limit is {max_pixels // 1_000_000} megapixels')
+    return img
+
+
+def exif_orientation(img):
+    """EXIF Orientation tag of an opened image (1: the pixels are stored upright)"""
+    return img.getexif().get(0x0112, 1)
+
+
+def oriented_size(img):
+    """Size the image will have once its EXIF orientation is applied"""
+    return img.size[::-1] if exif_orientation(img) in (5, 6, 7, 8) else img.size
+
+
+def source_size(source):
+    """Size in bytes of an upload given as bytes or a seekable file"""
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    source.seek(0, io.SEEK_END)
+    return source.tell()
+
+
+def read_source(source):
+    """The upload as bytes (for consumers that need them, e.g. the remove.bg request)"""
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    source.seek(0)
+    return source.read()
+
+
+def decode_cost(img, target=None):
+    """Rough bytes decode_image() will allocate for an opened image.
+
+    JPEGs are counted at the draft scale the decoder will pick for target,
+    everything else at full size. Used to budget concurrent decodes.
+    """
+    width, height = oriented_size(img)
+    if target and img.format == 'JPEG':
+        for scale in (8, 4, 2):
+            if -(-width // scale) >= target[0] and -(-height // scale) >= target[1]:
+                width, height = -(-width // scale), -(-height // scale)
+                break
+    return width * height * (1 if img.mode in ('1', 'L', 'P') else 4)
+
+
+def decode_image(img, target=None):
+    """Decode an opened image, upright, at no more resolution than target needs.
+
+    target is the (width, height) the caller will resize to, in upright
+    orientation. JPEGs are decoded straight at the smallest 1/2, 1/4 or 1/8
+    scale that still covers it (draft mode); other formats are decoded in
+    full and box-reduced while staying REDUCING_GAP times above it.
+    """
+    if target:
+        swapped = oriented_size(img) != img.size
+        img.draft(None, target[::-1] if swapped else target)
+
+    # in_place: the default returns a full copy even when nothing rotates
+    ImageOps.exif_transpose(img, in_place=True)
+
+    if target and img.mode in REDUCIBLE_MODES:
+        factor = min(img.width // target[0], img.height // target[1]) // REDUCING_GAP
+        if factor >= 2:
+            img = img.reduce(factor)
+    return img
+
+
+def load_image(source, target=None, max_pixels=MAX_IMAGE_PIXELS):
+    """open_image() + decode_image(): the one way routes turn uploads into pixels"""
+    return decode_image(open_image(source, max_pixels), target)
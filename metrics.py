@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# Latency buckets (seconds), Prometheus style
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Share of requests whose stage breakdown is logged at INFO (slow ones always are)
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.1))
+LOG_SLOW_MS = float(os.environ.get('LOG_SLOW_MS', 2000))
+
+# How often a worker writes its counters/histograms to the shared store (seconds)
+FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+
+
+class Metrics:
+    """Thread-safe counters, gauges and latency histograms, rendered in the Prometheus text format.
+
+    With a store (SQLiteMetricsStore) counters and histograms are summed
+    over every process sharing it, so any gunicorn worker can answer a
+    scrape with host-wide, monotonic totals. Each process writes its own
+    at most every flush_interval seconds (and on every render). Gauges are
+    never shared: they are the answering worker's own values.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, store=None, flush_interval=FLUSH_SECONDS):
+        self.buckets = tuple(buckets)
+        self.store = store
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}  # key -> [bucket counts..., +Inf count, sum]
+        self._flushed = 0.0
+        self._pid, self._token = None, None
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            histogram[index] += 1
+            histogram[-1] += seconds
+
+    def snapshot(self):
+        """This process's (counters, histograms), copied"""
+        with self._lock:
+            return dict(self._counters), {key: list(values) for key, values in self._histograms.items()}
+
+    def flush(self, force=False):
+        """Write this process's counters and histograms to the store, at most every flush_interval"""
+        now = time.monotonic()
+        if self.store is None or (not force and now - self._flushed < self.flush_interval):
+            return
+        self._flushed = now
+        if self._pid != os.getpid():
+            # One row per process lifetime: a recycled pid must not overwrite a dead worker's counts
+            self._pid, self._token = os.getpid(), uuid.uuid4().hex
+        self.store.save(self._pid, self._token, *self.snapshot())
+
+    def render(self):
+        if self.store is None:
+            counters, histograms = self.snapshot()
+        else:
+            self.flush(force=True)
+            counters, histograms = self.store.totals()
+        with self._lock:
+            gauges = sorted(self._gauges.items())
+        counters = sorted(counters.items())
+        histograms = sorted(histograms.items())
+
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in counters:
+            declare(name, 'counter')
+            lines.append(f'{name}{_labels(labels)} {value}')
+        for (name, labels), value in gauges:
+            declare(name, 'gauge')
+            lines.append(f'{name}{_labels(labels)} {value}')
+        for (name, labels), values in histograms:
+            declare(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {round(values[-1], 6)}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class SQLiteMetricsStore:
+    """Counter/histogram snapshots of every process on the host in a SQLite file.
+
+    Each process replaces its own row. Rows of processes that have exited
+    (max_requests recycling) are folded into one row, so their counts stay
+    in the totals without the table growing.
+    """
+
+    EXITED = 'exited'
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS snapshots (token TEXT PRIMARY KEY, pid INTEGER, data TEXT)')
+
+    def _db(self):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db, self._local.pid = db, os.getpid()
+        return self._local.db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def save(self, pid, token, counters, histograms):
+        with self._transaction() as db:
+            self._fold_exited(db, pid, token)
+            db.execute('INSERT OR REPLACE INTO snapshots (token, pid, data) VALUES (?, ?, ?)',
+                       (token, pid, _dump(counters, histograms)))
+
+    def totals(self):
+        """(counters, histograms) summed over every process, exited ones included"""
+        counters, histograms = {}, {}
+        for (data,) in self._db().execute('SELECT data FROM snapshots').fetchall():
+            _merge(counters, histograms, *_load(data))
+        return counters, histograms
+
+    def _fold_exited(self, db, pid, token):
+        rows = db.execute('SELECT token, pid, data FROM snapshots WHERE token != ?', (self.EXITED,)).fetchall()
+        # Dead processes, and earlier holders of our own (recycled) pid
+        gone = [(other, data) for other, other_pid, data in rows
+                if (other_pid == pid and other != token) or not _alive(other_pid)]
+        if not gone:
+            return
+        row = db.execute('SELECT data FROM snapshots WHERE token = ?', (self.EXITED,)).fetchone()
+        counters, histograms = _load(row[0]) if row else ({}, {})
+        for other, data in gone:
+            _merge(counters, histograms, *_load(data))
+            db.execute('DELETE FROM snapshots WHERE token = ?', (other,))
+        db.execute('INSERT OR REPLACE INTO snapshots (token, pid, data) VALUES (?, ?, ?)',
+                   (self.EXITED, 0, _dump(counters, histograms)))
+
+
+def _dump(counters, histograms):
+    return json.dumps({
+        'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+        'histograms': [[name, labels, values] for (name, labels), values in histograms.items()],
+    })
+
+
+def _load(data):
+    data = json.loads(data)
+    counters = {(name, tuple(map(tuple, labels))): value for name, labels, value in data['counters']}
+    histograms = {(name, tuple(map(tuple, labels))): values for name, labels, values in data['histograms']}
+    return counters, histograms
+
+
+def _merge(counters, histograms, more_counters, more_histograms):
+    for key, value in more_counters.items():
+        counters[key] = counters.get(key, 0) + value
+    for key, values in more_histograms.items():
+        if key in histograms:
+            histograms[key] = [a + b for a, b in zip(histograms[key], values)]
+        else:
+            histograms[key] = list(values)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+registry = Metrics()
+
+# Per-thread stage totals for the request being served
+_trace = threading.local()
+
+
+def start_trace():
+    _trace.stages = {}
+
+
+def end_trace():
+    """Stop collecting and return {stage: seconds} for the current request"""
+    stages = getattr(_trace, 'stages', None) or {}
+    _trace.stages = None
+    return stages
+
+
+@contextmanager
+def stage(name):
+    """Time a hot-path stage: feeds the stage histogram and the current request's trace"""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start_time
+        registry.observe('stage_duration_seconds', elapsed, stage=name)
+        stages = getattr(_trace, 'stages', None)
+        if stages is not None:
+            stages[name] = stages.get(name, 0.0) + elapsed
+
+
+def log_request(route, method, status, seconds, stages):
+    """One key=value line per request: sampled at INFO, always at WARNING when slow"""
+    ms = seconds * 1000
+    if ms >= LOG_SLOW_MS:
+        level = logging.WARNING
+    elif random.random() < LOG_SAMPLE_RATE:
+        level = logging.INFO
+    else:
+        level = logging.DEBUG
+    if not log.isEnabledFor(level):
+        return
+
+    breakdown = ' '.join(f'{name}_ms={elapsed * 1000:.1f}' for name, elapsed in stages.items())
+    log.log(level, 'request route=%s method=%s status=%s ms=%.1f %s', route, method, status, ms, breakdown)
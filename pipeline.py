@@ -0,0 +1,265 @@
+from PIL import Image, ImageFilter
+import logging
+from layout import compute_layout, paper_size
+from encoders import encode_pdf, encode_tiff, encode_raster, timed_encode, check_format, check_tiff_options
+from metrics import stage
+
+log = logging.getLogger(__name__)
+
+SHEET_DPI = 300
+
+# Fixed dimensions for joint photos (inches)
+JOINT_PHOTO_WIDTH = 1.9
+JOINT_PHOTO_HEIGHT = 1.4
+
+
+def fill_background(img, bg_color, feather=0):
+    """Flatten a (possibly transparent) image onto a solid background color.
+
+    Opaque images (no alpha, or alpha all 255) are returned as RGB without
+    compositing. Otherwise the photo is pasted through its own alpha onto
+    a single RGB canvas. feather > 0 blurs the alpha by that many pixels
+    first, for a softer cut edge.
+    """
+    if img.mode == 'P' and 'transparency' in img.info:
+        img = img.convert('RGBA')
+    elif img.mode in ('RGBa', 'La', 'PA'):
+        img = img.convert('RGBA')
+
+    if img.mode not in ('RGBA', 'LA'):
+        return img if img.mode == 'RGB' else img.convert('RGB')
+
+    # Scan the alpha band alone; getextrema() on RGBA would scan all four
+    alpha = img.getchannel('A')
+    if alpha.getextrema()[0] == 255:
+        return img.convert('RGB')
+
+    if feather:
+        alpha = alpha.filter(ImageFilter.GaussianBlur(feather))
+    if img.mode == 'LA':
+        img = img.convert('RGBA')
+
+    background = Image.new('RGB', img.size, bg_color)
+    background.paste(img, (0, 0), alpha)
+    return background
+
+
+def render_sheet(photo, layout):
+    """Paste a photo at every position of a precomputed layout"""
+    with stage('resize'):
+        if layout.rotated:
+            width, height = layout.photo_size
+            photo = photo.resize((height, width), Image.LANCZOS).transpose(Image.ROTATE_90)
+        else:
+            photo = photo.resize(layout.photo_size, Image.LANCZOS)
+
+    with stage('paste'):
+        sheet = Image.new('RGB', layout.sheet_size, 'white')
+        if layout.positions:
+            paste_rows(sheet, photo, layout.positions)
+
+    return sheet, len(layout.positions)
+
+
+def paste_rows(sheet, photo, positions):
+    """Paste the first row cell by cell, then block-copy that row down the sheet"""
+    if photo.mode != sheet.mode:
+        photo = photo.convert(sheet.mode)
+    width, height = photo.size
+
+    rows = {}
+    for x, y in positions:
+        rows.setdefault(y, []).append(x)
+    row_ys = sorted(rows)
+
+    first_y = row_ys[0]
+    first_row = rows[first_y]
+    for x in first_row:
+        sheet.paste(photo, (x, first_y))
+
+    # One strip covering the first row's photos (and the gaps between them)
+    strip_x = first_row[0]
+    strip = sheet.crop((strip_x, first_y, first_row[-1] + width, first_y + height))
+
+    for y in row_ys[1:]:
+        if rows[y] == first_row:
+            sheet.paste(strip, (strip_x, y))
+        else:
+            # Partial last row
+            for x in rows[y]:
+                sheet.paste(photo, (x, y))
+
+
+def sheet_layout(photo_width, photo_height, paper='4x6', paper_width=None, paper_height=None,
+                 dpi=SHEET_DPI, margin=None, bleed=0.0, max_photos=None, allow_rotate=False):
+    """Resolve paper/DPI options into a (memoized) sheet layout.
+
+    Rotated placement is opt-in (rotate=1 on the routes): sheets keep the
+    upright grid they always had unless the client asks for more copies.
+    """
+    paper_w, paper_h = paper_size(paper, paper_width, paper_height)
+    if margin is None:
+        margin = 20 / SHEET_DPI  # 20px at 300 DPI
+    return compute_layout(
+        paper_w, paper_h, photo_width, photo_height,
+        dpi=dpi, margin=margin, bleed=bleed,
+        max_photos=max_photos, allow_rotate=allow_rotate
+    )
+
+
+def passport_layout(photo_width, photo_height, max_photos=12, **options):
+    """Layout of a passport sheet (4x6 inch, max 12 photos by default)"""
+    return sheet_layout(photo_width, photo_height, max_photos=max_photos, **options)
+
+
+def joint_layout(**options):
+    """Layout of a 1.9x1.4 inch joint photo sheet (2x4 on 4x6 inch)"""
+    options.setdefault('margin', 15 / SHEET_DPI)  # 15px at 300 DPI
+    return sheet_layout(JOINT_PHOTO_WIDTH, JOINT_PHOTO_HEIGHT, **options)
+
+
+def sheet_type_layout(sheet_type, photo_width=1.2, photo_height=1.4, sheet_options=None):
+    """Layout of a 'joint' or a normal passport sheet"""
+    if sheet_type == 'joint':
+        return joint_layout(**(sheet_options or {}))
+    return passport_layout(photo_width, photo_height, **(sheet_options or {}))
+
+
+def sheet_photo_size(sheet_type, photo_width=1.2, photo_height=1.4, sheet_options=None):
+    """Size the source photo is resized to before tiling - all the resolution a sheet needs"""
+    layout = sheet_type_layout(sheet_type, photo_width, photo_height, sheet_options)
+    width, height = layout.photo_size
+    return (height, width) if layout.rotated else (width, height)
+
+
+def sheet_canvas_cost(sheet_type, photo_width=1.2, photo_height=1.4, sheet_options=None):
+    """Bytes of the RGB canvas a sheet is pasted onto"""
+    width, height = sheet_type_layout(sheet_type, photo_width, photo_height, sheet_options).sheet_size
+    return width * height * 3
+
+
+def render_passport_sheet(passport_photo, photo_width, photo_height, max_photos=12, **options):
+    """Tile a passport photo onto a sheet (4x6 inch, max 12 photos by default)"""
+    layout = passport_layout(photo_width, photo_height, max_photos=max_photos, **options)
+
+    log.debug('layout cols=%s rows=%s photos=%s rotated=%s',
+              layout.cols, layout.rows, len(layout.positions), layout.rotated)
+
+    return render_sheet(passport_photo, layout)
+
+
+def render_joint_sheet(joint_photo, **options):
+    """Tile a 1.9x1.4 inch joint photo onto a sheet (2x4 on 4x6 inch)"""
+    layout = joint_layout(**options)
+
+    log.debug('layout cols=%s rows=%s photos=%s rotated=%s',
+              layout.cols, layout.rows, len(layout.positions), layout.rotated)
+
+    return render_sheet(joint_photo, layout)
+
+
+def encode_image(img, format_type='png', quality='high', dpi=None, pages=1, compression='lzw', profile=None):
+    """Encode an image to PNG/JPEG/WebP/AVIF/PDF/TIFF bytes using the quality tiers.
+
+    profile names an encoder profile (encoders.ENCODER_PROFILES) for the
+    raster formats and the JPEG inside a PDF. PDF and TIFF carry the
+    physical page size (pixels at dpi) and can repeat the sheet over
+    several pages for print orders.
+    """
+    if format_type == 'pdf':
+        return encode_pdf(img, dpi or SHEET_DPI, quality, pages=pages, profile=profile)
+    if format_type == 'tiff':
+        return encode_tiff(img, dpi or SHEET_DPI, compression, pages=pages)
+
+    return encode_raster(img, format_type, quality, profile, dpi=dpi)
+
+
+def compose(img, bg_color=None, sheet_type=None, photo_width=1.2, photo_height=1.4, sheet_options=None,
+            feather=0):
+    """Background fill, resize and tiling, without encoding.
+
+    bg_color=None skips the background fill (feather softens its edge),
+    sheet_type=None skips the tiling (single photo). sheet_options are passed on to sheet_layout()
+    (paper, dpi, margin, bleed, ...). Returns (image, photos_count, dpi);
+    dpi is None for a single photo.
+    """
+    sheet_options = sheet_options or {}
+    dpi = sheet_options.get('dpi', SHEET_DPI)
+
+    if bg_color is not None:
+        with stage('convert'):
+            img = fill_background(img, bg_color, feather)
+
+    if sheet_type == 'joint':
+        img, count = render_joint_sheet(img, **sheet_options)
+        return img, count, dpi
+
+    if sheet_type == 'normal':
+        img, count = render_passport_sheet(img, photo_width, photo_height, **sheet_options)
+        return img, count, dpi
+
+    return img, 1, None
+
+
+def run_pipeline(img, bg_color=None, sheet_type=None, photo_width=1.2, photo_height=1.4,
+                 format_type='png', quality='high', sheet_options=None, output_options=None, feather=0,
+                 profile=None):
+    """Background fill, resize, tile and encode in one in-memory pass.
+
+    See compose() for the arguments; output_options (pages, compression)
+    and profile go to encode_image(). Returns (encoded_bytes, photos_count,
+    encode_stats).
+    """
+    img, count, dpi = compose(img, bg_color, sheet_type, photo_width, photo_height, sheet_options, feather)
+    with stage('encode'):
+        output, encode_stats = timed_encode(
+            encode_image, img, format_type, quality, dpi=dpi, profile=profile, **(output_options or {})
+        )
+    return output, count, encode_stats
+
+
+def read_sheet_options(data):
+    """Collect optional paper/layout parameters (request fields) for sheet_layout()"""
+    options = {}
+    if data.get('paper'):
+        options['paper'] = data.get('paper')
+    if data.get('paperWidth') and data.get('paperHeight'):
+        options['paper_width'] = float(data.get('paperWidth'))
+        options['paper_height'] = float(data.get('paperHeight'))
+    if data.get('dpi'):
+        options['dpi'] = int(data.get('dpi'))
+    if data.get('margin') is not None:
+        options['margin'] = float(data.get('margin'))
+    if data.get('bleed') is not None:
+        options['bleed'] = float(data.get('bleed'))
+    if data.get('maxPhotos') is not None:
+        # 0 means "as many as fit"
+        max_photos = int(data.get('maxPhotos'))
+        if max_photos < 0:
+            raise ValueError('maxPhotos cannot be negative')
+        options['max_photos'] = max_photos or None
+    if data.get('rotate') is not None:
+        options['allow_rotate'] = str(data.get('rotate')).lower() in ('1', 'true')
+
+    if not 72 <= options.get('dpi', SHEET_DPI) <= 1200:
+        raise ValueError('DPI must be between 72 and 1200')
+    return options
+
+
+def read_output_options(data):
+    """Collect optional print-output parameters (request fields) for encode_image().
+
+    Checked up front, so an unknown format or a TIFF that would be refused
+    is rejected before any decoding.
+    """
+    check_format(data.get('format', 'png'))
+    options = {}
+    if data.get('sheets'):
+        options['pages'] = int(data.get('sheets'))
+        if not 1 <= options['pages'] <= 500:
+            raise ValueError('sheets must be between 1 and 500')
+    if data.get('compression'):
+        options['compression'] = data.get('compression')
+    if data.get('format') == 'tiff':
+        check_tiff_options(**options)
+    return options
@@ -0,0 +1,85 @@
+from PIL import Image
+import io
+import time
+
+from loader import open_image, oriented_size, exif_orientation, decode_image, source_size, read_source
+
+# Output scale per quality tier (same factors the tiers always used)
+QUALITY_SCALE = {'high': 1.0, 'medium': 0.75, 'low': 0.5}
+
+# Highest zoom the editor allows (zoomSlider max in passport_maker.html)
+MAX_ZOOM = 3.0
+
+
+def target_size(image_size, passport_px, quality='high'):
+    """Smallest size that still covers the passport frame at max zoom.
+
+    The editor scales the photo to cover the passport canvas and lets the
+    user zoom in up to MAX_ZOOM, so that is the most resolution the cutout
+    can ever need. Lower quality tiers scale it down further.
+    """
+    width, height = image_size
+    frame_width, frame_height = passport_px
+
+    cover_scale = max(frame_width / width, frame_height / height) * MAX_ZOOM
+    scale = min(1.0, cover_scale * QUALITY_SCALE.get(quality, 0.5))
+
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def preprocess_upload(source, passport_px, quality='high'):
+    """Downsample and re-encode an upload before it goes to the removal engine.
+
+    source is the upload as bytes or a seekable file. Returns
+    (bytes_to_send, target_size, stats); target_size is upright. Uploads
+    that are already small enough, or that would not shrink, are passed
+    through untouched - unless they are stored rotated (EXIF orientation),
+    since the engine's cutout must come back upright. The cutout is still
+    scaled down to fit target_size afterwards.
+    """
+    start_time = time.perf_counter()
+
+    img = open_image(source)
+    size = oriented_size(img)
+    upright = exif_orientation(img) == 1
+    bytes_in = source_size(source)
+
+    target = target_size(size, passport_px, quality)
+    if target == size and upright:
+        return read_source(source), target, _stats(bytes_in, bytes_in, start_time, resized=False)
+
+    # JPEG: let the decoder do the coarse power-of-two downscale
+    img = decode_image(img, target)
+    if img.mode == 'P':
+        img = img.convert('RGBA')
+    img = img.resize(target, Image.LANCZOS)
+
+    buffered = io.BytesIO()
+    if _has_transparency(img):
+        img.save(buffered, format='PNG')
+    else:
+        # Opaque photos go up as JPEG: a fraction of the PNG size, same cutout
+        img.convert('RGB').save(buffered, format='JPEG', quality=95)
+    output = buffered.getvalue()
+
+    if len(output) >= bytes_in and upright:
+        # Re-encoding didn't pay off (e.g. tiny, flat PNG) - send the original
+        return read_source(source), target, _stats(bytes_in, bytes_in, start_time, resized=False)
+
+    return output, target, _stats(bytes_in, len(output), start_time, resized=True)
+
+
+def _has_transparency(img):
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        return img.convert('RGBA').getchannel('A').getextrema()[0] < 255
+    return False
+
+
+def _stats(bytes_in, bytes_out, start_time, resized):
+    return {
+        'resized': resized,
+        'bytes_in': bytes_in,
+        'bytes_out': bytes_out,
+        'bytes_saved': bytes_in - bytes_out,
+        'preprocess_ms': round((time.perf_counter() - start_time) * 1000, 1),
+    }
@@ -0,0 +1,204 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Drop idle buckets every this many take() calls (an idle bucket is a full one)
+PRUNE_EVERY = 1000
+
+
+class RateLimited(Exception):
+    """Client is over its request rate"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Rate limit exceeded, retry in {retry_after:.0f}s')
+        self.retry_after = retry_after
+
+
+class QuotaExhausted(Exception):
+    """The monthly upstream credit budget is used up"""
+
+    def __init__(self, used, limit, retry_after):
+        super().__init__(f'{used:g} of {limit:g} monthly credits used')
+        self.retry_after = retry_after
+
+
+def refill(tokens, updated, capacity, rate, now, cost=1):
+    """Token-bucket step: (tokens left, retry_after); retry_after is 0 when cost was taken"""
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    if tokens >= cost:
+        return tokens - cost, 0
+    return tokens, (cost - tokens) / rate
+
+
+def current_period(now=None):
+    """Quota period (calendar month, UTC) and seconds until the next one starts"""
+    now = datetime.fromtimestamp(time.time() if now is None else now, timezone.utc)
+    year, month = (now.year + 1, 1) if now.month == 12 else (now.year, now.month + 1)
+    next_start = datetime(year, month, 1, tzinfo=timezone.utc)
+    return now.strftime('%Y-%m'), (next_start - now).total_seconds()
+
+
+class MemoryStore:
+    """Buckets + credit ledger in process memory (one gunicorn worker's view only)"""
+
+    def __init__(self):
+        self._buckets = {}  # key -> (tokens, updated)
+        self._usage = {}  # period -> credits
+        self._lock = threading.Lock()
+        self._takes = 0
+
+    def take(self, key, capacity, rate, now, cost=1):
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens, retry_after = refill(tokens, updated, capacity, rate, now, cost)
+            self._buckets[key] = (tokens, now)
+
+            self._takes += 1
+            if self._takes % PRUNE_EVERY == 0:
+                idle = capacity / rate
+                self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < idle}
+            return retry_after
+
+    def charge(self, period, credits, limit):
+        with self._lock:
+            used = self._usage.get(period, 0)
+            if limit and used + credits > limit:
+                return False, used
+            self._usage[period] = used + credits
+            return True, used + credits
+
+    def adjust(self, period, credits=None, minimum=None):
+        """Add credits (negative refunds), or raise usage to at least minimum"""
+        with self._lock:
+            used = self._usage.get(period, 0)
+            if credits is not None:
+                used = max(0, used + credits)
+            if minimum is not None:
+                used = max(used, minimum)
+            self._usage[period] = used
+
+    def used(self, period):
+        with self._lock:
+            return self._usage.get(period, 0)
+
+
+class SQLiteStore:
+    """Buckets + credit ledger in a SQLite file, shared by every worker on the host.
+
+    Each read-modify-write runs in a BEGIN IMMEDIATE transaction, so
+    concurrent workers serialize on the file lock. Connections are per
+    thread and per process (never shared across a gunicorn fork).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+        with self._transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+            db.execute('CREATE TABLE IF NOT EXISTS usage (period TEXT PRIMARY KEY, credits REAL)')
+
+    def _db(self):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db, self._local.pid = db, os.getpid()
+        return self._local.db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def take(self, key, capacity, rate, now, cost=1):
+        with self._transaction() as db:
+            row = db.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row or (capacity, now)
+            tokens, retry_after = refill(tokens, updated, capacity, rate, now, cost)
+            db.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)', (key, tokens, now))
+
+            self._takes += 1
+            if self._takes % PRUNE_EVERY == 0:
+                db.execute('DELETE FROM buckets WHERE updated < ?', (now - capacity / rate,))
+            return retry_after
+
+    def charge(self, period, credits, limit):
+        with self._transaction() as db:
+            row = db.execute('SELECT credits FROM usage WHERE period = ?', (period,)).fetchone()
+            used = row[0] if row else 0
+            if limit and used + credits > limit:
+                return False, used
+            db.execute('INSERT OR REPLACE INTO usage (period, credits) VALUES (?, ?)', (period, used + credits))
+            return True, used + credits
+
+    def adjust(self, period, credits=None, minimum=None):
+        with self._transaction() as db:
+            row = db.execute('SELECT credits FROM usage WHERE period = ?', (period,)).fetchone()
+            used = row[0] if row else 0
+            if credits is not None:
+                used = max(0, used + credits)
+            if minimum is not None:
+                used = max(used, minimum)
+            db.execute('INSERT OR REPLACE INTO usage (period, credits) VALUES (?, ?)', (period, used))
+
+    def used(self, period):
+        row = self._db().execute('SELECT credits FROM usage WHERE period = ?', (period,)).fetchone()
+        return row[0] if row else 0
+
+
+class RateLimiter:
+    """Per-client token bucket: bursts of up to `burst` requests, refilled at per_minute"""
+
+    def __init__(self, store, burst=5, per_minute=10):
+        self.store = store
+        self.burst = burst
+        self.rate = per_minute / 60
+
+    def check(self, client):
+        """Take one token for client, or raise RateLimited"""
+        if not self.rate:
+            return
+        retry_after = self.store.take(f'client:{client}', self.burst, self.rate, time.time())
+        if retry_after:
+            raise RateLimited(retry_after)
+
+
+class QuotaLedger:
+    """Local count of upstream credits spent this month, checked before each paid call.
+
+    charge() reserves credits up front (so concurrent requests can't all
+    squeeze past the limit); refund() gives them back when the call did
+    not consume any. limit=0 counts without enforcing.
+    """
+
+    def __init__(self, store, monthly_limit=50):
+        self.store = store
+        self.limit = monthly_limit
+
+    def charge(self, credits=1):
+        period, retry_after = current_period()
+        ok, used = self.store.charge(period, credits, self.limit)
+        if not ok:
+            raise QuotaExhausted(used, self.limit, retry_after)
+
+    def refund(self, credits=1):
+        self.store.adjust(current_period()[0], credits=-credits)
+
+    def exhaust(self):
+        """Upstream says the quota is gone (402/403): stop forwarding until the period ends"""
+        if self.limit:
+            self.store.adjust(current_period()[0], minimum=self.limit)
+
+    def stats(self):
+        period = current_period()[0]
+        return {'period': period, 'used': self.store.used(period), 'limit': self.limit}
@@ -0,0 +1,142 @@
+import time
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_API_URL = 'https://api.remove.bg/v1.0'
+
+# Never let an upstream Retry-After park a worker for longer than this
+MAX_RETRY_AFTER = 30
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling remove.bg while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    After `threshold` failures in a row the circuit opens and calls fail
+    fast for `reset_timeout` seconds. Then a single trial call is let
+    through (half-open): success closes the circuit, failure re-opens it.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class CappedRetry(Retry):
+    """Retry policy that honors Retry-After up to MAX_RETRY_AFTER seconds"""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, MAX_RETRY_AFTER)
+
+
+class RemoveBgClient:
+    """remove.bg API client with a pooled keep-alive session.
+
+    Transient failures (connection errors, 429 and 5xx) are retried with
+    exponential backoff, honoring Retry-After. Repeated failures trip a
+    circuit breaker so requests fail fast while the upstream is down.
+    """
+
+    def __init__(self, api_key, api_url=DEFAULT_API_URL, pool_size=10, timeout=90,
+                 max_retries=3, backoff_factor=0.5, breaker_threshold=5, breaker_reset=30):
+        self.api_key = api_key
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+
+        retry = CappedRetry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,  # a read timeout may already have spent a credit
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({'GET', 'POST'}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.headers.update({'X-Api-Key': api_key})
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def remove_background(self, image_bytes, size='auto'):
+        """POST an image to /removebg and return the requests.Response"""
+        return self._request(
+            'POST', '/removebg',
+            files={'image_file': image_bytes},
+            data={'size': size}
+        )
+
+    def account(self):
+        """GET /account (credits and free API calls left)"""
+        return self._request('GET', '/account')
+
+    def _request(self, method, path, **kwargs):
+        if not self.breaker.allow():
+            raise CircuitOpenError('remove.bg circuit open, failing fast')
+
+        try:
+            response = self.session.request(method, self.api_url + path, timeout=self.timeout, **kwargs)
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def close(self):
+        self.session.close()
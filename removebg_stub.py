@@ -0,0 +1,139 @@
+"""Local stand-in for the remove.bg API, for tests and benchmarks.
+
+Serves POST /v1.0/removebg and GET /v1.0/account over HTTP/1.1 with
+keep-alive. By default /removebg answers with a transparent PNG of the
+uploaded image's size; queue scripted responses with `stub.push()`.
+
+Run standalone: python removebg_stub.py [port] [latency_seconds]
+"""
+import io
+import sys
+import json
+import time
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+
+def cutout_png(image_bytes):
+    """Fake a cutout: same size as the upload, transparent border"""
+    try:
+        size = Image.open(io.BytesIO(image_bytes)).size
+    except Exception:
+        size = (64, 64)
+    img = Image.new('RGBA', size, (0, 0, 0, 0))
+    img.paste((90, 90, 90, 255), (size[0] // 4, size[1] // 8, size[0] * 3 // 4, size[1]))
+    buffered = io.BytesIO()
+    img.save(buffered, format='PNG')
+    return buffered.getvalue()
+
+
+def read_image_file(headers, body):
+    """Pull image_file out of a multipart/form-data body"""
+    message = BytesParser(policy=HTTP).parsebytes(
+        b'Content-Type: ' + headers['Content-Type'].encode() + b'\r\n\r\n' + body
+    )
+    for part in message.iter_parts():
+        if part.get_param('name', header='content-disposition') == 'image_file':
+            return part.get_payload(decode=True)
+    return b''
+
+
+class RemoveBgStub:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency
+        self.requests = []  # (method, path, client_address)
+        self._responses = []
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub._record(self)
+                if self.path.endswith('/account'):
+                    body = json.dumps({'data': {'attributes': {'api': {'free_calls': 50}}}}).encode()
+                    self._send(200, body, {'Content-Type': 'application/json'})
+                else:
+                    self._send(404, b'Not found', {})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length)
+                stub._record(self)
+
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                scripted = stub._next_response()
+                if scripted is not None:
+                    self._send(*scripted)
+                elif self.path.endswith('/removebg'):
+                    image = read_image_file(self.headers, body)
+                    self._send(200, cutout_png(image), {'Content-Type': 'image/png'})
+                else:
+                    self._send(404, b'Not found', {})
+
+            def _send(self, status, body, headers):
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/v1.0'
+
+    def push(self, status, body=b'', headers=None):
+        """Queue a scripted response for the next request"""
+        with self._lock:
+            self._responses.append((status, body, headers or {}))
+
+    def _next_response(self):
+        with self._lock:
+            return self._responses.pop(0) if self._responses else None
+
+    def _record(self, handler):
+        with self._lock:
+            self.requests.append((handler.command, handler.path, handler.client_address))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    stub = RemoveBgStub(port=port, latency=latency)
+    print(f'remove.bg stub listening on {stub.url}')
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
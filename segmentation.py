@@ -0,0 +1,173 @@
+from PIL import Image, ImageFilter, ImageOps
+import io
+import logging
+import time
+
+import requests
+
+from removebg import CircuitOpenError
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+log = logging.getLogger(__name__)
+
+
+class RemovalError(Exception):
+    """Background removal failed; carries the HTTP status and error payload"""
+
+    def __init__(self, status_code, error, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.error = error
+        self.message = message
+
+    def __reduce__(self):
+        # Failed jobs are pickled into the shared job store (jobs.SQLiteJobStore)
+        return type(self), (self.status_code, self.error, self.message)
+
+
+class SegmentationBackend:
+    """Interface: turn uploaded image bytes into an RGBA cutout"""
+
+    name = None
+
+    def remove_background(self, image_bytes):
+        raise NotImplementedError
+
+
+class RemoveBgBackend(SegmentationBackend):
+    """Remote remove.bg API (paid credits, network round trip)"""
+
+    name = 'removebg'
+
+    def __init__(self, client):
+        self.client = client
+
+    def remove_background(self, image_bytes):
+        try:
+            start_time = time.perf_counter()
+            response = self.client.remove_background(image_bytes, size='auto')
+            log.debug('remove.bg status=%s ms=%.1f bytes=%s', response.status_code,
+                      (time.perf_counter() - start_time) * 1000, len(response.content))
+
+            if response.status_code == 200:
+                return Image.open(io.BytesIO(response.content))
+
+            log.warning('remove.bg error status=%s body=%r', response.status_code, response.text[:500])
+
+            if response.status_code == 403:
+                raise RemovalError(403, 'API quota exceeded', 'Free API limit (50 images/month) reached.')
+            elif response.status_code == 402:
+                raise RemovalError(402, 'Credits exhausted', 'Remove.bg API credits used up.')
+            else:
+                raise RemovalError(response.status_code, 'API error', f'Service error: {response.status_code}')
+
+        except CircuitOpenError as open_err:
+            log.warning('remove.bg circuit open: %s', open_err)
+            raise RemovalError(503, 'Service unavailable', 'Background removal is temporarily unavailable. Please try again shortly.')
+
+        except requests.exceptions.Timeout as timeout_err:
+            log.warning('remove.bg timeout: %s', timeout_err)
+            raise RemovalError(504, 'Request timeout', 'Processing took too long. Try smaller image.')
+
+        except requests.exceptions.ConnectionError as conn_err:
+            log.warning('remove.bg connection error: %s', conn_err)
+            raise RemovalError(503, 'Connection error', 'Cannot connect to removal service.')
+
+
+class LocalBackend(SegmentationBackend):
+    """Offline CPU matting for plain, studio-style backgrounds.
+
+    The background color is estimated from the top/left/right border
+    (the subject usually touches the bottom edge). Pixels close to it in
+    color and without strong edges count as background, but only where
+    they are connected to that border, so a white shirt in front of a
+    white wall keeps its interior. The matte is computed on a downscaled
+    copy with NumPy and upsampled, which gives soft edges for free.
+    """
+
+    name = 'local'
+
+    def __init__(self, work_size=512, border=4, edge_weight=0.5):
+        self.work_size = work_size
+        self.border = border
+        self.edge_weight = edge_weight
+
+    def remove_background(self, image_bytes):
+        if np is None:
+            raise RemovalError(501, 'Engine unavailable', 'Local background removal needs numpy installed.')
+
+        try:
+            img = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+        except Exception as e:
+            raise RemovalError(400, 'Invalid image', str(e))
+
+        rgba = img.convert('RGBA')
+        rgba.putalpha(self.matte(img))
+        return rgba
+
+    def matte(self, img):
+        """Alpha mask (mode L, same size as img) separating subject from background"""
+        small = img.convert('RGB')
+        small.thumbnail((self.work_size, self.work_size), Image.BILINEAR)
+        pixels = np.asarray(small, dtype=np.float32)
+        b = self.border
+
+        border = np.concatenate([
+            pixels[:b].reshape(-1, 3),
+            pixels[:, :b].reshape(-1, 3),
+            pixels[:, -b:].reshape(-1, 3),
+        ])
+        background = np.median(border, axis=0)
+        distance = np.sqrt(((pixels - background) ** 2).sum(axis=2))
+
+        # Edges (luminance gradient) push a pixel towards foreground
+        luminance = pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        grad_y, grad_x = np.gradient(luminance)
+        score = distance + self.edge_weight * np.hypot(grad_x, grad_y)
+
+        # Tolerance adapts to how noisy/uneven the backdrop is
+        spread = np.median(np.sqrt(((border - background) ** 2).sum(axis=1)))
+        low = max(12.0, 3.0 * spread)
+        high = low * 2.5
+
+        connected = self._connected_to_border(score < high)
+        alpha = np.where(connected, np.clip((score - low) / (high - low), 0.0, 1.0), 1.0)
+
+        mask = Image.fromarray((alpha * 255).astype(np.uint8), 'L')
+        mask = mask.filter(ImageFilter.MedianFilter(3))
+        return mask.resize(img.size, Image.BILINEAR)
+
+    def _connected_to_border(self, candidate):
+        """Keep the candidate pixels reachable from the top/left/right border"""
+        region = np.zeros_like(candidate)
+        region[0] = candidate[0]
+        region[:, 0] = candidate[:, 0]
+        region[:, -1] = candidate[:, -1]
+
+        # Alternate whole-run propagation along rows and columns until stable;
+        # far fewer passes than growing the region one pixel at a time
+        while True:
+            grown = _spread_runs(region, candidate)
+            grown = _spread_runs(grown.T, candidate.T).T
+            if np.array_equal(grown, region):
+                return region
+            region = grown
+
+
+def _spread_runs(region, candidate):
+    """Mark every horizontal run of candidate pixels that touches the region"""
+    height, width = candidate.shape
+    flat = np.ascontiguousarray(candidate).ravel()
+    starts = flat.copy()
+    starts[1:] &= ~flat[:-1]
+    starts[::width] = flat[::width]
+
+    run_ids = np.cumsum(starts) * flat
+    touched = np.zeros(int(starts.sum()) + 1, dtype=bool)
+    touched[run_ids[np.ascontiguousarray(region).ravel() & flat]] = True
+    touched[0] = False
+    return touched[run_ids].reshape(height, width)
@@ -162,15 +162,38 @@ document.getElementById('removeBackgroundBtn').addEventListener('click', async (
                 const formData = new FormData();
                 const blob = dataURItoBlob(imageData);
                 formData.append('image', blob, 'photo.png');
+                formData.append('async', '1');
+                // Lets the server downscale to what the passport frame can use
+                formData.append('width', currentPhotoWidth);
+                formData.append('height', currentPhotoHeight);
                 return formData;
             })()
         });
 
+        if (response.status === 429) {
+            // Rate limit, full queue or monthly limit: the server's message says which
+            const limited = await response.json().catch(() => ({}));
+            throw new Error(limited.message || 'Server is busy with other photos. Please try again in a few seconds.');
+        }
         if (!response.ok) {
             throw new Error(`Server error: ${response.status}`);
         }
 
-        const result = await response.json();
+        let result = await response.json();
+
+        // Queued job - poll until it finishes
+        while (response.status === 202 && result.status_url) {
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            const jobResponse = await fetch(result.status_url);
+            if (jobResponse.status === 202) {
+                continue;
+            }
+            result = await jobResponse.json();
+            if (!jobResponse.ok) {
+                throw new Error(result.message || result.error || `Server error: ${jobResponse.status}`);
+            }
+            break;
+        }
 
         if (result.success) {
             const img = new Image();
@@ -213,62 +236,38 @@ document.getElementById('generatePassportBtn').addEventListener('click', async (
 
     try {
         drawCanvas();
-        const imageData = passportCanvas.toDataURL('image/png');
+        const imageBlob = await new Promise(resolve => passportCanvas.toBlob(resolve, 'image/png'));
 
         console.log('Sending image data to server...');
 
-        const response = await fetch('/api/process-passport', {
+        // Background fill + sheet generation in a single request,
+        // uploaded as multipart and returned as raw PNG bytes (no base64)
+        const formData = new FormData();
+        formData.append('image', imageBlob, 'photo.png');
+        formData.append('bgColor', currentBgColor);
+        formData.append('sheetType', sheetType);
+        formData.append('format', 'png');
+        formData.append('width', currentPhotoWidth);
+        formData.append('height', currentPhotoHeight);
+
+        const sheetResponse = await fetch('/api/passport-pipeline?raw=1', {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                image: imageData,
-                bgColor: currentBgColor
-            })
-        });
-
-        if (!response.ok) {
-            throw new Error(`Server error: ${response.status}`);
-        }
-
-        const result = await response.json();
-
-        if (!result.success) {
-            throw new Error(result.error || 'Processing failed');
-        }
-
-        console.log('Image processed, generating sheet...');
-
-        // YEH NAYI LINE - Choose endpoint based on sheet type
-        const endpoint = sheetType === 'joint' ? '/api/generate-joint-sheet' : '/api/generate-passport-sheet';
-
-        const sheetResponse = await fetch(endpoint, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                image: result.image,
-                format: 'png',
-                width: currentPhotoWidth,
-                height: currentPhotoHeight
-            })
+            body: formData
         });
 
         if (!sheetResponse.ok) {
             throw new Error(`Sheet generation error: ${sheetResponse.status}`);
         }
 
-        const sheetResult = await sheetResponse.json();
-
-        if (!sheetResult.success) {
-            throw new Error(sheetResult.error || 'Sheet generation failed');
+        const sheetBlob = await sheetResponse.blob();
+        const finalSheet = document.getElementById('finalPassportSheet');
+        if (finalSheet.src.startsWith('blob:')) {
+            URL.revokeObjectURL(finalSheet.src);
         }
 
         console.log('Sheet generated successfully!');
 
-        document.getElementById('finalPassportSheet').src = sheetResult.image;
+        finalSheet.src = URL.createObjectURL(sheetBlob);
         passportLoading.style.display = 'none';
         passportEditor.style.display = 'none';
         passportFinal.style.display = 'block';
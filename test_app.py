@@ -0,0 +1,288 @@
+import base64
+import io
+import os
+import threading
+import time
+import zipfile
+
+import pytest
+from PIL import Image
+
+# Before the app is imported: no rate-limit database, no limits, no remote calls
+os.environ.setdefault('RATE_LIMIT_STORAGE', 'memory')
+os.environ.setdefault('RATE_LIMIT_PER_MINUTE', '0')
+os.environ.setdefault('REMOVEBG_MONTHLY_CREDITS', '0')
+os.environ.setdefault('REMOVAL_ENGINE', 'local')
+
+from app import app, removal_jobs, memory_budget, removal_backends  # noqa: E402
+from ratelimit import RateLimiter, MemoryStore  # noqa: E402
+from segmentation import LocalBackend  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def photo_bytes(seed=0, size=(360, 420), format='PNG'):
+    """Opaque photo; seed makes each upload unique, so content-keyed caches miss"""
+    img = Image.new('RGB', size, (40 + seed % 200, 90, 160))
+    img.paste((230, 200, 180), (size[0] // 4, size[1] // 5, size[0] * 3 // 4, size[1]))
+    buffered = io.BytesIO()
+    img.save(buffered, format=format)
+    return buffered.getvalue()
+
+
+def data_uri(image_bytes, mimetype='image/png'):
+    return f'data:{mimetype};base64,' + base64.b64encode(image_bytes).decode()
+
+
+def decoded(response):
+    """Image bytes of a JSON (data URI) response"""
+    return base64.b64decode(response.get_json()['image'].split(',', 1)[1])
+
+
+@pytest.mark.parametrize('sheet_type, legacy_route', [
+    ('normal', '/api/generate-passport-sheet'),
+    ('joint', '/api/generate-joint-sheet'),
+])
+def test_pipeline_matches_legacy_sheet_routes(client, sheet_type, legacy_route):
+    image = data_uri(photo_bytes(seed=1))
+
+    pipeline = client.post('/api/passport-pipeline', json={'image': image, 'sheetType': sheet_type})
+    legacy = client.post(legacy_route, json={'image': image})
+
+    assert pipeline.status_code == legacy.status_code == 200
+    assert decoded(pipeline) == decoded(legacy)
+    assert pipeline.get_json()['photos_count'] == legacy.get_json()['photos_count']
+
+
+def test_pipeline_rejects_unknown_sheet_type(client):
+    response = client.post('/api/passport-pipeline', json={'image': data_uri(photo_bytes()), 'sheetType': 'poster'})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('query, headers', [
+    ('?raw=1', {}),
+    ('', {'Accept': 'image/png'}),
+])
+def test_raw_responses(client, query, headers):
+    image = data_uri(photo_bytes(seed=2))
+    response = client.post('/api/generate-passport-sheet' + query, json={'image': image}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert int(response.headers['Content-Length']) == len(response.data)
+    assert response.headers['X-Photos-Count'] == '12'
+    assert Image.open(io.BytesIO(response.data)).size == (1200, 1800)
+
+    # Same bytes as the default JSON response
+    assert response.data == decoded(client.post('/api/generate-passport-sheet', json={'image': image}))
+
+
+def test_plain_fetch_keeps_json(client):
+    response = client.post('/api/process-passport', json={'image': data_uri(photo_bytes())},
+                           headers={'Accept': '*/*'})
+    assert response.is_json
+    assert response.get_json()['success']
+
+
+@pytest.mark.parametrize('fields', [{'dpi': 0}, {'dpi': 4000}, {'dpi': 'high'}, {'width': 0}, {'headRatio': 'big'}])
+def test_autocrop_rejects_bad_photo_size(client, fields):
+    response = client.post('/api/process-passport', json={'image': data_uri(photo_bytes()), 'autoCrop': 1, **fields})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid request'
+
+
+def test_multipart_upload_matches_json(client):
+    image_bytes = photo_bytes(seed=3)
+    multipart = client.post('/api/generate-passport-sheet?raw=1', data={
+        'image': (io.BytesIO(image_bytes), 'photo.png'),
+        'width': '1.2',
+        'height': '1.4',
+    })
+    json_body = client.post('/api/generate-passport-sheet?raw=1', json={'image': data_uri(image_bytes)})
+
+    assert multipart.status_code == 200
+    assert multipart.data == json_body.data
+
+
+@pytest.mark.parametrize('route, fields', [
+    ('/api/generate-passport-sheet', {'dpi': 5000}),
+    ('/api/generate-passport-sheet', {'paper': 'tabloid'}),
+    ('/api/generate-joint-sheet', {'dpi': 'high'}),
+    ('/api/passport-pipeline', {'sheetType': 'normal', 'paper': 'tabloid'}),
+    ('/api/generate-passport-sheet', {'paperWidth': 12, 'paperHeight': 12, 'dpi': 1200, 'maxPhotos': 0}),
+    ('/api/generate-passport-sheet', {'paperWidth': -4, 'paperHeight': 6}),
+    ('/api/generate-passport-sheet', {'bleed': -1.2}),
+    ('/api/generate-passport-sheet', {'margin': -0.5}),
+    ('/api/generate-joint-sheet', {'maxPhotos': -1}),
+    ('/api/generate-passport-sheet', {'format': 'gif'}),
+    ('/api/passport-pipeline', {'sheetType': 'joint', 'format': 'bmp'}),
+])
+def test_invalid_sheet_options_are_400(client, route, fields):
+    response = client.post(route, json={'image': data_uri(photo_bytes()), **fields})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid request'
+
+
+def test_background_removal_job_lifecycle(client):
+    response = client.post('/api/remove-background', data={
+        'image': (io.BytesIO(photo_bytes(seed=4, format='JPEG')), 'photo.jpg'),
+        'async': '1',
+        'engine': 'local',
+    })
+    assert response.status_code == 202
+    status_url = response.get_json()['status_url']
+
+    deadline = time.monotonic() + 10
+    while (poll := client.get(status_url)).status_code == 202 and time.monotonic() < deadline:
+        assert poll.get_json()['status'] in ('queued', 'running')
+        time.sleep(0.05)
+
+    assert poll.status_code == 200
+    job = poll.get_json()
+    assert job['status'] == 'done'
+    assert Image.open(io.BytesIO(decoded(poll))).mode == 'RGBA'
+
+    assert client.get('/api/jobs/0123456789abcdef').status_code == 404
+
+
+def test_rotated_upload_comes_back_upright(client):
+    # Stored 600x400 with red on the left; EXIF orientation 6 shows it 400x600, red on top
+    img = Image.new('RGB', (600, 400), (30, 60, 200))
+    img.paste((220, 30, 30), (0, 0, 300, 400))
+    exif = img.getexif()
+    exif[0x0112] = 6
+    buffered = io.BytesIO()
+    img.save(buffered, format='JPEG', exif=exif)
+
+    response = client.post('/api/remove-background', data={
+        'image': (io.BytesIO(buffered.getvalue()), 'photo.jpg'),
+        'engine': 'local',
+    })
+    assert response.status_code == 200
+    cutout = Image.open(io.BytesIO(decoded(response))).convert('RGB')
+    assert cutout.size == (400, 600)
+    top, bottom = cutout.getpixel((200, 100)), cutout.getpixel((200, 500))
+    assert top[0] > top[2] and bottom[2] > bottom[0]
+
+
+@pytest.mark.parametrize('fields', [{'dpi': 'high'}, {'width': 'wide'}, {'dpi': 0}, {'height': -1}])
+def test_remove_background_rejects_bad_photo_size(client, fields):
+    response = client.post('/api/remove-background', data={
+        'image': (io.BytesIO(photo_bytes(format='JPEG')), 'photo.jpg'),
+        'engine': 'local',
+        **fields,
+    })
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid request'
+
+
+def test_async_removal_waits_for_the_memory_budget(client, monkeypatch):
+    monkeypatch.setattr(memory_budget, 'wait', 0)
+    memory_budget.acquire(memory_budget.limit)  # another request holds the whole budget
+    try:
+        response = client.post('/api/remove-background', data={
+            'image': (io.BytesIO(photo_bytes(seed=10, format='JPEG')), 'photo.jpg'),
+            'async': '1',
+            'engine': 'local',
+        })
+        status_url = response.get_json()['status_url']
+        deadline = time.monotonic() + 5
+        while (poll := client.get(status_url)).status_code == 202 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        memory_budget.release(memory_budget.limit)
+
+    assert poll.status_code == 503
+    assert poll.headers['Retry-After'] == '5'
+    assert memory_budget.in_use == 0
+
+
+def test_only_paid_removals_are_rate_limited(client, monkeypatch):
+    monkeypatch.setattr('app.rate_limiter', RateLimiter(MemoryStore(), burst=1, per_minute=1))
+    monkeypatch.setitem(removal_backends, 'removebg', LocalBackend())  # no network in tests
+
+    def remove(seed, engine):
+        return client.post('/api/remove-background', data={
+            'image': (io.BytesIO(photo_bytes(seed=seed, format='JPEG')), 'photo.jpg'),
+            'engine': engine,
+        })
+
+    first = remove(11, 'removebg')
+    assert (first.status_code, first.headers['X-Cache']) == (200, 'MISS')
+    for _ in range(3):
+        repeat = remove(11, 'removebg')  # the same photo again: served from the cache
+        assert (repeat.status_code, repeat.headers['X-Cache']) == (200, 'HIT')
+        assert repeat.headers['X-Encode-Ms'] == '0'
+        assert repeat.headers['X-Encode-Profile'] == first.headers['X-Encode-Profile']
+        assert repeat.headers['X-Encode-Bytes'] == first.headers['X-Encode-Bytes']
+    assert remove(12, 'local').status_code == 200
+
+    limited = remove(13, 'removebg')
+    assert limited.status_code == 429
+    assert 'Retry-After' in limited.headers
+
+
+def test_batch_route_streams_a_zip(client):
+    response = client.post('/api/batch/sheets', data={
+        'images': [(io.BytesIO(photo_bytes(seed=5)), 'a.png'), (io.BytesIO(photo_bytes(seed=6)), 'b.png')],
+        'sheetType': 'joint',
+    })
+    assert response.status_code == 200
+    assert response.headers['X-Batch-Items'] == '2'
+
+    zf = zipfile.ZipFile(io.BytesIO(response.data))
+    assert sorted(zf.namelist()) == ['a-sheet.png', 'b-sheet.png', 'manifest.json']
+
+    assert client.post('/api/batch/sheets', data={}).status_code == 400
+
+
+def test_tiff_sheets_are_capped(client):
+    image = data_uri(photo_bytes(seed=7))
+    ok = client.post('/api/generate-passport-sheet?raw=1', json={'image': image, 'format': 'tiff', 'sheets': 2})
+    assert ok.status_code == 200
+    assert ok.mimetype == 'image/tiff'
+    assert Image.open(io.BytesIO(ok.data)).n_frames == 2
+
+    for fields in ({'sheets': 100}, {'compression': 'zip'}):
+        response = client.post('/api/generate-passport-sheet', json={'image': image, 'format': 'tiff', **fields})
+        assert response.status_code == 400, fields
+
+    # PDF pages share one image, so long print runs stay allowed there
+    assert client.post('/api/generate-passport-sheet?raw=1',
+                       json={'image': image, 'format': 'pdf', 'sheets': 100}).status_code == 200
+
+
+def test_sheet_cache_miss_then_hit(client):
+    body = {'image': data_uri(photo_bytes(seed=8)), 'width': 1.2, 'height': 1.4}
+
+    miss = client.post('/api/generate-passport-sheet?raw=1', json=body)
+    hit = client.post('/api/generate-passport-sheet?raw=1', json=body)
+    assert (miss.headers['X-Cache'], hit.headers['X-Cache']) == ('MISS', 'HIT')
+    assert hit.data == miss.data
+    assert hit.headers['X-Photos-Count'] == miss.headers['X-Photos-Count'] == '12'
+    assert hit.headers['X-Encode-Bytes'] == miss.headers['X-Encode-Bytes']
+    assert hit.headers['X-Encode-Ms'] == '0'  # nothing was encoded for the hit
+
+    # Any layout/output parameter is part of the key
+    other = client.post('/api/generate-passport-sheet?raw=1', json={**body, 'format': 'jpeg'})
+    assert other.headers['X-Cache'] == 'MISS'
+
+
+def test_job_status_is_202_until_done(client):
+    release = threading.Event()
+    stats = {'bytes_saved': 0, 'preprocess_ms': 0, 'encode': {'profile': 'balanced', 'encode_ms': 1, 'bytes': 3}}
+    job_id = removal_jobs.submit(lambda: release.wait(5) and (photo_bytes(seed=9), stats))
+
+    pending = client.get(f'/api/jobs/{job_id}')
+    assert pending.status_code == 202
+    assert pending.get_json()['status'] in ('queued', 'running')
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while (done := client.get(f'/api/jobs/{job_id}')).status_code == 202 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert done.status_code == 200
+    assert decoded(done) == photo_bytes(seed=9)
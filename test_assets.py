@@ -0,0 +1,72 @@
+import gzip
+import os
+
+import pytest
+
+import assets
+from assets import minify_css, minify_js, build, load_manifest, pick_encoding
+
+CSS = '/* theme */\n[data-theme="a  b"] {\n    font-family: \'Segoe UI\', sans-serif;\n    color: red;\n}\n'
+JS = 'function f() {\n    // comment\n\n    el.innerHTML = `\n        <p>hi</p>\n    `;\n    return 1;\n}\n'
+
+
+def test_minify_css_keeps_strings(monkeypatch):
+    monkeypatch.setattr(assets, 'rcssmin', None)  # the built-in fallback
+    assert minify_css(CSS) == '[data-theme="a  b"]{font-family: \'Segoe UI\',sans-serif;color: red}'
+
+
+def test_minify_js_leaves_template_literals_alone(monkeypatch):
+    monkeypatch.setattr(assets, 'rjsmin', None)
+    assert minify_js(JS) == 'function f() {\nel.innerHTML = `\n        <p>hi</p>\n    `;\nreturn 1;\n}'
+
+
+@pytest.mark.skipif(assets.rcssmin is None or assets.rjsmin is None, reason='rcssmin/rjsmin not installed')
+def test_real_minifiers_keep_strings_and_template_literals():
+    assert '[data-theme="a  b"]' in minify_css(CSS) and "'Segoe UI'" in minify_css(CSS)
+    assert '`\n        <p>hi</p>\n    `' in minify_js(JS)
+    assert '// comment' not in minify_js(JS)
+
+
+def make_static(tmp_path):
+    for source in {source for sources in assets.BUNDLES.values() for source in sources}:
+        path = tmp_path / source
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text('body { color: red; }\n' if source.endswith('.css') else 'var x = 1;\n')
+
+
+def test_build_writes_hashed_and_compressed_bundles(tmp_path):
+    make_static(tmp_path)
+    manifest = build(str(tmp_path))
+
+    dist = tmp_path / assets.DIST_DIR
+    filename = manifest['maker.js']
+    assert filename.startswith('maker.') and filename.endswith('.js')
+    content = (dist / filename).read_bytes()
+    assert gzip.decompress((dist / (filename + '.gz')).read_bytes()) == content
+    if assets.brotli is not None:
+        assert assets.brotli.decompress((dist / (filename + '.br')).read_bytes()) == content
+        assert pick_encoding(str(dist / filename), 'gzip, br')[1] == 'br'
+    assert load_manifest(str(tmp_path)) == manifest
+
+
+def test_source_change_rebuilds_under_a_new_name(tmp_path):
+    make_static(tmp_path)
+    old = build(str(tmp_path))['home.js']
+
+    main_js = tmp_path / 'js' / 'main.js'
+    main_js.write_text('var y = 2;\n')
+    later = os.path.getmtime(tmp_path / assets.DIST_DIR / assets.MANIFEST) + 10
+    os.utime(main_js, (later, later))
+
+    new = load_manifest(str(tmp_path))['home.js']
+    assert new != old
+    assert not (tmp_path / assets.DIST_DIR / old).exists()
+
+
+def test_pick_encoding(tmp_path):
+    path = tmp_path / 'a.js'
+    path.write_text('x')
+    (tmp_path / 'a.js.gz').write_bytes(gzip.compress(b'x'))
+
+    assert pick_encoding(str(path), 'gzip, deflate, br') == (str(path) + '.gz', 'gzip')
+    assert pick_encoding(str(path), 'identity') == (str(path), None)
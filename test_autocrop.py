@@ -0,0 +1,62 @@
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+import autocrop
+from autocrop import crop_box, auto_crop, NoFaceFound
+
+SKIN = (224, 172, 140)
+
+
+def portrait(size=(1200, 1600), face=(450, 400, 750, 800)):
+    """Flat backdrop, skin-colored oval face, dark shirt"""
+    img = Image.new('RGB', size, (70, 110, 190))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse(face, fill=SKIN)
+    draw.rectangle((250, 1100, 950, 1600), fill=(30, 30, 30))
+    buffered = io.BytesIO()
+    img.save(buffered, format='JPEG', quality=95)
+    return buffered.getvalue()
+
+
+def test_crop_box_sets_head_height_and_eye_line():
+    face = (400, 300, 200, 200)
+    left, top, right, bottom = crop_box((2000, 2000), face, eye_y=384, photo_aspect=1.0,
+                                        head_ratio=0.5, eye_line=0.4)
+    head_height = 200 * 1.35
+    assert bottom - top == pytest.approx(head_height / 0.5)
+    assert right - left == pytest.approx(bottom - top)
+    assert (left + right) / 2 == pytest.approx(500)
+    assert 384 - top == pytest.approx(0.4 * (bottom - top))
+
+
+def test_crop_box_stays_inside_the_image():
+    left, top, right, bottom = crop_box((500, 500), (0, 0, 200, 200), eye_y=80, photo_aspect=0.8)
+    assert left >= 0 and top >= 0
+    assert right <= 500 and bottom <= 500
+
+
+def test_skin_heuristic_frames_the_face(monkeypatch):
+    pytest.importorskip('numpy')
+    monkeypatch.setattr(autocrop, 'cv2', None)
+
+    photo, info = auto_crop(portrait(), (360, 420))
+    assert photo.size == (360, 420)
+    assert info['detector'] == 'skin'
+
+    x, y, w, h = info['face']
+    assert abs((x + w / 2) - 600) < 30  # face center
+    assert abs(y - 400) < 30  # top of the face
+    left, top, right, bottom = info['crop']
+    assert left < 450 and right > 750 and top < 400
+
+
+def test_no_face(monkeypatch):
+    pytest.importorskip('numpy')
+    monkeypatch.setattr(autocrop, 'cv2', None)
+
+    buffered = io.BytesIO()
+    Image.new('RGB', (800, 600), (70, 110, 190)).save(buffered, format='JPEG')
+    with pytest.raises(NoFaceFound):
+        auto_crop(buffered.getvalue(), (360, 420))
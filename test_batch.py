@@ -0,0 +1,86 @@
+import io
+import json
+import zipfile
+
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage, MultiDict
+
+from batch import BatchError, read_batch_items, stream_zip, build_pdf, BATCH_MAX_ITEMS
+
+
+def photo(color='navy', size=(240, 280)):
+    buffered = io.BytesIO()
+    Image.new('RGB', size, color).save(buffered, format='JPEG')
+    return buffered.getvalue()
+
+
+def upload(data, filename):
+    return FileStorage(io.BytesIO(data), filename=filename)
+
+
+def archive(names):
+    buffered = io.BytesIO()
+    with zipfile.ZipFile(buffered, 'w') as zf:
+        for name in names:
+            zf.writestr(name, photo())
+    return buffered.getvalue()
+
+
+def test_items_from_parts_and_archive_with_overrides():
+    files = MultiDict([
+        ('images', upload(photo(), 'a.jpg')),
+        ('archive', upload(archive(['set/b.jpg', 'set/.hidden.jpg', 'notes.txt']), 'set.zip')),
+    ])
+    form = {'sheetType': 'normal', 'items': json.dumps([{'name': 'b.jpg', 'sheetType': 'joint'}])}
+
+    items = read_batch_items(files, form)
+    assert [(name, options['sheetType']) for name, _, options in items] == [('a.jpg', 'normal'), ('b.jpg', 'joint')]
+
+
+def test_item_bytes_are_reserved_before_they_are_read():
+    parts = [upload(photo(), 'a.jpg'), upload(photo('maroon'), 'b.jpg')]
+    zipped = upload(archive(['c.jpg']), 'set.zip')
+    reserved = []
+
+    items = read_batch_items(MultiDict([('images', parts[0]), ('images', parts[1]), ('archive', zipped)]), {},
+                             reserve=reserved.append)
+    assert reserved == [sum(len(image_bytes) for _, image_bytes, _ in items)]
+
+
+@pytest.mark.parametrize('files, form', [
+    (MultiDict(), {}),
+    (MultiDict([('images', upload(photo(), 'a.jpg'))] * (BATCH_MAX_ITEMS + 1)), {}),
+    (MultiDict([('images', upload(photo(), 'a.jpg'))]), {'items': 'not json'}),
+    (MultiDict([('archive', upload(b'not a zip', 'x.zip'))]), {}),
+])
+def test_invalid_batches(files, form):
+    with pytest.raises(BatchError):
+        read_batch_items(files, form)
+
+
+def test_zip_has_a_sheet_per_item_and_reports_failures():
+    items = [
+        ('a.jpg', photo(), {}),
+        ('b.jpg', photo('maroon'), {'sheetType': 'joint', 'format': 'jpeg'}),
+        ('broken.jpg', b'not an image', {}),
+    ]
+    zf = zipfile.ZipFile(io.BytesIO(b''.join(stream_zip(items))))
+
+    assert sorted(zf.namelist()) == ['a-sheet.png', 'b-sheet.jpg', 'manifest.json']
+    assert Image.open(io.BytesIO(zf.read('a-sheet.png'))).size == (1200, 1800)
+
+    manifest = json.loads(zf.read('manifest.json'))
+    assert [entry['name'] for entry in manifest] == ['a.jpg', 'b.jpg', 'broken.jpg']
+    assert [entry.get('photos_count') for entry in manifest] == [12, 8, None]
+    assert 'error' in manifest[2]
+
+
+def test_pdf_has_one_page_per_sheet():
+    parts, size, manifest = build_pdf([('a.jpg', photo(), {}), ('b.jpg', photo(), {'paper': '5x7'})])
+    pdf = b''.join(parts)
+
+    assert len(pdf) == size
+    assert b'/Count 2' in pdf
+    assert b'/MediaBox [0 0 360.0 504.0]' in pdf
+    assert len(manifest) == 2
@@ -0,0 +1,82 @@
+import os
+
+from cache import ResultCache, PageCache, make_key
+
+
+def test_key_depends_on_every_part():
+    assert make_key(b'photo', 'high') == make_key(b'photo', 'high')
+    assert make_key(b'photo', 'high') != make_key(b'photo', 'low')
+    assert make_key(b'ab', 'c') != make_key(b'a', 'bc')
+
+
+def test_memory_hit_then_disk_hit(tmp_path):
+    cache = ResultCache(str(tmp_path), memory_limit=10, disk_limit=100)
+    cache.put('a', b'12345678')
+    cache.put('b', b'12345678')  # evicts 'a' from memory, both stay on disk
+
+    assert cache.get('b') == b'12345678'
+    assert cache.get('a') == b'12345678'
+    assert cache.get('missing') is None
+
+    stats = cache.stats()
+    assert stats['memory_hits'] == 1
+    assert stats['disk_hits'] == 1
+    assert stats['misses'] == 1
+
+
+def test_disk_lru_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path), memory_limit=0, disk_limit=10)
+    cache.put('a', b'12345')
+    cache.put('b', b'12345')
+    cache.get('a')  # 'b' is now least recently used
+    cache.put('c', b'12345')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == b'12345'
+    assert cache.get('c') == b'12345'
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a.bin', 'c.bin']
+
+
+def test_page_cache_rebuilds_when_a_source_changes(tmp_path):
+    template = tmp_path / 'page.html'
+    template.write_text('v1')
+    renders = []
+
+    def render():
+        renders.append(1)
+        return template.read_text()
+
+    cache = PageCache()
+    body, etag, last_modified, hit = cache.get('/page', [str(template)], render)
+    assert (body, hit) == (b'v1', False)
+    assert cache.get('/page', [str(template)], render) == (body, etag, last_modified, True)
+    assert len(renders) == 1
+
+    template.write_text('v2')
+    later = os.path.getmtime(template) + 10
+    os.utime(template, (later, later))
+    body, new_etag, new_last_modified, hit = cache.get('/page', [str(template)], render)
+    assert (body, hit) == (b'v2', False)
+    assert new_etag != etag
+    assert new_last_modified == int(later)
+
+
+def test_disk_tier_is_shared_and_bounded_per_host(tmp_path):
+    # Two gunicorn workers over one directory
+    worker_a = ResultCache(str(tmp_path), memory_limit=0, disk_limit=12)
+    worker_b = ResultCache(str(tmp_path), memory_limit=0, disk_limit=12)
+
+    worker_a.put('a', b'1234')
+    assert worker_b.get('a') == b'1234'  # written by the other worker
+
+    worker_b.put('b', b'1234')
+    worker_a.put('c', b'1234')
+    worker_a.get('b')  # 'a' is now the least recently used, by either worker
+    worker_b.put('d', b'1234')
+
+    assert sum(p.stat().st_size for p in tmp_path.iterdir()) == 12
+    assert worker_a.get('a') is None
+    assert worker_a.get('b') == worker_a.get('d') == b'1234'
+
+    # A restarted worker sees what is already on disk
+    assert ResultCache(str(tmp_path), disk_limit=12).stats()['disk_entries'] == 3
@@ -0,0 +1,65 @@
+import io
+
+import pytest
+from PIL import Image, ImageFilter, JpegImagePlugin, features
+
+from encoders import encode_raster, encode_pdf, jpeg_for_pdf, encoder_profile, timed_encode, UnsupportedFormat
+
+
+@pytest.fixture(scope='module')
+def photo():
+    return Image.effect_noise((300, 350), 30).convert('RGB').filter(ImageFilter.GaussianBlur(1))
+
+
+def test_profiles_change_png_effort(photo):
+    fast = encode_raster(photo, 'png', profile='fast')
+    smallest = encode_raster(photo, 'png', profile='smallest')
+    assert len(smallest) < len(fast)
+    assert Image.open(io.BytesIO(fast)).tobytes() == Image.open(io.BytesIO(smallest)).tobytes()
+
+
+def test_profiles_change_jpeg_settings(photo):
+    balanced = Image.open(io.BytesIO(encode_raster(photo, 'jpeg', profile='balanced')))
+    smallest = Image.open(io.BytesIO(encode_raster(photo, 'jpeg', profile='smallest')))
+    printed = Image.open(io.BytesIO(encode_raster(photo, 'jpeg', profile='print')))
+
+    assert not balanced.info.get('progressive') and smallest.info.get('progressive')
+    assert JpegImagePlugin.get_sampling(balanced) == 2  # 4:2:0
+    assert JpegImagePlugin.get_sampling(printed) == 0  # 4:4:4
+
+
+@pytest.mark.skipif(not features.check('webp'), reason='Pillow built without libwebp')
+def test_webp_output_is_webp(photo):
+    output = encode_raster(photo, 'webp')
+    assert output[:4] == b'RIFF' and output[8:12] == b'WEBP'
+    assert Image.open(io.BytesIO(output)).format == 'WEBP'
+
+    # The print profile is lossless
+    lossless = Image.open(io.BytesIO(encode_raster(photo, 'webp', profile='print')))
+    assert lossless.convert('RGB').tobytes() == photo.tobytes()
+
+
+def test_unknown_profile_is_rejected(photo):
+    with pytest.raises(UnsupportedFormat):
+        encoder_profile('tiny')
+    with pytest.raises(UnsupportedFormat):
+        encode_raster(photo, 'png', profile='tiny')
+
+
+def test_unknown_format_is_rejected(photo):
+    with pytest.raises(UnsupportedFormat):
+        encode_raster(photo, 'gif')
+
+
+def test_pdf_jpeg_follows_the_profile(photo):
+    printed = Image.open(io.BytesIO(jpeg_for_pdf(photo, profile='print')))
+    assert JpegImagePlugin.get_sampling(printed) == 0  # 4:4:4
+    assert JpegImagePlugin.get_sampling(Image.open(io.BytesIO(jpeg_for_pdf(photo)))) == 2
+    assert jpeg_for_pdf(photo, profile='print') in encode_pdf(photo, 300, profile='print')
+
+
+def test_timed_encode_reports_profile_and_size(photo):
+    output, stats = timed_encode(encode_raster, photo, 'jpeg', 'medium', profile='fast')
+    assert stats['profile'] == 'fast'
+    assert stats['bytes'] == len(output)
+    assert stats['encode_ms'] >= 0
@@ -0,0 +1,73 @@
+import base64
+import io
+import json
+import os
+import threading
+
+import pytest
+
+from ingest import spool_json_image, MemoryBudget, BudgetExceeded
+
+
+class Trickle(io.BytesIO):
+    """Body stream that hands out a few bytes per read, like a slow client"""
+
+    def read(self, size=-1):
+        return super().read(min(size, 7) if size and size > 0 else 7)
+
+
+def test_data_uri_is_decoded_across_chunk_boundaries():
+    raw = os.urandom(5000)
+    body = json.dumps({
+        'format': 'jpg',
+        'image': 'data:image/png;base64,' + base64.b64encode(raw).decode(),
+        'sheet': {'image': 'nested, left alone'},
+    }).replace('/', '\\/')  # some encoders escape slashes
+
+    spool, data = spool_json_image(Trickle(body.encode()))
+    assert spool.read() == raw
+    assert data == {'format': 'jpg', 'image': None, 'sheet': {'image': 'nested, left alone'}}
+
+
+def test_bare_base64_and_missing_image():
+    spool, data = spool_json_image(io.BytesIO(json.dumps({'image': 'aGVsbG8='}).encode()))
+    assert spool.read() == b'hello'
+
+    spool, data = spool_json_image(io.BytesIO(b'{"bgColor": "#fff", "note": "\\"image\\": x"}'))
+    assert spool is None
+    assert data == {'bgColor': '#fff', 'note': '"image": x'}
+
+
+def test_large_uploads_spill_to_disk():
+    raw = os.urandom(200_000)
+    body = json.dumps({'image': base64.b64encode(raw).decode()}).encode()
+    spool, _ = spool_json_image(io.BytesIO(body), spool_max=64 * 1024)
+    assert spool._rolled
+    assert spool.read() == raw
+
+
+def test_truncated_body():
+    with pytest.raises(ValueError):
+        spool_json_image(io.BytesIO(b'{"image": "aGVsbG8'))
+
+
+def test_budget_blocks_until_memory_is_released():
+    budget = MemoryBudget(100, wait=5)
+    budget.acquire(80)
+
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (budget.acquire(50), acquired.set()))
+    waiter.start()
+    assert not acquired.wait(0.1)
+
+    budget.release(80)
+    assert acquired.wait(5)
+    waiter.join()
+    assert budget.in_use == 50
+
+
+def test_budget_times_out_but_lets_one_oversized_request_through():
+    budget = MemoryBudget(100, wait=0.05)
+    budget.acquire(500)  # alone: allowed
+    with pytest.raises(BudgetExceeded):
+        budget.acquire(1)
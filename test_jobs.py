@@ -0,0 +1,84 @@
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from jobs import JobQueue, MemoryJobStore, SQLiteJobStore, JobLost, QueueFull
+from segmentation import RemovalError
+
+
+def make_store(kind, tmp_path):
+    return MemoryJobStore() if kind == 'memory' else SQLiteJobStore(str(tmp_path / 'jobs.db'))
+
+
+def wait_done(queue, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job['status'] not in ('queued', 'running'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'job {job_id} still pending')
+
+
+@pytest.mark.parametrize('kind', ['memory', 'sqlite'])
+def test_results_and_errors_round_trip(kind, tmp_path):
+    queue = JobQueue(max_workers=2, store=make_store(kind, tmp_path))
+
+    done = wait_done(queue, queue.submit(lambda: (b'png', {'bytes_saved': 3})))
+    assert done['status'] == 'done'
+    assert done['result'] == (b'png', {'bytes_saved': 3})
+
+    def fail():
+        raise RemovalError(402, 'Credits exhausted', 'Remove.bg API credits used up.')
+
+    failed = wait_done(queue, queue.submit(fail))
+    assert failed['status'] == 'failed'
+    assert (failed['error'].status_code, failed['error'].message) == (402, 'Remove.bg API credits used up.')
+    assert queue.get('missing') is None
+
+
+@pytest.mark.parametrize('kind', ['memory', 'sqlite'])
+def test_finished_results_are_capped(kind, tmp_path):
+    queue = JobQueue(max_workers=1, max_results=2, max_result_bytes=25, store=make_store(kind, tmp_path))
+
+    ids = [wait_done(queue, queue.submit(lambda: b'x' * 10))['id'] for _ in range(3)]
+    assert queue.get(ids[0]) is None  # only the newest two are kept
+    assert queue.get(ids[2])['result'] == b'x' * 10
+
+    big = wait_done(queue, queue.submit(lambda: b'x' * 100))['id']
+    assert queue.get(big) is not None  # the newest result is kept even over the byte cap
+    assert queue.get(ids[2]) is None
+
+
+def test_expired_results_are_purged_on_get(tmp_path):
+    queue = JobQueue(result_ttl=0.05, store=MemoryJobStore())
+    job_id = wait_done(queue, queue.submit(lambda: b'png'))['id']
+    time.sleep(0.1)
+    assert queue.get(job_id) is None
+
+
+def test_sqlite_store_is_shared_between_workers(tmp_path):
+    release = threading.Event()
+    worker_a = JobQueue(max_pending=1, store=SQLiteJobStore(str(tmp_path / 'jobs.db')))
+    worker_b = JobQueue(max_pending=1, store=SQLiteJobStore(str(tmp_path / 'jobs.db')))
+
+    job_id = worker_a.submit(lambda: release.wait(5) and b'png')
+    with pytest.raises(QueueFull):
+        worker_b.submit(lambda: b'png')
+
+    release.set()
+    assert wait_done(worker_b, job_id)['result'] == b'png'
+
+
+def test_job_of_a_dead_worker_is_reported_lost(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / 'jobs.db'))
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    store.add({'id': 'lost', 'status': 'running', 'pid': dead.pid, 'submitted_at': time.time()}, max_pending=4)
+
+    job = JobQueue(store=store).get('lost')
+    assert job['status'] == 'failed'
+    assert isinstance(job['error'], JobLost)
@@ -0,0 +1,68 @@
+import pytest
+
+from layout import compute_layout, paper_size, MAX_SHEET_PIXELS
+from pipeline import passport_layout
+
+
+def test_default_passport_sheet_is_3x4():
+    layout = compute_layout(4, 6, 1.2, 1.4, dpi=300, margin=20 / 300, max_photos=12)
+    assert layout.sheet_size == (1200, 1800)
+    assert (layout.cols, layout.rows, layout.rotated) == (3, 4, False)
+    assert layout.positions[0] == (40, 36)
+    assert len(layout.positions) == 12
+
+
+def test_rotation_used_when_it_fits_more():
+    # 2.5x1.8in on 4x6: 1x3 upright vs 2x2 rotated
+    upright = compute_layout(4, 6, 2.5, 1.8, allow_rotate=False)
+    rotated = compute_layout(4, 6, 2.5, 1.8)
+    assert rotated.rotated
+    assert rotated.photo_size == (540, 750)
+    assert len(rotated.positions) > len(upright.positions)
+
+
+def test_photos_never_overlap_and_respect_bleed():
+    layout = compute_layout(8.5, 11, 2, 2, dpi=600, margin=0.1, bleed=0.1)
+    width, height = layout.photo_size
+    xs = sorted({x for x, _ in layout.positions})
+    assert all(b - a >= width + 60 for a, b in zip(xs, xs[1:]))
+    assert xs[-1] + width <= layout.sheet_size[0]
+
+
+def test_layout_is_memoized():
+    assert compute_layout(5, 7, 2, 2) is compute_layout(5, 7, 2, 2)
+
+
+def test_paper_sizes():
+    assert paper_size('A4') == (8.27, 11.69)
+    assert paper_size(width=3, height=5) == (3.0, 5.0)
+    with pytest.raises(ValueError):
+        paper_size('tabloid')
+    with pytest.raises(ValueError):
+        paper_size(width=-4, height=6)
+
+
+def test_sheet_routes_rotate_only_on_request():
+    # The maker's "UK Passport (1.38x1.77)" preset keeps its upright 2x3 grid
+    upright = passport_layout(1.38, 1.77)
+    assert (upright.cols, upright.rows, len(upright.positions), upright.rotated) == (2, 3, 6, False)
+
+    rotated = passport_layout(1.38, 1.77, allow_rotate=True)
+    assert (len(rotated.positions), rotated.rotated) == (8, True)
+
+
+@pytest.mark.parametrize('paper, options', [
+    ((4, 6), {'bleed': -1.2}),  # used to divide by zero
+    ((4, 6), {'margin': -0.5}),
+    ((4, 6), {'margin': 3}),  # nothing left to tile
+    ((12, 12), {'dpi': 1200}),
+    ((200, 200), {'dpi': 1200}),
+])
+def test_invalid_sheets_are_rejected(paper, options):
+    with pytest.raises(ValueError):
+        compute_layout(*paper, 1.2, 1.4, **options)
+
+
+def test_sheet_pixel_ceiling_allows_5x7_at_1200_dpi():
+    layout = compute_layout(5, 7, 1.2, 1.4, dpi=1200)
+    assert layout.sheet_size[0] * layout.sheet_size[1] <= MAX_SHEET_PIXELS
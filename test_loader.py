@@ -0,0 +1,46 @@
+import io
+
+import pytest
+from PIL import Image
+
+from loader import load_image, ImageTooLarge
+
+
+def encode(img, fmt, **params):
+    buffered = io.BytesIO()
+    img.save(buffered, format=fmt, **params)
+    return buffered.getvalue()
+
+
+def test_jpeg_is_drafted_to_the_smallest_scale_covering_the_target():
+    data = encode(Image.new('RGB', (4000, 3000), 'red'), 'JPEG')
+    img = load_image(data, (360, 420))
+    assert img.size == (1000, 750)
+    assert img.width >= 360 and img.height >= 420
+
+
+def test_without_target_decodes_full_size():
+    data = encode(Image.new('RGB', (800, 600), 'red'), 'JPEG')
+    assert load_image(data).size == (800, 600)
+
+
+def test_png_is_reduced_but_stays_above_twice_the_target():
+    data = encode(Image.new('RGB', (3000, 3600), 'red'), 'PNG')
+    img = load_image(data, (300, 360))
+    assert img.size == (600, 720)
+
+
+def test_exif_orientation_is_applied():
+    img = Image.new('RGB', (400, 200), 'red')
+    exif = img.getexif()
+    exif[0x0112] = 6  # rotate 90 degrees clockwise
+    data = encode(img, 'JPEG', exif=exif)
+
+    assert load_image(data).size == (200, 400)
+    assert load_image(data, (100, 200)).size == (100, 200)
+
+
+def test_pixel_ceiling():
+    data = encode(Image.new('L', (2000, 2000)), 'PNG')
+    with pytest.raises(ImageTooLarge):
+        load_image(data, max_pixels=1_000_000)
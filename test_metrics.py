@@ -0,0 +1,78 @@
+import subprocess
+import sys
+
+from metrics import Metrics, SQLiteMetricsStore, stage, start_trace, end_trace
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    metrics.observe('latency', 0.05, route='/a')
+    metrics.observe('latency', 0.5, route='/a')
+    metrics.observe('latency', 5.0, route='/a')
+
+    text = metrics.render()
+    assert 'latency_bucket{route="/a",le="0.1"} 1' in text
+    assert 'latency_bucket{route="/a",le="1.0"} 2' in text
+    assert 'latency_bucket{route="/a",le="+Inf"} 3' in text
+    assert 'latency_count{route="/a"} 3' in text
+    assert text.count('# TYPE latency histogram') == 1
+
+
+def test_counters_are_kept_per_label_set():
+    metrics = Metrics()
+    metrics.inc('requests_total', status=200)
+    metrics.inc('requests_total', status=200)
+    metrics.inc('requests_total', status=500)
+
+    text = metrics.render()
+    assert 'requests_total{status="200"} 2' in text
+    assert 'requests_total{status="500"} 1' in text
+
+
+def test_stages_accumulate_into_the_current_trace():
+    start_trace()
+    with stage('decode'):
+        pass
+    with stage('decode'):
+        pass
+    with stage('encode'):
+        pass
+
+    stages = end_trace()
+    assert set(stages) == {'decode', 'encode'}
+    assert end_trace() == {}
+
+
+def test_workers_sharing_a_store_report_host_wide_totals(tmp_path):
+    worker_a = Metrics(buckets=(1.0,), store=SQLiteMetricsStore(str(tmp_path / 'metrics.db')))
+    worker_b = Metrics(buckets=(1.0,), store=SQLiteMetricsStore(str(tmp_path / 'metrics.db')))
+    worker_a.inc('requests_total', route='/a')
+    worker_a.observe('latency', 0.5)
+    worker_a.flush(force=True)
+    worker_b.inc('requests_total', route='/a')
+    worker_b.observe('latency', 2.0)
+    worker_b.set_gauge('queue_depth', 3)
+
+    text = worker_b.render()
+    assert 'requests_total{route="/a"} 2' in text
+    assert 'latency_bucket{le="1.0"} 1' in text
+    assert 'latency_count 2' in text
+    assert 'queue_depth 3' in text
+    assert 'queue_depth' not in worker_a.render()  # gauges stay per worker
+
+
+def test_counts_of_exited_workers_are_kept(tmp_path):
+    path = str(tmp_path / 'metrics.db')
+    code = (
+        'from metrics import Metrics, SQLiteMetricsStore\n'
+        f'metrics = Metrics(store=SQLiteMetricsStore({path!r}))\n'
+        'metrics.inc("requests_total", 5)\n'
+        'metrics.flush(force=True)\n'
+    )
+    for _ in range(2):
+        subprocess.run([sys.executable, '-c', code], check=True)
+
+    metrics = Metrics(store=SQLiteMetricsStore(path))
+    metrics.inc('requests_total')
+    assert 'requests_total 11' in metrics.render()
+    assert 'requests_total 11' in metrics.render()  # folded once, not twice
@@ -0,0 +1,47 @@
+from PIL import Image
+
+from pipeline import fill_background
+
+
+def cutout(size=(60, 80)):
+    """Red subject on a transparent background with a soft (gradient) edge"""
+    img = Image.new('RGBA', size, (200, 30, 30, 255))
+    img.putalpha(Image.linear_gradient('L').resize(size))
+    return img
+
+
+def reference_fill(img, bg_color):
+    """The original compositing: RGBA canvas, paste through the alpha, to RGB"""
+    background = Image.new('RGBA', img.size, bg_color)
+    img = img.convert('RGBA')
+    background.paste(img, (0, 0), img)
+    return background.convert('RGB')
+
+
+def test_opaque_rgb_is_returned_untouched():
+    img = Image.new('RGB', (40, 40), 'blue')
+    assert fill_background(img, '#FFFFFF') is img
+
+
+def test_fully_opaque_alpha_skips_compositing():
+    img = Image.new('RGBA', (40, 40), (10, 20, 30, 255))
+    result = fill_background(img, '#FFFFFF')
+    assert result.mode == 'RGB'
+    assert result.getpixel((0, 0)) == (10, 20, 30)
+
+
+def test_transparent_matches_reference_compositing():
+    for mode in ('RGBA', 'LA'):
+        img = cutout().convert(mode)
+        for color in ('#FFFFFF', '#3366CC'):
+            assert fill_background(img, color).tobytes() == reference_fill(img, color).tobytes()
+
+
+def test_feather_softens_the_edge():
+    img = Image.new('RGBA', (40, 40), (0, 0, 0, 0))
+    img.paste((0, 0, 0, 255), (20, 0, 40, 40))
+
+    hard = fill_background(img, '#FFFFFF')
+    soft = fill_background(img, '#FFFFFF', feather=3)
+    assert hard.getpixel((19, 20)) == (255, 255, 255)
+    assert 0 < soft.getpixel((19, 20))[0] < 255
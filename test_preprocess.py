@@ -0,0 +1,71 @@
+import io
+
+from PIL import Image, ImageFilter
+
+from preprocess import target_size, preprocess_upload
+
+PASSPORT_PX = (360, 420)  # 1.2x1.4in at 300 DPI
+
+
+def encoded(img, format, **params):
+    buffered = io.BytesIO()
+    img.save(buffered, format=format, **params)
+    return buffered.getvalue()
+
+
+def test_target_size_per_quality_tier():
+    # Covering the frame at the editor's 3x zoom needs 0.36x of a 3000x4000 photo
+    assert target_size((3000, 4000), PASSPORT_PX, 'high') == (1080, 1440)
+    assert target_size((3000, 4000), PASSPORT_PX, 'medium') == (810, 1080)
+    assert target_size((3000, 4000), PASSPORT_PX, 'low') == (540, 720)
+
+
+def test_target_size_never_upscales():
+    assert target_size((600, 700), PASSPORT_PX, 'high') == (600, 700)
+
+
+def test_small_upload_is_passed_through():
+    upload = encoded(Image.new('RGB', (600, 700), 'gray'), 'JPEG')
+    output, target, stats = preprocess_upload(upload, PASSPORT_PX)
+
+    assert output == upload
+    assert target == (600, 700)
+    assert stats['resized'] is False
+    assert stats['bytes_saved'] == 0
+
+
+def test_upload_that_would_not_shrink_is_passed_through():
+    # A flat PNG is a few KB; the downscaled JPEG would be bigger
+    upload = encoded(Image.new('RGB', (1500, 2000), 'gray'), 'PNG')
+    output, target, stats = preprocess_upload(upload, PASSPORT_PX)
+
+    assert output == upload
+    assert target == (1080, 1440)  # the cutout is still resized afterwards
+    assert (stats['resized'], stats['bytes_out'], stats['bytes_saved']) == (False, len(upload), 0)
+
+
+def test_large_photo_is_downscaled_and_savings_reported():
+    photo = Image.effect_noise((3000, 4000), 40).convert('RGB').filter(ImageFilter.GaussianBlur(2))
+    upload = encoded(photo, 'JPEG')
+
+    output, target, stats = preprocess_upload(io.BytesIO(upload), PASSPORT_PX, 'medium')
+
+    assert Image.open(io.BytesIO(output)).size == target == (810, 1080)
+    assert stats['resized'] is True
+    assert stats['bytes_in'] == len(upload)
+    assert stats['bytes_out'] == len(output)
+    assert stats['bytes_saved'] == len(upload) - len(output) > 0
+
+
+def test_rotated_upload_is_sent_upright():
+    # Stored 600x400, shown 400x600 (EXIF orientation 6): small enough, but must not be passed through
+    img = Image.new('RGB', (600, 400), 'red')
+    exif = img.getexif()
+    exif[0x0112] = 6
+    upload = encoded(img, 'JPEG', exif=exif)
+
+    output, target, stats = preprocess_upload(upload, PASSPORT_PX)
+
+    assert output != upload
+    assert Image.open(io.BytesIO(output)).size == target == (400, 600)
+    assert stats['resized'] is True
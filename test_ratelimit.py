@@ -0,0 +1,64 @@
+import pytest
+
+from ratelimit import (
+    RateLimiter, QuotaLedger, MemoryStore, SQLiteStore, RateLimited, QuotaExhausted, refill, current_period
+)
+
+
+def test_bucket_allows_a_burst_then_refills():
+    tokens, retry_after = 2, 0
+    for _ in range(2):
+        tokens, retry_after = refill(tokens, 0, capacity=2, rate=0.5, now=0)
+        assert retry_after == 0
+    tokens, retry_after = refill(tokens, 0, capacity=2, rate=0.5, now=0)
+    assert retry_after == pytest.approx(2)
+
+    # Two seconds later one token is back, never more than capacity
+    assert refill(tokens, 0, capacity=2, rate=0.5, now=2)[1] == 0
+    assert refill(0, 0, capacity=2, rate=0.5, now=1000)[0] == 1
+
+
+def test_limiter_is_per_client():
+    limiter = RateLimiter(MemoryStore(), burst=1, per_minute=1)
+    limiter.check('1.1.1.1')
+    limiter.check('2.2.2.2')
+    with pytest.raises(RateLimited) as exc:
+        limiter.check('1.1.1.1')
+    assert 55 < exc.value.retry_after <= 60
+
+
+def test_sqlite_store_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / 'limits.db')
+    worker_a = RateLimiter(SQLiteStore(path), burst=2, per_minute=1)
+    worker_b = RateLimiter(SQLiteStore(path), burst=2, per_minute=1)
+
+    worker_a.check('client')
+    worker_b.check('client')
+    with pytest.raises(RateLimited):
+        worker_a.check('client')
+
+
+@pytest.mark.parametrize('store', ['memory', 'sqlite'])
+def test_ledger_charge_refund_and_exhaust(store, tmp_path):
+    ledger = QuotaLedger(MemoryStore() if store == 'memory' else SQLiteStore(str(tmp_path / 'q.db')), monthly_limit=2)
+
+    ledger.charge()
+    ledger.charge()
+    with pytest.raises(QuotaExhausted):
+        ledger.charge()
+
+    ledger.refund()
+    assert ledger.stats()['used'] == 1
+    ledger.charge()
+
+    ledger.refund()
+    ledger.exhaust()  # upstream answered 402/403
+    with pytest.raises(QuotaExhausted):
+        ledger.charge()
+
+
+def test_period_rolls_over_at_month_end():
+    # 2026-12-31 23:00 UTC
+    period, retry_after = current_period(1798758000)
+    assert period == '2026-12'
+    assert retry_after == 3600
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+import requests
+
+from removebg import RemoveBgClient, CircuitOpenError
+from removebg_stub import RemoveBgStub
+
+
+@pytest.fixture
+def stub():
+    with RemoveBgStub() as server:
+        yield server
+
+
+def make_client(stub, **kwargs):
+    kwargs.setdefault('backoff_factor', 0)
+    return RemoveBgClient('test-key', api_url=stub.url, timeout=5, **kwargs)
+
+
+def test_success_returns_png(stub):
+    response = make_client(stub).remove_background(b'not really an image')
+    assert response.status_code == 200
+    assert response.content.startswith(b'\x89PNG')
+
+
+def test_connections_are_kept_alive(stub):
+    client = make_client(stub)
+    for _ in range(3):
+        assert client.remove_background(b'x').status_code == 200
+    client_ports = {address[1] for _, _, address in stub.requests}
+    assert len(client_ports) == 1
+
+
+def test_retries_transient_5xx(stub):
+    stub.push(503)
+    stub.push(502)
+    response = make_client(stub, max_retries=3).remove_background(b'x')
+    assert response.status_code == 200
+    assert len(stub.requests) == 3
+
+
+def test_honors_retry_after(stub):
+    stub.push(429, headers={'Retry-After': '1'})
+    start = time.monotonic()
+    response = make_client(stub).remove_background(b'x')
+    assert response.status_code == 200
+    assert time.monotonic() - start >= 1
+
+
+def test_quota_errors_are_not_retried(stub):
+    stub.push(402, b'{"errors": []}')
+    response = make_client(stub).remove_background(b'x')
+    assert response.status_code == 402
+    assert len(stub.requests) == 1
+
+
+def test_circuit_opens_and_fails_fast(stub):
+    client = make_client(stub, max_retries=0, breaker_threshold=2, breaker_reset=60)
+    stub.push(500)
+    stub.push(500)
+    client.remove_background(b'x')
+    client.remove_background(b'x')
+
+    with pytest.raises(CircuitOpenError):
+        client.remove_background(b'x')
+    assert len(stub.requests) == 2
+
+
+def test_circuit_half_open_trial_closes_it(stub):
+    client = make_client(stub, max_retries=0, breaker_threshold=1, breaker_reset=0.2)
+    stub.push(500)
+    client.remove_background(b'x')
+    assert client.breaker.state == 'open'
+
+    time.sleep(0.25)
+    assert client.remove_background(b'x').status_code == 200
+    assert client.breaker.state == 'closed'
+
+
+def test_connection_errors_count_as_failures():
+    client = RemoveBgClient('k', api_url='http://127.0.0.1:9', max_retries=0,
+                            backoff_factor=0, breaker_threshold=1, timeout=1)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.remove_background(b'x')
+    with pytest.raises(CircuitOpenError):
+        client.remove_background(b'x')
@@ -0,0 +1,55 @@
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+from segmentation import LocalBackend, RemovalError, np
+
+pytestmark = pytest.mark.skipif(np is None, reason='LocalBackend needs numpy')
+
+BACKDROP = (236, 238, 240)
+
+
+def studio_photo(size=(400, 500)):
+    """Plain backdrop, a dark subject touching the bottom edge, and a backdrop-coloured patch inside it"""
+    img = Image.new('RGB', size, BACKDROP)
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((130, 60, 270, 220), fill=(150, 100, 80))  # head
+    draw.rectangle((80, 220, 320, 500), fill=(40, 50, 90))  # shoulders, cut by the bottom edge
+    draw.rectangle((160, 300, 240, 420), fill=BACKDROP)  # white shirt, same colour as the wall
+    buffered = io.BytesIO()
+    img.save(buffered, format='PNG')
+    return buffered.getvalue()
+
+
+def test_local_matte_keeps_the_subject_and_clears_the_border():
+    cutout = LocalBackend().remove_background(studio_photo())
+    assert cutout.mode == 'RGBA'
+    assert cutout.size == (400, 500)
+
+    alpha = cutout.getchannel('A')
+    for point in [(5, 5), (395, 5), (5, 300), (395, 300), (60, 480), (200, 20)]:
+        assert alpha.getpixel(point) == 0, point
+    for point in [(200, 140), (100, 400), (300, 250)]:
+        assert alpha.getpixel(point) == 255, point
+
+    # Backdrop-coloured but not connected to the border: stays opaque
+    assert alpha.getpixel((200, 360)) == 255
+
+
+def test_invalid_image_is_a_400():
+    with pytest.raises(RemovalError) as exc:
+        LocalBackend().remove_background(b'not an image')
+    assert exc.value.status_code == 400
+
+
+def test_exif_orientation_is_applied():
+    img = Image.open(io.BytesIO(studio_photo())).transpose(Image.ROTATE_90)  # stored sideways
+    exif = img.getexif()
+    exif[0x0112] = 8  # rotate 90 degrees counter-clockwise back to upright
+    buffered = io.BytesIO()
+    img.save(buffered, format='PNG', exif=exif)
+
+    cutout = LocalBackend().remove_background(buffered.getvalue())
+    assert cutout.size == (400, 500)
+    assert cutout.getchannel('A').getpixel((200, 140)) == 255